@@ -0,0 +1,156 @@
+import argparse
+import datetime
+import os
+import shutil
+import sys
+import time
+from typing import *
+
+from experience_tracker.backends import make_backend
+
+
+def migrate(source: str, destination: str):
+    """ copy every table and the blob store of `source` into `destination`, document ids are preserved """
+    start = time.time()
+    src = make_backend(source)
+    dst = make_backend(destination)
+
+    for name in src.tables:
+        target = dst.table(name)
+        if len(target) != 0:
+            raise RuntimeError('Destination table `{}` is not empty'.format(name))
+
+        docs = src.table(name).all()
+        target.insert_many(docs)
+        print('{:>15}: {} documents'.format(name, len(docs)))
+
+    dst.compact()
+
+    if os.path.isdir(src.location + '.blobs'):
+        shutil.copytree(src.location + '.blobs', dst.location + '.blobs', dirs_exist_ok=True)
+
+    src.close()
+    dst.close()
+    print('Migrated {} to {} in {:.2f} s'.format(source, destination, time.time() - start))
+
+
+def compact(location: str, keep_last: int = None, drop_outputs_after: float = None, grace: float = 3600):
+    """ apply the retention policies, fold the pending writes (journal) and reclaim the unused space """
+    from experience_tracker.database import ExperienceDatabase
+    import experience_tracker.maintenance as maintenance
+
+    start = time.time()
+    db = ExperienceDatabase(location)
+    before = maintenance.disk_usage(db)
+
+    drop_after = None
+    if drop_outputs_after is not None:
+        drop_after = datetime.timedelta(days=drop_outputs_after)
+
+    report = maintenance.compact(db, keep_last=keep_last, drop_outputs_after=drop_after, grace=grace)
+    after = maintenance.disk_usage(db)
+    db.close()
+
+    print('    removed observations: {}'.format(report['removed_observations']))
+    print('         dropped outputs: {}'.format(report['dropped_outputs']))
+    print('           removed blobs: {}'.format(report['removed_blobs']))
+    print('                    size: {:.2f} Mio -> {:.2f} Mio ({:.2f} Mio reclaimed)'.format(
+        before / 1024 ** 2, after / 1024 ** 2, (before - after) / 1024 ** 2))
+    print('Compacted {} in {:.2f} s'.format(location, time.time() - start))
+
+
+def export(location: str, output: str, fmt: str = 'npz'):
+    """ append the observations added since the last export to the columnar tables in `output` """
+    from experience_tracker.database import ExperienceDatabase
+    import experience_tracker.export as columnar
+
+    start = time.time()
+    db = ExperienceDatabase(location)
+    report = columnar.export(db, output, fmt)
+    db.close()
+
+    print('            observations: {}'.format(report['observations']))
+    print('             metric rows: {}'.format(report['metrics']))
+    print('             kernel rows: {}'.format(report['kernels']))
+    print('             window rows: {}'.format(report['windows']))
+    print('Exported {} to {} in {:.2f} s'.format(location, output, time.time() - start))
+
+
+def recover(location: str, paths: List[str] = None, force: bool = False, keep: bool = False):
+    """ insert the partial observations of the runs that did not finish, saved by `LocalTrackLogger.checkpoint` """
+    from experience_tracker.database import ExperienceDatabase
+    import experience_tracker.checkpoint as checkpoint
+
+    start = time.time()
+    db = ExperienceDatabase(location)
+    recovered = 0
+
+    for path in paths or checkpoint.pending(location):
+        header, reports, checkpoints = checkpoint.read_checkpoint(path)
+
+        if header is None:
+            print('{:>40}: empty, skipped'.format(os.path.basename(path)))
+            continue
+
+        if checkpoint.is_running(header) and not force:
+            print('{:>40}: process {} is still running, skipped (use --force)'.format(
+                os.path.basename(path), header['pid']))
+            continue
+
+        checkpoint.recover(db, path, remove=not keep)
+        recovered += 1
+        print('{:>40}: {} namespaces, {} checkpoints'.format(os.path.basename(path), len(reports), checkpoints))
+
+    db.close()
+    print('Recovered {} observations in {:.2f} s'.format(recovered, time.time() - start))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Maintenance commands for the experiment database')
+    commands = parser.add_subparsers(dest='command')
+
+    cmd = commands.add_parser('migrate', help='Convert a database to another backend (e.g. TinyDB to SQLite)')
+    cmd.add_argument('source', help='path or URL of the database to read from')
+    cmd.add_argument('destination', help='path or URL of the database to write to (e.g. sqlite://benchmark.sqlite)')
+
+    cmd = commands.add_parser('compact', help='Apply retention policies and rewrite the database compactly')
+    cmd.add_argument('database', help='path or URL of the database')
+    cmd.add_argument('--keep-last', type=int, default=None, metavar='N',
+                     help='only keep the N most recent observations of each program/system')
+    cmd.add_argument('--drop-outputs-after', type=float, default=None, metavar='DAYS',
+                     help='remove stdout/stderr of the observations older than DAYS days')
+    cmd.add_argument('--grace', type=float, default=3600, metavar='SECONDS',
+                     help='keep unreferenced blobs written in the last SECONDS seconds (default: 3600)')
+
+    cmd = commands.add_parser('export',
+                              help='Export new observations to columnar files (metrics, windows and nvprof tables)')
+    cmd.add_argument('database', help='path or URL of the database')
+    cmd.add_argument('output', help='folder receiving the exported parts, exports are incremental')
+    cmd.add_argument('--format', default='npz', choices=['npz', 'parquet'],
+                     help='file format, parquet requires pyarrow (default: npz)')
+
+    cmd = commands.add_parser('recover', help='Save the observations of the runs that crashed from their checkpoints')
+    cmd.add_argument('database', help='path or URL of the database')
+    cmd.add_argument('checkpoints', nargs='*',
+                     help='checkpoint files to recover (default: all the files in <database>.checkpoints/)')
+    cmd.add_argument('--force', action='store_true', default=False,
+                     help='recover the runs whose process is still alive as well')
+    cmd.add_argument('--keep', action='store_true', default=False, help='do not remove the checkpoint files')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'migrate':
+        migrate(args.source, args.destination)
+    elif args.command == 'compact':
+        compact(args.database, args.keep_last, args.drop_outputs_after, args.grace)
+    elif args.command == 'export':
+        export(args.database, args.output, args.format)
+    elif args.command == 'recover':
+        recover(args.database, args.checkpoints, args.force, args.keep)
+    else:
+        parser.print_help()
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+import asyncio
+import json
+import os
+import threading
+from typing import *
+
+from experience_tracker.local_server import Collector
+from experience_tracker.transport import FRAME, STATUS, unpack_records
+
+# HTTP status line of the replies
+REASONS = {
+    204: 'No Content',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+}
+
+
+class AsyncLocalServer:
+    """
+        Collect the metrics of the tracked program in the tracker process: an asyncio event loop, running in a
+        background thread, serves the unix socket of the job (binary batches, see `transport.pack_records`) and/or the
+        HTTP routes of `LocalServer` on `port`. Many producers can be connected at the same time, their records
+        are applied to a single `Collector` by the event loop so no lock is needed.
+
+        `stop()` returns the namespaces so the tracker can save them in the `Observation`
+    """
+
+    def __init__(self, path: str = None, port: int = None, collector: Collector = None):
+        if path is None and port is None:
+            raise ValueError('Expected a unix socket path or a port')
+
+        self.path = path
+        self.port = port
+        self.collector = collector or Collector()
+
+        self.loop: asyncio.AbstractEventLoop = None
+        self.stopping: asyncio.Event = None
+        self.thread: threading.Thread = None
+        self.ready = threading.Event()
+        self.error: Exception = None
+        # tasks serving the connected producers
+        self.connections: Set[asyncio.Task] = set()
+
+        self.records = 0
+        self.batches = 0
+        self.errors = 0
+
+    @property
+    def namespaces(self) -> Dict[str, Dict[str, Any]]:
+        return self.collector.namespaces
+
+    def start(self) -> 'AsyncLocalServer':
+        """ start the event loop and wait until the servers are listening """
+        self.thread = threading.Thread(target=asyncio.run, args=(self._main(),), name='AsyncLocalServer', daemon=True)
+        self.thread.start()
+        self.ready.wait()
+
+        if self.error is not None:
+            raise self.error
+
+        return self
+
+    def stop(self, timeout: float = 10) -> Dict[str, Dict[str, Any]]:
+        """ close the servers and the connections, returns the namespaces """
+        if self.thread is not None and self.thread.is_alive():
+            self.loop.call_soon_threadsafe(self.stopping.set)
+            self.thread.join(timeout)
+
+        return self.namespaces
+
+    async def _main(self):
+        self.loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        servers = []
+
+        try:
+            if self.path is not None:
+                if os.path.exists(self.path):
+                    os.unlink(self.path)
+                servers.append(await asyncio.start_unix_server(self._serve_socket, self.path))
+
+            if self.port is not None:
+                server = await asyncio.start_server(self._serve_http, 'localhost', self.port)
+                # port 0 picks a free port
+                self.port = server.sockets[0].getsockname()[1]
+                servers.append(server)
+
+        except Exception as e:
+            self.error = e
+            for server in servers:
+                server.close()
+            self.ready.set()
+            return
+
+        self.ready.set()
+        await self.stopping.wait()
+
+        for server in servers:
+            server.close()
+
+        # the producers that are still connected
+        for task in list(self.connections):
+            task.cancel()
+        await asyncio.gather(*self.connections, return_exceptions=True)
+
+        for server in servers:
+            await server.wait_closed()
+
+        if self.path is not None and os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def _apply(self, records: List[Dict]):
+        self.collector.apply(records)
+        self.records += len(records)
+        self.batches += 1
+
+    async def _serve_socket(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """ batches of binary records, each batch is acknowledged (see `transport.uds_sender`) """
+        self.connections.add(asyncio.current_task())
+
+        try:
+            while True:
+                size, count = FRAME.unpack(await reader.readexactly(FRAME.size))
+                payload = await reader.readexactly(size)
+
+                try:
+                    self._apply(unpack_records(payload, count))
+                    writer.write(STATUS.pack(0, 0))
+                except Exception as e:
+                    self.errors += 1
+                    message = str(e).encode('utf-8')
+                    writer.write(STATUS.pack(1, len(message)) + message)
+
+                await writer.drain()
+
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            # the producer exited or the server is stopped
+            pass
+        finally:
+            self.connections.discard(asyncio.current_task())
+            writer.close()
+
+    async def _serve_http(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """ HTTP/1.1 with keep-alive, only the JSON POST routes of `LocalServer` """
+        self.connections.add(asyncio.current_task())
+
+        try:
+            while True:
+                head = await reader.readuntil(b'\r\n\r\n')
+                request_line, *lines = head.decode('latin-1').rstrip('\r\n').split('\r\n')
+                method, path, _ = request_line.split(' ', 2)
+
+                headers = {}
+                for line in lines:
+                    name, _, value = line.partition(':')
+                    headers[name.strip().lower()] = value.strip()
+
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                status, message = self._route(method, path, body)
+
+                message = message.encode('utf-8')
+                reply = 'HTTP/1.1 {} {}\r\n'.format(status, REASONS[status])
+
+                # no content with 204
+                if status != 204:
+                    reply += 'Content-Length: {}\r\nContent-Type: text/plain\r\n'.format(len(message))
+
+                writer.write((reply + '\r\n').encode('latin-1') + message)
+                await writer.drain()
+
+                if headers.get('connection', '').lower() == 'close':
+                    return
+
+        except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.connections.discard(asyncio.current_task())
+            writer.close()
+
+    def _route(self, method: str, path: str, body: bytes) -> Tuple[int, str]:
+        if method != 'POST':
+            return 405, ''
+
+        route = path.strip('/').split('/')
+
+        try:
+            record = json.loads(body or b'null')
+
+            if route == ['batch']:
+                records = record['records']
+            elif route in (['merge'], ['push']):
+                records = [dict(record, kind=route[0])]
+            elif len(route) == 2 and route[0] == 'float':
+                records = [dict(record, kind=route[1])]
+            elif route in (['program'], ['system']):
+                # nothing is done with them, see `LocalServer.set_program`
+                return 204, ''
+            else:
+                return 404, 'unknown route `{}`'.format(path)
+
+            # only the unknown streams are not found, missing fields are bad requests
+            unknown = self.collector.unknown_streams(records)
+            if unknown:
+                self.errors += 1
+                return 404, 'unknown streams `{}`'.format(', '.join(unknown))
+
+            self._apply(records)
+
+        except Exception as e:
+            self.errors += 1
+            return 400, 'malformed request: {!r}'.format(e)
+
+        return 204, ''
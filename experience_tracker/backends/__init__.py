@@ -0,0 +1,56 @@
+import os
+from typing import *
+
+from experience_tracker.backends.base import Backend, Table, INDEXES
+
+SQLITE_EXTENSIONS = {'.sqlite', '.sqlite3', '.sqlitedb'}
+SQLITE_HEADER = b'SQLite format 3\x00'
+
+
+def parse_location(location: str) -> Tuple[str, str]:
+    """
+        Resolve a database location to a `(backend_name, path)` tuple.
+
+        Locations can be URLs `sqlite://path/to/file.db`, `tinydb://path/to/file.json` (use three slashes for
+        absolute paths: `sqlite:///tmp/benchmark.db`) or plain paths.
+        For plain paths the backend is selected from the file content if it exists and from its extension otherwise
+    """
+    if '://' in location:
+        scheme, path = location.split('://', 1)
+        if scheme not in BACKENDS:
+            raise ValueError('Unknown database backend `{}` (expected one of {})'.format(scheme, list(BACKENDS)))
+        return scheme, path
+
+    if os.path.isfile(location) and os.path.getsize(location) > 0:
+        with open(location, 'rb') as file:
+            if file.read(len(SQLITE_HEADER)) == SQLITE_HEADER:
+                return 'sqlite', location
+        return 'tinydb', location
+
+    if os.path.splitext(location)[1] in SQLITE_EXTENSIONS:
+        return 'sqlite', location
+
+    return 'tinydb', location
+
+
+def make_tinydb_backend(path: str) -> Backend:
+    # TinyDB rewrites the whole file on every write, writes are appended to a journal instead
+    from experience_tracker.backends.tinydb_backend import TinyBackend
+    from experience_tracker.backends.journal import JournalBackend
+    return JournalBackend(TinyBackend(path))
+
+
+def make_sqlite_backend(path: str) -> Backend:
+    from experience_tracker.backends.sqlite_backend import SQLiteBackend
+    return SQLiteBackend(path)
+
+
+BACKENDS: Dict[str, Callable[[str], Backend]] = {
+    'tinydb': make_tinydb_backend,
+    'sqlite': make_sqlite_backend,
+}
+
+
+def make_backend(location: str) -> Backend:
+    name, path = parse_location(location)
+    return BACKENDS[name](path)
@@ -0,0 +1,142 @@
+import itertools
+import os
+from contextlib import contextmanager
+from typing import *
+
+
+# Columns that are looked up directly by the explorers, backends that support it should index them
+INDEXES: Dict[str, Tuple[str, ...]] = {
+    'programs': ('uid', 'name'),
+    'systems': ('uid', 'hostname'),
+    'observations': ('program_uid', 'system_uid'),
+}
+
+
+class Table:
+    """
+        A collection of JSON documents.
+        Every document gets an integer `id` when it is inserted (unless it already has one)
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def insert(self, doc: Dict) -> int:
+        return self.insert_many([doc])[0]
+
+    def insert_many(self, docs: List[Dict]) -> List[int]:
+        raise NotImplementedError()
+
+    def update(self, doc: Dict):
+        """ replace the document that has the same `id` """
+        raise NotImplementedError()
+
+    def upsert_many(self, docs: List[Dict]):
+        """ insert or replace documents that already have an `id` """
+        existing = {doc['id'] for doc in self.all()}
+
+        self.insert_many([doc for doc in docs if doc['id'] not in existing])
+        for doc in docs:
+            if doc['id'] in existing:
+                self.update(doc)
+
+    def remove(self, ids: List[int]):
+        """ delete the documents with those ids, unknown ids are ignored """
+        raise NotImplementedError()
+
+    def next_id(self) -> int:
+        return max((doc.get('id', -1) for doc in self.all()), default=-1) + 1
+
+    def search(self, **fields) -> List[Dict]:
+        """ return the documents matching all the `field == value` conditions """
+        raise NotImplementedError()
+
+    def all(self) -> List[Dict]:
+        return self.search()
+
+    def scan(self, fields: List[str] = None, after: int = None, **conditions) -> Iterator[Dict]:
+        """
+            Iterate over the documents matching `conditions` in `id` order, starting after the id `after`.
+            If `fields` is given only those fields (and `id`) are returned.
+            Backends should override this to avoid loading every matching document at once
+        """
+        docs = sorted(self.search(**conditions), key=lambda doc: doc['id'])
+
+        for doc in docs:
+            if after is None or doc['id'] > after:
+                yield project(doc, fields)
+
+    def iterate(self, fields: List[str] = None, limit: int = None, offset: int = 0, after: int = None,
+                **conditions) -> Iterator[Dict]:
+        """ generator over the matching documents with `limit`/`offset` and cursor (`after`) paging """
+        stop = None if limit is None else offset + limit
+        return itertools.islice(self.scan(fields, after, **conditions), offset, stop)
+
+    def page(self, size: int, fields: List[str] = None, after: int = None,
+             **conditions) -> Tuple[List[Dict], Optional[int]]:
+        """ returns a page of documents and the cursor of the next page (None if this is the last one) """
+        docs = list(self.iterate(fields, limit=size, after=after, **conditions))
+        cursor = docs[-1]['id'] if len(docs) == size else None
+        return docs, cursor
+
+    def __len__(self) -> int:
+        raise NotImplementedError()
+
+    def __iter__(self):
+        return iter(self.all())
+
+
+class Backend:
+    """
+        Storage used by the ExperienceDatabase, holds the `programs`, `systems` and `observations` tables
+    """
+    tables = tuple(INDEXES.keys())
+
+    def __init__(self, location: str):
+        self.location = location
+
+    def table(self, name: str) -> Table:
+        raise NotImplementedError()
+
+    def data_version(self):
+        """
+            Value that changes when the database is modified by someone else (another process or connection),
+            it is used to know when cached data must be reloaded
+        """
+        try:
+            stat = os.stat(self.location)
+            return stat.st_mtime_ns, stat.st_size
+        except FileNotFoundError:
+            return None
+
+    @contextmanager
+    def transaction(self):
+        """ group the writes made inside the context in a single atomic write, transactions can be nested """
+        yield
+
+    def compact(self):
+        """ fold pending writes into the main store and reclaim the unused space """
+        pass
+
+    def files(self) -> List[str]:
+        """ files used by the backend """
+        return [self.location]
+
+    def close(self):
+        pass
+
+
+def project(doc: Dict, fields: Optional[List[str]]) -> Dict:
+    if fields is None:
+        return doc
+
+    result = {key: doc[key] for key in fields if key in doc}
+    result['id'] = doc['id']
+    return result
+
+
+def matches(doc: Dict, fields: Dict) -> bool:
+    for key, value in fields.items():
+        if doc.get(key) != value:
+            return False
+    return True
@@ -0,0 +1,366 @@
+import heapq
+import json
+import os
+import uuid
+from contextlib import contextmanager
+from typing import *
+
+from experience_tracker.backends.base import Backend, Table, matches, project
+from experience_tracker.backends.lock import FileLock
+
+
+class Journal:
+    """
+        Append-only, line-delimited log of the writes that are not yet in the main store.
+        Each line is `{"table": name, "op": "insert" | "update" | "remove", "doc": {...}}`,
+        documents always carry their `id`.
+        Records written inside a transaction are grouped in a single `{"op": "batch", "records": [...]}` line
+        so they are applied all together or not at all.
+
+        Reading the journal is incremental: only the bytes appended since the last read are parsed.
+        The first line is a header holding a unique generation id, it changes every time the journal is truncated
+        so readers know they need to reload everything.
+
+        The journal does not lock anything itself, see `JournalBackend`
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.header = b''
+        self.offset = 0
+        self.records = 0
+        # latest version of each document written in the journal: table -> id -> doc (None if removed)
+        self.docs: Dict[str, Dict[int, Optional[Dict]]] = {}
+        # records of the transaction in progress
+        self.buffer: Optional[List[Dict]] = None
+        # incremented every time we read records we did not write ourselves
+        self.changes = 0
+
+    def reset(self):
+        self.header = b''
+        self.offset = 0
+        self.records = 0
+        self.docs = {}
+
+    def refresh(self) -> bool:
+        """ read the new records, returns True if the journal was truncated since the last call """
+        try:
+            size = os.path.getsize(self.path)
+        except FileNotFoundError:
+            size = 0
+
+        reloaded = False
+        if self.offset > 0 and (size < self.offset or not self._same_generation()):
+            self.reset()
+            reloaded = True
+
+        offset = self.offset
+        if size > self.offset:
+            self._read()
+
+        if reloaded or self.offset != offset:
+            self.changes += 1
+
+        if reloaded and self.buffer:
+            # keep the records of the transaction in progress visible
+            for record in self.buffer:
+                self._apply(record)
+
+        return reloaded
+
+    def _same_generation(self) -> bool:
+        with open(self.path, 'rb') as file:
+            return file.read(len(self.header)) == self.header
+
+    def _read(self):
+        with open(self.path, 'rb') as file:
+            file.seek(self.offset)
+            data = file.read()
+
+        # a writer might be in the middle of appending, only consume complete lines
+        end = data.rfind(b'\n') + 1
+        if self.offset == 0:
+            self.header = data[:data.find(b'\n') + 1]
+        self.offset += end
+
+        for line in data[:end].splitlines():
+            try:
+                record = json.loads(line.decode('utf-8'))
+            except ValueError:
+                # line torn by a writer that died mid-write
+                continue
+            self._apply(record)
+
+    def _apply(self, record: Dict):
+        if record['op'] == 'header':
+            return
+
+        if record['op'] == 'batch':
+            for rec in record['records']:
+                self._apply(rec)
+            return
+
+        table = record['table']
+        doc = record['doc']
+        op = record['op']
+
+        self.docs.setdefault(table, {})[doc['id']] = None if op == 'remove' else doc
+        self.records += 1
+
+    def append(self, table: str, op: str, docs: List[Dict]):
+        records = [{'table': table, 'op': op, 'doc': doc} for doc in docs]
+
+        if self.buffer is not None:
+            # visible to the reads of the transaction but only written on commit
+            self.buffer.extend(records)
+            for record in records:
+                self._apply(record)
+            return
+
+        self._write(records, applied=False)
+
+    def begin(self):
+        self.buffer = []
+
+    def commit(self):
+        records, self.buffer = self.buffer, None
+
+        try:
+            if len(records) == 1:
+                self._write(records, applied=True)
+            elif len(records) > 1:
+                self._write([{'op': 'batch', 'records': records}], applied=True)
+        except:
+            # nothing was written (e.g. a document is not serializable)
+            self.reset()
+            raise
+
+    def rollback(self):
+        self.buffer = None
+        # drop the records of the transaction applied in memory
+        self.reset()
+
+    @staticmethod
+    def _make_header() -> bytes:
+        return (json.dumps({'op': 'header', 'generation': uuid.uuid4().hex}) + '\n').encode('utf-8')
+
+    def _write(self, records: List[Dict], applied: bool):
+        data = ''.join(json.dumps(record) + '\n' for record in records).encode('utf-8')
+
+        # single write on a file opened in append mode, cost is proportional to the record size
+        with open(self.path, 'a+b') as file:
+            start = os.fstat(file.fileno()).st_size
+
+            if start == 0:
+                data = self._make_header() + data
+            else:
+                file.seek(start - 1)
+                if file.read(1) != b'\n':
+                    data = b'\n' + data
+
+            file.write(data)
+
+        if start == self.offset and start > 0:
+            # nobody else wrote since our last read, no need to parse our own records back
+            self.offset = start + len(data)
+            if not applied:
+                for record in records:
+                    self._apply(record)
+        else:
+            self.reset()
+            self.refresh()
+
+    def truncate(self):
+        header = self._make_header()
+        with open(self.path, 'wb') as file:
+            file.write(header)
+
+        self.reset()
+        self.header = header
+        self.offset = len(header)
+
+
+class JournalTable(Table):
+    def __init__(self, name: str, backend: 'JournalBackend'):
+        super(JournalTable, self).__init__(name)
+        self.backend = backend
+        self.inner = backend.inner.table(name)
+
+    @property
+    def pending(self) -> Dict[int, Dict]:
+        return self.backend.journal.docs.get(self.name, {})
+
+    def next_id(self) -> int:
+        return max([self.backend.base_id(self.name)] + [i + 1 for i in self.pending])
+
+    def insert_many(self, docs: List[Dict]) -> List[int]:
+        # ids must be allocated and written while holding the lock or two writers could pick the same
+        with self.backend.lock.exclusive():
+            self.backend.refresh()
+            next_id = self.next_id()
+            rows = []
+
+            for doc in docs:
+                doc = dict(doc)
+                if 'id' not in doc:
+                    doc['id'] = next_id
+                next_id = max(next_id, doc['id']) + 1
+                rows.append(doc)
+
+            self.backend.append(self.name, 'insert', rows)
+            return [row['id'] for row in rows]
+
+    def update(self, doc: Dict):
+        self.backend.append(self.name, 'update', [dict(doc)])
+
+    def upsert_many(self, docs: List[Dict]):
+        self.backend.append(self.name, 'update', [dict(doc) for doc in docs])
+
+    def remove(self, ids: List[int]):
+        self.backend.append(self.name, 'remove', [{'id': doc_id} for doc_id in ids])
+
+    def search(self, **fields) -> List[Dict]:
+        with self.backend.lock.shared():
+            self.backend.refresh()
+            pending = self.pending
+
+            docs = [doc for doc in self.inner.search(**fields) if doc['id'] not in pending]
+            docs.extend(dict(doc) for doc in pending.values() if doc is not None and matches(doc, fields))
+
+        docs.sort(key=lambda doc: doc['id'])
+        return docs
+
+    def scan(self, fields: List[str] = None, after: int = None, **conditions) -> Iterator[Dict]:
+        with self.backend.lock.shared():
+            self.backend.refresh()
+            pending = dict(self.pending)
+
+            # the lock cannot be held while the caller consumes the generator, make sure we read a consistent state
+            inner = [doc for doc in self.inner.scan(fields, after, **conditions) if doc['id'] not in pending]
+
+        journaled = sorted(
+            (project(dict(doc), fields) for doc in pending.values()
+             if doc is not None and matches(doc, conditions) and (after is None or doc['id'] > after)),
+            key=lambda doc: doc['id'])
+
+        return heapq.merge(inner, journaled, key=lambda doc: doc['id'])
+
+    def __len__(self) -> int:
+        with self.backend.lock.shared():
+            self.backend.refresh()
+            pending = self.pending
+
+            if not pending:
+                return len(self.inner)
+
+            # journaled ids can replace or remove a document of the main store, or none (new or unknown ids)
+            replaced = sum(1 for doc in self.inner.scan(['id'], after=min(pending) - 1) if doc['id'] in pending)
+            added = sum(1 for doc in pending.values() if doc is not None)
+            return len(self.inner) - replaced + added
+
+
+class JournalBackend(Backend):
+    """
+        Send all the writes to an append-only journal next to the database and merge it back when reading.
+        Every `compact_after` records the journal is folded into the main store (see `compact`)
+
+        Many processes can share the same database: writes and compactions hold an exclusive file lock,
+        reads hold a shared one
+    """
+
+    def __init__(self, inner: Backend, journal: str = None, compact_after: int = 1000):
+        super(JournalBackend, self).__init__(inner.location)
+        self.inner = inner
+        self.journal = Journal(journal or inner.location + '.journal')
+        self.lock = FileLock(inner.location + '.lock')
+        self.compact_after = compact_after
+        self._base_ids: Dict[str, int] = {}
+        self._tables: Dict[str, JournalTable] = {}
+        self.depth = 0
+
+    def base_id(self, name: str) -> int:
+        """ next id of the main store, it only changes when the journal is compacted """
+        if name not in self._base_ids:
+            self._base_ids[name] = self.inner.table(name).next_id()
+        return self._base_ids[name]
+
+    def refresh(self):
+        if self.journal.refresh():
+            self._base_ids = {}
+
+    def data_version(self):
+        # all the writes go through the journal (compactions truncate it), our own writes are not counted
+        with self.lock.shared():
+            self.refresh()
+            return self.journal.changes
+
+    def append(self, name: str, op: str, docs: List[Dict]):
+        if len(docs) == 0:
+            return
+
+        with self.lock.exclusive():
+            self.refresh()
+            self.journal.append(name, op, docs)
+
+            if self.depth == 0:
+                self._maybe_compact()
+
+    def _maybe_compact(self):
+        if self.compact_after is not None and self.journal.records >= self.compact_after:
+            self.compact()
+
+    @contextmanager
+    def transaction(self):
+        with self.lock.exclusive():
+            if self.depth == 0:
+                self.refresh()
+                self.journal.begin()
+
+            self.depth += 1
+            try:
+                yield
+            except:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.journal.rollback()
+                raise
+            else:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.journal.commit()
+                    self._maybe_compact()
+
+    def table(self, name: str) -> Table:
+        if name not in self._tables:
+            self._tables[name] = JournalTable(name, self)
+        return self._tables[name]
+
+    def compact(self):
+        """
+            Write the journaled documents in the main store and empty the journal.
+            Compaction is idempotent, if it is interrupted the journal is simply replayed again
+        """
+        with self.lock.exclusive():
+            self.refresh()
+
+            with self.inner.transaction():
+                for name, docs in self.journal.docs.items():
+                    table = self.inner.table(name)
+                    updated = [doc for doc in docs.values() if doc is not None]
+                    removed = [doc_id for doc_id, doc in docs.items() if doc is None]
+
+                    if updated:
+                        table.upsert_many(updated)
+                    if removed:
+                        table.remove(removed)
+
+            self.journal.truncate()
+            self._base_ids = {}
+            self.inner.compact()
+
+    def files(self) -> List[str]:
+        return self.inner.files() + [self.journal.path]
+
+    def close(self):
+        self.inner.close()
+        self.lock.close()
@@ -0,0 +1,72 @@
+import os
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # no inter-process locking on this platform, threads are still serialized
+    fcntl = None
+
+
+class FileLock:
+    """
+        Inter-process readers/writer lock backed by `flock` on `path`.
+        The lock is reentrant inside a process, holding the exclusive lock also grants the shared one.
+        Threads of a same process are serialized
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.fd = None
+        self.depth = 0
+        self.exclusive_held = False
+        self.thread_lock = threading.RLock()
+
+    @contextmanager
+    def shared(self):
+        self._acquire(exclusive=False)
+        try:
+            yield
+        finally:
+            self._release()
+
+    @contextmanager
+    def exclusive(self):
+        self._acquire(exclusive=True)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _acquire(self, exclusive: bool):
+        self.thread_lock.acquire()
+
+        if self.depth == 0:
+            if fcntl is not None:
+                if self.fd is None:
+                    self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o666)
+                fcntl.flock(self.fd, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            self.exclusive_held = exclusive
+
+        elif exclusive and not self.exclusive_held:
+            self.thread_lock.release()
+            # flock upgrades are not atomic, another writer could sneak in between our read and our write
+            raise RuntimeError('Cannot acquire the exclusive lock while holding the shared lock')
+
+        self.depth += 1
+
+    def _release(self):
+        self.depth -= 1
+
+        if self.depth == 0:
+            if fcntl is not None:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+            self.exclusive_held = False
+
+        self.thread_lock.release()
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
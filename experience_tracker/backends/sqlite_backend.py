@@ -0,0 +1,248 @@
+import json
+import sqlite3
+import threading
+from typing import *
+
+from experience_tracker.backends.base import Backend, Table, INDEXES, matches, project
+
+
+class SQLiteTable(Table):
+    """
+        Documents are stored as JSON text next to a few indexed columns extracted from the document.
+        Conditions on indexed columns (and `id`) are resolved by SQLite, the others are filtered in python
+    """
+
+    def __init__(self, name: str, backend: 'SQLiteBackend'):
+        super(SQLiteTable, self).__init__(name)
+        self.backend = backend
+        self.columns: Tuple[str, ...] = INDEXES.get(name, ())
+
+    def create(self, cursor):
+        columns = ''.join(', {} TEXT'.format(col) for col in self.columns)
+        cursor.execute('CREATE TABLE IF NOT EXISTS {} (id INTEGER PRIMARY KEY{}, doc TEXT NOT NULL)'.format(
+            self.name, columns))
+
+        for col in self.columns:
+            cursor.execute('CREATE INDEX IF NOT EXISTS {table}_{col} ON {table} ({col})'.format(
+                table=self.name, col=col))
+
+    def _row(self, doc: Dict) -> List:
+        doc = dict(doc)
+        doc.pop('id', None)
+        return [doc.get(col) for col in self.columns] + [json.dumps(doc)]
+
+    def next_id(self) -> int:
+        with self.backend.lock:
+            query = 'SELECT COALESCE(MAX(id), -1) + 1 FROM {}'.format(self.name)
+            return self.backend.conn.execute(query).fetchone()[0]
+
+    def insert_many(self, docs: List[Dict]) -> List[int]:
+        columns = ''.join(', {}'.format(col) for col in self.columns)
+        params = ', ?' * len(self.columns)
+        ids = []
+        rows = []
+
+        with self.backend.transaction() as cursor:
+            # ids start at 0 to stay compatible with the TinyDB databases
+            cursor.execute('SELECT COALESCE(MAX(id), -1) + 1 FROM {}'.format(self.name))
+            next_id = cursor.fetchone()[0]
+
+            for doc in docs:
+                doc_id = doc.get('id', next_id)
+                next_id = max(next_id, doc_id) + 1
+
+                rows.append([doc_id] + self._row(doc))
+                ids.append(doc_id)
+
+            cursor.executemany('INSERT INTO {} (id{}, doc) VALUES (?{}, ?)'.format(self.name, columns, params), rows)
+
+        return ids
+
+    def update(self, doc: Dict):
+        assignments = ''.join('{} = ?, '.format(col) for col in self.columns)
+
+        with self.backend.transaction() as cursor:
+            cursor.execute('UPDATE {} SET {}doc = ? WHERE id = ?'.format(self.name, assignments),
+                           self._row(doc) + [doc['id']])
+
+    def upsert_many(self, docs: List[Dict]):
+        columns = ''.join(', {}'.format(col) for col in self.columns)
+        params = ', ?' * len(self.columns)
+
+        with self.backend.transaction() as cursor:
+            cursor.executemany('INSERT OR REPLACE INTO {} (id{}, doc) VALUES (?{}, ?)'.format(
+                self.name, columns, params), [[doc['id']] + self._row(doc) for doc in docs])
+
+    def search(self, **fields) -> List[Dict]:
+        indexed = {k: v for k, v in fields.items() if k in self.columns or k == 'id'}
+        others = {k: v for k, v in fields.items() if k not in indexed}
+
+        query = 'SELECT id, doc FROM {}'.format(self.name)
+        if indexed:
+            query += ' WHERE ' + ' AND '.join('{} = ?'.format(k) for k in indexed)
+        query += ' ORDER BY id'
+
+        with self.backend.lock:
+            rows = self.backend.conn.execute(query, list(indexed.values())).fetchall()
+
+        docs = []
+        for doc_id, text in rows:
+            doc = json.loads(text)
+            doc['id'] = doc_id
+
+            if matches(doc, others):
+                docs.append(doc)
+
+        return docs
+
+    def remove(self, ids: List[int]):
+        with self.backend.transaction() as cursor:
+            cursor.executemany('DELETE FROM {} WHERE id = ?'.format(self.name), [[doc_id] for doc_id in ids])
+
+    def _select(self, needed: Optional[Set[str]]) -> Tuple[str, List, Callable]:
+        """ build the select expression that fetches the `needed` fields of the documents """
+        if needed is not None and needed <= set(self.columns):
+            # everything is in the indexed columns, no JSON to parse
+            def make_doc(row):
+                return {col: value for col, value in zip(self.columns, row[1:]) if col in needed}
+
+            return ', '.join(self.columns), [], make_doc
+
+        if needed is not None and self.backend.has_json:
+            # only extract the needed fields, large fields are never sent back to python
+            names = sorted(needed)
+            expr = 'json_object({})'.format(', '.join('?, json_extract(doc, ?)' for _ in names))
+            params = [p for name in names for p in (name, '$."{}"'.format(name))]
+
+            def make_doc(row):
+                return {k: v for k, v in json.loads(row[1]).items() if v is not None}
+
+            return expr, params, make_doc
+
+        return 'doc', [], lambda row: json.loads(row[1])
+
+    def scan(self, fields: List[str] = None, after: int = None, **conditions) -> Iterator[Dict]:
+        """ documents are fetched `page_size` rows at a time using keyset pagination on `id` """
+        indexed = {k: v for k, v in conditions.items() if k in self.columns or k == 'id'}
+        others = {k: v for k, v in conditions.items() if k not in indexed}
+
+        needed = None if fields is None else set(fields) | set(others)
+        expr, params, make_doc = self._select(needed)
+
+        query = 'SELECT id, {} FROM {} WHERE id > ?'.format(expr, self.name)
+        query += ''.join(' AND {} = ?'.format(k) for k in indexed)
+        query += ' ORDER BY id LIMIT ?'
+
+        last = -1 if after is None else after
+        while True:
+            with self.backend.lock:
+                rows = self.backend.conn.execute(
+                    query, params + [last] + list(indexed.values()) + [self.backend.page_size]).fetchall()
+
+            for row in rows:
+                doc = make_doc(row)
+                doc['id'] = row[0]
+
+                if matches(doc, others):
+                    yield project(doc, fields)
+
+            if len(rows) < self.backend.page_size:
+                return
+
+            last = rows[-1][0]
+
+    def __len__(self) -> int:
+        with self.backend.lock:
+            return self.backend.conn.execute('SELECT COUNT(*) FROM {}'.format(self.name)).fetchone()[0]
+
+
+class _Transaction:
+    """ only the outermost transaction commits (or rolls back) """
+
+    def __init__(self, backend: 'SQLiteBackend'):
+        self.backend = backend
+
+    def __enter__(self):
+        self.backend.lock.acquire()
+        try:
+            if self.backend.depth == 0:
+                # take the write lock right away so ids read inside the transaction cannot be taken by another process
+                self.backend.conn.execute('BEGIN IMMEDIATE')
+        except:
+            self.backend.lock.release()
+            raise
+
+        self.backend.depth += 1
+        return self.backend.conn.cursor()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            self.backend.depth -= 1
+
+            if self.backend.depth == 0:
+                if exc_type is None:
+                    self.backend.conn.execute('COMMIT')
+                else:
+                    self.backend.conn.execute('ROLLBACK')
+        finally:
+            self.backend.lock.release()
+
+
+class SQLiteBackend(Backend):
+    """
+        SQLite storage, lookups on `uid`, `name`, `hostname`, `program_uid` and `system_uid` use real indexes
+        and inserts only write the new rows.
+        Many processes can write to the same database, SQLite takes care of the locking
+    """
+
+    def __init__(self, location: str, page_size: int = 256):
+        super(SQLiteBackend, self).__init__(location)
+        self.page_size = page_size
+        # the explorer serves requests from multiple threads
+        # transactions are managed explicitly (see `_Transaction`), concurrent writers wait up to `timeout` seconds
+        self.conn = sqlite3.connect(location, timeout=60, check_same_thread=False, isolation_level=None)
+        self.lock = threading.RLock()
+        self.depth = 0
+
+        # readers (explorer) do not block the writers (trackers)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+
+        try:
+            self.conn.execute("SELECT json_object('a', json_extract('{}', '$.a'))")
+            self.has_json = True
+        except sqlite3.OperationalError:
+            # SQLite was built without the JSON1 extension, projections are done in python
+            self.has_json = False
+        self._tables = {name: SQLiteTable(name, self) for name in self.tables}
+
+        with self.transaction() as cursor:
+            for table in self._tables.values():
+                table.create(cursor)
+
+    def data_version(self):
+        # changes every time another connection commits, our own commits do not change it
+        with self.lock:
+            return self.conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def transaction(self) -> _Transaction:
+        return _Transaction(self)
+
+    def table(self, name: str) -> Table:
+        if name not in self._tables:
+            self._tables[name] = SQLiteTable(name, self)
+            with self.transaction() as cursor:
+                self._tables[name].create(cursor)
+
+        return self._tables[name]
+
+    def compact(self):
+        with self.lock:
+            self.conn.execute('VACUUM')
+            # VACUUM goes through the WAL, move everything back into the database file
+            self.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    def files(self) -> List[str]:
+        return [self.location, self.location + '-wal', self.location + '-shm']
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,159 @@
+from tinydb import TinyDB, where
+from tinydb.middlewares import Middleware
+from tinydb.storages import JSONStorage
+from contextlib import contextmanager
+from functools import reduce
+from typing import *
+
+from experience_tracker.backends.base import Backend, Table
+
+
+class TransactionMiddleware(Middleware):
+    """
+        While a transaction is open the file is read once and the writes are kept in memory,
+        they are flushed to the storage in a single write when the outermost transaction ends
+    """
+
+    def __init__(self, storage_cls=JSONStorage):
+        super(TransactionMiddleware, self).__init__(storage_cls)
+        self.depth = 0
+        self.cache = None
+        self.dirty = False
+
+    def read(self):
+        if self.depth == 0:
+            return self.storage.read()
+
+        if self.cache is None:
+            self.cache = self.storage.read()
+        return self.cache
+
+    def write(self, data):
+        if self.depth == 0:
+            return self.storage.write(data)
+
+        self.cache = data
+        self.dirty = True
+
+    def begin(self):
+        self.depth += 1
+
+    def end(self, commit: bool):
+        self.depth -= 1
+        if self.depth > 0:
+            return
+
+        if commit and self.dirty:
+            self.storage.write(self.cache)
+
+        self.cache = None
+        self.dirty = False
+
+
+class TinyTable(Table):
+    """
+        TinyDB table, every lookup is a full scan and every write rewrites the whole file
+    """
+
+    def __init__(self, name: str, backend: 'TinyBackend'):
+        super(TinyTable, self).__init__(name)
+        self.backend = backend
+        self.table = backend.db.table(name)
+
+    def insert_many(self, docs: List[Dict]) -> List[int]:
+        next_id = self.next_id()
+        rows = []
+
+        for doc in docs:
+            doc = dict(doc)
+            if 'id' not in doc:
+                doc['id'] = next_id
+            next_id = max(next_id, doc['id']) + 1
+            rows.append(doc)
+
+        self.backend.write_documents(self.name, rows)
+        return [row['id'] for row in rows]
+
+    def update(self, doc: Dict):
+        self.backend.write_documents(self.name, [doc])
+
+    def upsert_many(self, docs: List[Dict]):
+        self.backend.write_documents(self.name, docs)
+
+    def remove(self, ids: List[int]):
+        self.backend.remove_documents(self.name, ids)
+
+    def search(self, **fields) -> List[Dict]:
+        # the file might have been modified by another process
+        self.table.clear_cache()
+
+        if len(fields) == 0:
+            return self.table.all()
+
+        query = reduce(lambda a, b: a & b, [where(key) == value for key, value in fields.items()])
+        return self.table.search(query)
+
+    def __len__(self) -> int:
+        return len(self.table)
+
+
+class TinyBackend(Backend):
+    def __init__(self, location: str):
+        super(TinyBackend, self).__init__(location)
+        self.db = TinyDB(location, storage=TransactionMiddleware(JSONStorage))
+
+    @contextmanager
+    def transaction(self):
+        self.db.storage.begin()
+        try:
+            yield
+        except:
+            self.db.storage.end(commit=False)
+            self._clear_cache()
+            raise
+        else:
+            self.db.storage.end(commit=True)
+
+    def _clear_cache(self):
+        for name in self.db.tables():
+            self.db.table(name).clear_cache()
+
+    def table(self, name: str) -> Table:
+        return TinyTable(name, self)
+
+    def write_documents(self, name: str, docs: List[Dict]):
+        """
+            Insert or replace (matching on `id`) documents with a single read and a single write of the file.
+            We write the storage directly so TinyDB's own document id counter never gets out of sync
+        """
+        data = self.db.storage.read() or {}
+        table = data.setdefault(name, {})
+
+        doc_ids = {doc.get('id'): doc_id for doc_id, doc in table.items()}
+        next_doc_id = max((int(doc_id) for doc_id in table), default=0) + 1
+
+        for doc in docs:
+            doc_id = doc_ids.get(doc['id'])
+
+            if doc_id is None:
+                doc_id = str(next_doc_id)
+                next_doc_id += 1
+
+            table[doc_id] = dict(doc)
+
+        self.db.storage.write(data)
+        self.db.table(name).clear_cache()
+
+    def remove_documents(self, name: str, ids: List[int]):
+        ids = set(ids)
+        data = self.db.storage.read() or {}
+        table = data.get(name, {})
+
+        for doc_id in [doc_id for doc_id, doc in table.items() if doc.get('id') in ids]:
+            del table[doc_id]
+
+        self.db.storage.write(data)
+        self.db.table(name).clear_cache()
+
+    def close(self):
+        self.db.close()
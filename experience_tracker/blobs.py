@@ -0,0 +1,97 @@
+import hashlib
+import os
+import re
+import threading
+import zlib
+from typing import *
+
+
+class BlobStore:
+    """
+        Content addressed store for the large fields of the observations (stdout, stderr, nvprof csv).
+        Blobs are zlib compressed and saved as `<root>/<sha256[:2]>/<sha256[2:]>`, identical outputs are stored once.
+
+        Documents only keep a reference: `{'blob': sha256, 'size': uncompressed bytes, 'lines': line count}`
+    """
+
+    def __init__(self, root: str, level: int = 6):
+        self.root = root
+        self.level = level
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key[2:])
+
+    def put(self, data: bytes) -> str:
+        key = hashlib.sha256(data).hexdigest()
+        path = self.path(key)
+
+        if os.path.exists(path):
+            # reused blobs are fresh again for the garbage collector
+            os.utime(path)
+            return key
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        tmp = '{}.{}.{}.tmp'.format(path, os.getpid(), threading.get_ident())
+        with open(tmp, 'wb') as file:
+            file.write(zlib.compress(data, self.level))
+        os.replace(tmp, path)
+
+        return key
+
+    def get(self, key: str) -> bytes:
+        with open(self.path(key), 'rb') as file:
+            return zlib.decompress(file.read())
+
+    def remove(self, key: str):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def keys(self) -> Iterator[str]:
+        if not os.path.isdir(self.root):
+            return
+
+        for prefix in os.listdir(self.root):
+            folder = os.path.join(self.root, prefix)
+            for name in os.listdir(folder):
+                if not name.endswith('.tmp'):
+                    yield prefix + name
+
+    def size(self) -> int:
+        """ bytes used on disk """
+        return sum(os.path.getsize(self.path(key)) for key in self.keys())
+
+    def put_lines(self, lines: List[str]) -> Dict:
+        text = ''.join(lines)
+        data = text.encode('utf-8')
+        return {
+            'blob': self.put(data),
+            'size': len(data),
+            'lines': len(split_lines(text))
+        }
+
+    def get_lines(self, ref: Dict) -> List[str]:
+        return split_lines(self.get(ref['blob']).decode('utf-8'))
+
+    def load_lines(self, value: Union[List[str], Dict, None]) -> Optional[List[str]]:
+        """ resolve a field that is either a blob reference or inlined lines (older databases) """
+        if is_blob_ref(value):
+            return self.get_lines(value)
+        return value
+
+
+def split_lines(text: str) -> List[str]:
+    """
+        lines of `text` with their `\\n`, `''.join` gives `text` back; unlike `str.splitlines` the `\\r` of the
+        progress bars and the other line boundaries do not end a line
+    """
+    lines = re.split('(?<=\n)', text)
+    if lines[-1] == '':
+        lines.pop()
+    return lines
+
+
+def is_blob_ref(value) -> bool:
+    return isinstance(value, dict) and 'blob' in value
@@ -0,0 +1,245 @@
+import atexit
+import json
+import os
+import threading
+import time
+import uuid
+from typing import *
+
+import experience_tracker.stats as stats
+import experience_tracker.sysinfo as sysinfo
+from experience_tracker.backends import parse_location
+from experience_tracker.database import ExperienceDatabase, Observation, Program, System
+from experience_tracker.sampling import Sampled
+
+# checkpoints of the running jobs are saved as `<database>.checkpoints/<run>.jsonl`
+CHECKPOINT_SUFFIX = '.checkpoints'
+
+
+def checkpoint_folder(location: str) -> str:
+    return parse_location(location)[1] + CHECKPOINT_SUFFIX
+
+
+def run_header(program: Program, system: System, observation: Observation) -> Dict:
+    """ first line of a checkpoint file, what is needed to insert the observation of the run """
+    return {
+        'run': uuid.uuid4().hex,
+        'hostname': sysinfo.get_hostname(),
+        'pid': os.getpid(),
+        'started': time.time(),
+        'program': program.as_json(),
+        'system': system.as_json(),
+        'program_uid': observation.program_uid,
+        'system_uid': observation.system_uid,
+        'date': observation.date,
+    }
+
+
+def version(value) -> Any:
+    """ changes when a value is pushed to a stream, when a key is pushed again or its value changed in place """
+    if isinstance(value, Sampled):
+        return id(value), value.warmup, value.sampler.offered
+
+    if isinstance(value, tuple(stats.STATS.values())):
+        return id(value), value.current_count
+
+    # a key pushed again can get the id of the value it replaces and values can be changed in place,
+    # compare what would be saved instead
+    return json.dumps(value, default=repr)
+
+
+class Checkpointer:
+    """
+        Save the namespaces of a `LocalTrackLogger` that changed since the last checkpoint to an append-only
+        JSON lines file, from a background thread every `interval` seconds and at exit:
+            - the first line describes the run (`run_header`)
+            - then one line per checkpoint `{'checkpoint': n, 'time': ..., 'namespaces': {name: encoded namespace}}`,
+              a namespace replaces the one saved by the previous checkpoints
+
+        Changes are detected by comparing the `version` of the values, pushing a value costs nothing more.
+        The file is removed once the observation is persisted, the files left belong to runs that did not finish
+        and are inserted in the database by `recover` (`exp-tracker-admin recover`).
+
+        The streams are read while the program updates them without a lock: a checkpoint can miss the value being
+        pushed, and a namespace whose streams keep changing while they are read (`ATTEMPTS` times) is skipped
+        until the next checkpoint (counted in `skipped`)
+    """
+
+    # reads of a namespace before it is left for the next checkpoint
+    ATTEMPTS = 3
+
+    def __init__(self, path: str, reports: Dict[str, Dict], header: Dict, interval: float = 60.0):
+        self.path = path
+        self.reports = reports
+        self.header = header
+        self.interval = interval
+
+        # namespace -> key -> version of the last checkpoint
+        self.versions: Dict[str, Dict[str, Any]] = {}
+        self.checkpoints = 0
+        self.skipped = 0
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread: threading.Thread = None
+        self.file = None
+
+    def start(self) -> 'Checkpointer':
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self.file = open(self.path, 'a', encoding='utf-8')
+        self._write(self.header)
+
+        self.thread = threading.Thread(target=self._run, name='Checkpointer', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+        return self
+
+    def checkpoint(self) -> List[str]:
+        """ write the namespaces that changed since the last checkpoint, returns their names """
+        with self.lock:
+            if self.file is None:
+                return []
+
+            changed = {}
+
+            # the program can add namespaces and keys while we read them, the dict copies are atomic
+            for name, namespace in dict(self.reports).items():
+                if not isinstance(namespace, dict):
+                    continue
+
+                namespace = dict(namespace)
+                versions = {key: version(value) for key, value in namespace.items()}
+
+                if versions != self.versions.get(name):
+                    state = self._snapshot(namespace)
+
+                    # the versions are not updated, the namespace is written by the next checkpoint
+                    if state is None:
+                        self.skipped += 1
+                        continue
+
+                    changed[name] = state
+                    self.versions[name] = versions
+
+            if changed:
+                self.checkpoints += 1
+                self._write({'checkpoint': self.checkpoints, 'time': time.time(), 'namespaces': changed})
+
+            return list(changed)
+
+    def _snapshot(self, namespace: Dict) -> Optional[Dict]:
+        for _ in range(self.ATTEMPTS):
+            try:
+                return stats.encode(namespace)
+            except RuntimeError:
+                # a deque or a dict of a stream changed while it was read
+                continue
+
+        return None
+
+    def close(self, remove: bool = False):
+        """ stop the thread after a last checkpoint, `remove` deletes the file once the observation was saved """
+        self.stopping.set()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+
+        if not remove:
+            self.checkpoint()
+
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+            if remove and os.path.exists(self.path):
+                os.remove(self.path)
+
+    def _write(self, record: Dict):
+        self.file.write(json.dumps(record) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def _run(self):
+        while not self.stopping.wait(self.interval):
+            try:
+                self.checkpoint()
+            except Exception as e:
+                print('Checkpointer: could not save the metrics ({})'.format(e))
+
+
+def read_checkpoint(path: str) -> Tuple[Dict, Dict[str, Dict], int]:
+    """ header, latest saved state of each namespace and number of checkpoints of a checkpoint file """
+    header = None
+    reports = {}
+    checkpoints = 0
+
+    with open(path, 'r', encoding='utf-8') as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # the job died while writing its last checkpoint
+                break
+
+            if header is None:
+                header = record
+                continue
+
+            reports.update(record['namespaces'])
+            checkpoints = record['checkpoint']
+
+    return header, reports, checkpoints
+
+
+def pending(location: str) -> List[str]:
+    """ checkpoint files of the runs that did not persist their observation """
+    folder = checkpoint_folder(location)
+    if not os.path.isdir(folder):
+        return []
+
+    return sorted(os.path.join(folder, name) for name in os.listdir(folder) if name.endswith('.jsonl'))
+
+
+def is_running(header: Dict) -> bool:
+    """ the process of the run is still alive (only known on the same host) """
+    if header['hostname'] != sysinfo.get_hostname():
+        return False
+
+    try:
+        os.kill(header['pid'], 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+
+    return True
+
+
+def recover(db: ExperienceDatabase, path: str, remove: bool = True) -> Optional[Observation]:
+    """ insert the partial observation saved in a checkpoint file, its stderr tells it was recovered """
+    header, reports, checkpoints = read_checkpoint(path)
+    if header is None:
+        return None
+
+    info = header['program']
+    program = Program(info['name'], info['arguments'], info['version'])
+    program.date = info['date']
+    program.systems = set(info['systems'])
+    program.add_system(header['system_uid'])
+
+    info = header['system']
+    system = System(info['cpu'], info['gpus'], info['memory'], info['hostname'])
+
+    observation = Observation(header['program_uid'], header['system_uid'], header['date'], reports, [], [
+        'recovered from {} ({} checkpoints, last modified {})\n'.format(
+            os.path.basename(path), checkpoints, time.ctime(os.path.getmtime(path)))
+    ])
+
+    with db.batch() as batch:
+        batch.insert_program(program)
+        batch.insert_system(system)
+        batch.insert_observation(observation)
+
+    if remove:
+        os.remove(path)
+
+    return observation
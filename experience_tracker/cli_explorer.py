@@ -1,5 +1,7 @@
+import sys
 from typing import *
 from experience_tracker.database import ExperienceDatabase
+from experience_tracker.compare import compare_observations
 
 
 database = ExperienceDatabase()
@@ -65,13 +67,23 @@ def list_systems():
     print()
 
 
-def list_obs():
-    """ list all the observations stored in the database """
-    for obs in database.observations():
+def list_obs(limit=None, offset=0):
+    """ list the observations stored in the database (optional: limit=N offset=N) """
+    limit = optional_int(limit)
+    observations = database.iter_observations(
+        fields=['program_uid', 'system_uid', 'date'], limit=limit, offset=int(offset))
+
+    for obs in observations:
         print(str_obs(obs), end='')
     print()
 
 
+def optional_int(value):
+    if value is None:
+        return None
+    return int(value)
+
+
 def show_obs(id):
     """ display a detailed report of the observation of an experiement """
     results = database.get_observation(by='id', value=int(id))
@@ -92,13 +104,13 @@ def show_obs(id):
 
     print('    * STDOUT')
     print('-' * 20)
-    for line in doc['stdout']:
+    for line in database.load_lines(doc['stdout']) or []:
         print(line)
     print('-' * 20)
 
     print('    * STDERR')
     print('-' * 20)
-    for line in doc['stderr']:
+    for line in database.load_lines(doc['stderr']) or []:
         print(line)
     print('-' * 20)
 
@@ -109,6 +121,32 @@ def show_obs(id):
     print('<' * 20)
 
 
+def compare_obs(ids, confidence='0.95'):
+    """ Welch's t-test of the metrics of observations against the first one (ids=1,2,3 confidence=0.95) """
+    ids = [int(id) for id in ids.split(',')]
+    observations = []
+
+    for id in ids:
+        results = database.get_observation(by='id', value=id)
+        if len(results) == 0:
+            raise NotFound('Not found document with id={}'.format(id))
+        observations.append(results[0])
+
+    rows = compare_observations(observations, [str(id) for id in ids], float(confidence))
+    if len(rows) == 0:
+        print('    no metrics shared by the observations')
+        return
+
+    print('{:>30} {:>6} {:>12} {:>12} {:>9} {:>25} {:>9} {:>7}'.format(
+        'key', 'obs', 'baseline', 'mean', 'diff %', 'interval', 'p', 'effect'))
+
+    for row in rows:
+        print('{:>30} {:>6} {:12.4g} {:12.4g} {:8.2f}% [{:11.4g}, {:11.4g}] {:9.3g} {:7.2f} {}'.format(
+            row['key'], row['other'], row['mean_a'], row['mean_b'], row['rel_diff'] * 100, row['ci_low'],
+            row['ci_high'], row['p'], row['effect'], '*' if row['significant'] else ''))
+    print()
+
+
 def exit():
     """ exit the repl"""
     pass
@@ -125,6 +163,7 @@ defined_commands = {
     'list-systems': list_systems,
     'list-observations': list_obs,
     'show-observation': show_obs,
+    'compare-observations': compare_obs,
     'exit': exit,
     'help': show_help,
 }
@@ -153,6 +192,11 @@ def execute_cmd(name: str, args: Dict[str, str]):
 
 
 def main():
+    global database
+
+    if len(sys.argv) > 1:
+        database = ExperienceDatabase(sys.argv[1])
+
     i = 0
 
     while True:
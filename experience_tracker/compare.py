@@ -0,0 +1,222 @@
+import math
+from typing import *
+
+import numpy as np
+
+import experience_tracker.stats as stats
+
+# columns of the rows returned by `compare_observations`
+COLUMNS = ['key', 'baseline', 'other', 'n_a', 'mean_a', 'sd_a', 'n_b', 'mean_b', 'sd_b', 'diff', 'rel_diff',
+           'ci_low', 'ci_high', 't', 'df', 'p', 'effect', 'significant']
+
+
+def moments(reports: Dict) -> Dict[str, Tuple[int, float, float]]:
+    """
+        `namespace/key -> (count, mean, m2)` of the StatStreams saved in the reports of an observation,
+        read from the saved states without rebuilding the streams
+    """
+    result = {}
+
+    for namespace, values in (reports or {}).items():
+        if not isinstance(values, dict) or 'nvprof' in values:
+            continue
+
+        for key, value in values.items():
+            summary = stats.peek(value)
+
+            if summary is not None and summary['type'] == 'StatStream':
+                result['{}/{}'.format(namespace, key)] = (summary['count'], summary['mean'], summary['m2'])
+
+    return result
+
+
+def welch(n_a, mean_a, m2_a, n_b, mean_b, m2_b, confidence: float = 0.95) -> Dict[str, np.ndarray]:
+    """
+        Welch's t-test of `mean_b - mean_a` from the moments of the two samples (arrays, one element per metric).
+        Metrics with fewer than 2 observations on one side are NaN.
+
+        Returns the difference, its confidence interval, t, the degrees of freedom (Welch-Satterthwaite),
+        the two sided p-value and the effect size (Hedges' g)
+    """
+    n_a, mean_a, m2_a, n_b, mean_b, m2_b = (np.asarray(v, dtype=np.float64) for v in
+                                            (n_a, mean_a, m2_a, n_b, mean_b, m2_b))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        valid = (n_a > 1) & (n_b > 1)
+
+        # sample variances
+        var_a = np.where(valid, m2_a / (n_a - 1), np.nan)
+        var_b = np.where(valid, m2_b / (n_b - 1), np.nan)
+
+        se_a = var_a / n_a
+        se_b = var_b / n_b
+        se = np.sqrt(se_a + se_b)
+
+        diff = mean_b - mean_a
+        t = diff / se
+        df = (se_a + se_b) ** 2 / (se_a ** 2 / (n_a - 1) + se_b ** 2 / (n_b - 1))
+
+        # identical constant samples
+        t = np.where(se == 0, np.where(diff == 0, 0.0, np.copysign(np.inf, diff)), t)
+        df = np.where(se == 0, n_a + n_b - 2, df)
+
+        p = t_sf2(t, df)
+        half_width = t_ppf2(1 - confidence, df) * se
+
+        pooled = np.sqrt(((n_a - 1) * var_a + (n_b - 1) * var_b) / (n_a + n_b - 2))
+        correction = 1 - 3 / (4 * (n_a + n_b) - 9)
+        effect = np.where(pooled > 0, diff / pooled * correction, np.where(diff == 0, 0.0, np.nan))
+
+    return {
+        'diff': diff,
+        'ci_low': diff - half_width,
+        'ci_high': diff + half_width,
+        't': t,
+        'df': df,
+        'p': p,
+        'effect': np.where(valid, effect, np.nan),
+    }
+
+
+def compare_observations(observations: List[Dict], labels: List[str] = None, confidence: float = 0.95,
+                         baseline: int = 0) -> List[Dict]:
+    """
+        Compare the StatStreams shared by the observations to the ones of the baseline observation,
+        one row per (metric, observation), see `COLUMNS`.
+        A difference is `significant` if the p-value is lower than `1 - confidence`
+    """
+    if len(observations) < 2:
+        raise ValueError('Expected at least two observations to compare')
+
+    labels = labels or [str(obs.get('id', i)) for i, obs in enumerate(observations)]
+    base = moments(observations[baseline].get('reports'))
+    rows = []
+
+    for i, obs in enumerate(observations):
+        if i == baseline:
+            continue
+
+        other = moments(obs.get('reports'))
+        keys = sorted(base.keys() & other.keys())
+        if len(keys) == 0:
+            continue
+
+        a = np.array([base[key] for key in keys], dtype=np.float64)
+        b = np.array([other[key] for key in keys], dtype=np.float64)
+        result = welch(a[:, 0], a[:, 1], a[:, 2], b[:, 0], b[:, 1], b[:, 2], confidence)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            sd_a = np.sqrt(a[:, 2] / np.maximum(a[:, 0], 1))
+            sd_b = np.sqrt(b[:, 2] / np.maximum(b[:, 0], 1))
+            rel_diff = np.where(a[:, 1] != 0, result['diff'] / np.abs(a[:, 1]), np.nan)
+
+        for k, key in enumerate(keys):
+            rows.append({
+                'key': key,
+                'baseline': labels[baseline],
+                'other': labels[i],
+                'n_a': int(a[k, 0]),
+                'mean_a': float(a[k, 1]),
+                'sd_a': float(sd_a[k]),
+                'n_b': int(b[k, 0]),
+                'mean_b': float(b[k, 1]),
+                'sd_b': float(sd_b[k]),
+                'diff': float(result['diff'][k]),
+                'rel_diff': float(rel_diff[k]),
+                'ci_low': float(result['ci_low'][k]),
+                'ci_high': float(result['ci_high'][k]),
+                't': float(result['t'][k]),
+                'df': float(result['df'][k]),
+                'p': float(result['p'][k]),
+                'effect': float(result['effect'][k]),
+                'significant': bool(result['p'][k] < 1 - confidence),
+            })
+
+    return rows
+
+
+def t_sf2(t, df) -> np.ndarray:
+    """ two sided p-value of the Student t distribution, `P(|T| >= |t|)` """
+    t = np.asarray(t, dtype=np.float64)
+    df = np.asarray(df, dtype=np.float64)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x = df / (df + t * t)
+
+    return betainc(df / 2, np.full_like(x, 0.5), x)
+
+
+def t_ppf2(alpha, df) -> np.ndarray:
+    """ `t` such that `P(|T| >= t) = alpha` (bisection on `t_sf2`) """
+    df = np.asarray(df, dtype=np.float64)
+    low = np.zeros_like(df)
+    high = np.full_like(df, 1e4)
+
+    for _ in range(100):
+        middle = (low + high) / 2
+        above = t_sf2(middle, df) > alpha
+        low = np.where(above, middle, low)
+        high = np.where(above, high, middle)
+
+    return np.where(np.isnan(df), np.nan, (low + high) / 2)
+
+
+_lgamma = np.vectorize(math.lgamma, otypes=[np.float64])
+
+
+def betainc(a, b, x, iterations: int = 200, eps: float = 1e-14) -> np.ndarray:
+    """
+        Regularized incomplete beta function `I_x(a, b)` (continued fraction, Numerical Recipes 6.4),
+        vectorized over numpy arrays
+    """
+    a, b, x = np.broadcast_arrays(*(np.asarray(v, dtype=np.float64) for v in (a, b, x)))
+    nan = np.isnan(a) | np.isnan(b) | np.isnan(x)
+
+    # the continued fraction converges fast for x < (a + 1) / (a + b + 2), use I_x(a, b) = 1 - I_1-x(b, a)
+    flip = x > (a + 1) / (a + b + 2)
+    a, b, x = np.where(flip, b, a), np.where(flip, a, b), np.where(flip, 1 - x, x)
+
+    a = np.where(nan, 1, a)
+    b = np.where(nan, 1, b)
+    x = np.clip(np.where(nan, 0.5, x), 0, 1)
+
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        log_front = a * np.log(x) + b * np.log1p(-x) - (_lgamma(a) + _lgamma(b) - _lgamma(a + b))
+        front = np.where((x > 0) & (x < 1), np.exp(log_front) / a, 0.0)
+
+    result = front * _betacf(a, b, x, iterations, eps)
+    result = np.where(x >= 1, 1.0, result)
+    result = np.where(flip, 1 - result, result)
+    return np.where(nan, np.nan, result)
+
+
+def _betacf(a, b, x, iterations, eps):
+    tiny = 1e-300
+
+    def fix(v):
+        return np.where(np.abs(v) < tiny, tiny, v)
+
+    qab = a + b
+    qap = a + 1
+    qam = a - 1
+    c = np.ones_like(x)
+    d = 1 / fix(1 - qab * x / qap)
+    h = d
+
+    for m in range(1, iterations + 1):
+        m2 = 2 * m
+        aa = m * (b - m) * x / ((qam + m2) * (a + m2))
+        d = 1 / fix(1 + aa * d)
+        c = fix(1 + aa / c)
+        h = h * d * c
+
+        aa = -(a + m) * (qab + m) * x / ((a + m2) * (qap + m2))
+        d = 1 / fix(1 + aa * d)
+        c = fix(1 + aa / c)
+        delta = d * c
+        h = h * delta
+
+        if np.all(np.abs(delta - 1) < eps):
+            break
+
+    return h
@@ -1,11 +1,16 @@
-from tinydb import TinyDB, where
 import hashlib
+import os
 from typing import List, Dict, Set
 import experience_tracker.sysinfo as sysinfo
 from experience_tracker.stats import StatStream
+import experience_tracker.stats as stats
+from experience_tracker.backends import make_backend, INDEXES
+from experience_tracker.blobs import BlobStore
+from experience_tracker.index import TableIndex
 import datetime
 
-TINY_DB = './benchmark.db'
+# Path or URL (`sqlite://benchmark.db`) of the database, see `experience_tracker.backends.parse_location`
+TINY_DB = os.environ.get('EXP_TRACKER_DB', './benchmark.db')
 
 
 class Program:
@@ -53,22 +58,41 @@ class Program:
         }
 
     def _insert(self, table):
-        results = table.search(where('uid') == self.uid)
-
-        if len(results) == 0:
-            table.insert({
-                'name': self.name,
-                'arguments': self.arguments,
-                'version': self.version,
-                'date': self.date,
-                'systems': list(self.systems),
-                'uid': self.uid,
-                'id':  len(table)
-            })
-        else:
-            result = results[0]
-            result['systems'] = list(set(result['systems'] + list(self.systems)))
-            table.update(result, doc_ids=[result.doc_id])
+        return Program._insert_many(table, [self])
+
+    @staticmethod
+    def _insert_many(table, programs: List['Program']) -> List[Dict]:
+        """ returns the documents that were written """
+        # merge the programs with the same uid before touching the table
+        docs: Dict[str, Dict] = {}
+        for program in programs:
+            if program.uid in docs:
+                docs[program.uid]['systems'] = list(set(docs[program.uid]['systems']) | program.systems)
+            else:
+                docs[program.uid] = program.as_json()
+
+        new = []
+        updated = []
+        for uid, doc in docs.items():
+            results = table.search(uid=uid)
+
+            if len(results) == 0:
+                new.append(doc)
+            else:
+                result = results[0]
+                systems = set(result['systems'])
+
+                if not systems.issuperset(doc['systems']):
+                    result['systems'] = list(systems | set(doc['systems']))
+                    updated.append(result)
+
+        if new:
+            for doc, doc_id in zip(new, table.insert_many(new)):
+                doc['id'] = doc_id
+        if updated:
+            table.upsert_many(updated)
+
+        return new + updated
 
 
 class System:
@@ -118,17 +142,19 @@ class System:
         }
 
     def _insert(self, table):
-        results = table.search(where('uid') == self.uid)
-        if len(results) == 0:
-            table.insert({
-                'cpu': self.cpu,
-                'gpus': self.gpus,
-                'memory': self.memory,
-                'hostname': self.hostname,
-                'uid': self.uid,
-                'mid': self.mid,
-                'id': len(table)
-            })
+        return System._insert_many(table, [self])
+
+    @staticmethod
+    def _insert_many(table, systems: List['System']) -> List[Dict]:
+        """ returns the documents that were written """
+        docs = {system.uid: system.as_json() for system in systems}
+        new = [doc for uid, doc in docs.items() if len(table.search(uid=uid)) == 0]
+
+        if new:
+            for doc, doc_id in zip(new, table.insert_many(new)):
+                doc['id'] = doc_id
+
+        return new
 
 
 class Observation:
@@ -140,16 +166,50 @@ class Observation:
         self.stdout: List[str] = out
         self.stderr: List[str] = err
 
-    def _insert(self, table):
-        table.insert({
+    def as_json(self):
+        return {
             'program_uid': self.program_uid,
             'system_uid': self.system_uid,
             'date': self.date,
-            'reports': self.reports,
+            # statistics are saved as their partial state, see `stats.encode`
+            'reports': stats.encode(self.reports),
             'stdout': self.stdout,
-            'stderr': self.stderr,
-            'id': len(table)
-        })
+            'stderr': self.stderr
+        }
+
+    def _insert(self, table, blobs: BlobStore = None):
+        return table.insert(self._document(blobs))
+
+    @staticmethod
+    def _insert_many(table, observations: List['Observation'], blobs: BlobStore = None):
+        if observations:
+            return table.insert_many([obs._document(blobs) for obs in observations])
+        return []
+
+    def _document(self, blobs: BlobStore = None) -> Dict:
+        doc = self.as_json()
+
+        if blobs is not None:
+            # large fields are stored out of line, the document only holds a reference
+            doc['stdout'] = blobs.put_lines(self.stdout)
+            doc['stderr'] = blobs.put_lines(self.stderr)
+            doc['reports'] = {
+                name: Observation._externalize_report(report, blobs) for name, report in doc['reports'].items()
+            }
+
+        return doc
+
+    @staticmethod
+    def _externalize_report(report, blobs: BlobStore):
+        if not isinstance(report, dict) or not isinstance(report.get('nvprof'), dict):
+            return report
+
+        nvprof = dict(report['nvprof'])
+        nvprof['csv'] = blobs.put_lines(nvprof['csv'])
+
+        report = dict(report)
+        report['nvprof'] = nvprof
+        return report
 
     def dump(self):
         Observation._recursive_dump(self.reports)
@@ -157,40 +217,119 @@ class Observation:
     @staticmethod
     def _recursive_dump(data, depth=0, indentation_size=2):
         for key, value in data.items():
+            if stats.is_encoded(value):
+                value = stats.decode(value)
+
+            # sampled streams, see `experience_tracker.sampling`
+            if hasattr(value, 'resolve'):
+                value = value.resolve()
+
             if isinstance(value, dict):
                 print('{}{}:'.format(' ' * depth, key))
                 Observation._recursive_dump(value, depth + indentation_size)
 
-            elif isinstance(value, StatStream):
+            elif isinstance(value, tuple(stats.STATS.values())):
                 print('{}{}:'.format(' ' * depth, key))
                 value.dump(depth=depth + indentation_size)
 
+                if value.sampling is not None:
+                    print('{}sampled: {mode} {param}, {recorded}/{offered} recorded'.format(
+                        ' ' * (depth + indentation_size), **value.sampling))
+
             else:
                 print('{}{}:{}'.format(' ' * depth, key, value))
 
 
+class Batch:
+    """
+        Unit of work, collects programs, systems and observations and writes them all at once when the context exits.
+        Programs and systems are deduplicated by uid.
+
+        >>> with db.batch() as batch:
+        ...     batch.insert_program(program)
+        ...     batch.insert_system(system)
+        ...     batch.insert_observation(observation)
+    """
+
+    def __init__(self, db: 'ExperienceDatabase'):
+        self.db = db
+        self.programs: List[Program] = []
+        self.systems: List[System] = []
+        self.observations: List[Observation] = []
+
+    def insert_program(self, program: Program):
+        self.programs.append(program)
+
+    def insert_system(self, system: System):
+        self.systems.append(system)
+
+    def insert_observation(self, observation: Observation):
+        self.observations.append(observation)
+
+    def commit(self):
+        self.db.insert_many(self.programs, self.systems, self.observations)
+        self.programs, self.systems, self.observations = [], [], []
+
+    def __enter__(self) -> 'Batch':
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.commit()
+
+
 class ExperienceDatabase:
     """
         Keeps Track of experiences:
             - program    : definition of an experiment (usually script name + arguments)
             - observation: results of the jobs ran
             - system     : system description on which the job was ran
+
+        `db_loc` is a path or a URL selecting the storage backend (TinyDB json file or SQLite)
     """
 
     def __init__(self, db_loc=TINY_DB):
-        self.db = TinyDB(db_loc)
-        self._programs = self.db.table('programs')
-        self._observations = self.db.table('observations')
-        self._systems = self.db.table('systems')
+        self.backend = make_backend(db_loc)
+        self._programs = self.backend.table('programs')
+        self._observations = self.backend.table('observations')
+        self._systems = self.backend.table('systems')
+        self.blobs = BlobStore(self.backend.location + '.blobs')
+
+        # programs and systems are looked up in loops by the explorers
+        self._program_index = TableIndex(self._programs, INDEXES['programs'], self.backend)
+        self._system_index = TableIndex(self._systems, INDEXES['systems'], self.backend)
 
     def insert_program(self, program):
-        return program._insert(self._programs)
+        # the lookup and the write must happen in the same transaction if other processes write to the database
+        with self.backend.transaction():
+            docs = program._insert(self._programs)
+
+        self._program_index.update(docs)
 
     def insert_observation(self, observation):
-        return observation._insert(self._observations)
+        with self.backend.transaction():
+            return observation._insert(self._observations, self.blobs)
 
     def insert_system(self, system):
-        return system._insert(self._systems)
+        with self.backend.transaction():
+            docs = system._insert(self._systems)
+
+        self._system_index.update(docs)
+
+    def insert_many(self, programs: List[Program] = (), systems: List[System] = (),
+                    observations: List[Observation] = ()):
+        """ insert everything in a single transaction, returns the ids of the observations """
+        with self.backend.transaction():
+            program_docs = Program._insert_many(self._programs, list(programs))
+            system_docs = System._insert_many(self._systems, list(systems))
+            ids = Observation._insert_many(self._observations, list(observations), self.blobs)
+
+        self._program_index.update(program_docs)
+        self._system_index.update(system_docs)
+        return ids
+
+    def batch(self) -> Batch:
+        return Batch(self)
 
     def programs(self):
         return self._programs.all()
@@ -199,15 +338,47 @@ class ExperienceDatabase:
         return self._systems.all()
 
     def get_program(self, by: str, value: str):
-        return self._programs.search(where(by) == value)
+        return self._program_index.lookup(by, value)
 
     def get_system(self, by: str, value: str):
-        return self._systems.search(where(by) == value)
+        return self._system_index.lookup(by, value)
 
     def get_observation(self, by: str, value: str):
-        return self._observations.search(where(by) == value)
+        return self._observations.search(**{by: value})
+
+    def search_observations(self, **fields):
+        return self._observations.search(**fields)
 
     def observations(self):
-        return self._observations
+        return self._observations.all()
+
+    def iter_observations(self, fields: List[str] = None, limit: int = None, offset: int = 0, after: int = None,
+                          **conditions):
+        """
+            Generator over the observations matching `conditions` (`field=value`) in `id` order.
+            `fields` selects the fields to load (`id` is always included), `after` is the cursor returned by
+            `page_observations`
+        """
+        return self._observations.iterate(fields, limit, offset, after, **conditions)
+
+    def page_observations(self, size: int, fields: List[str] = None, after: int = None, **conditions):
+        """ returns `(observations, cursor)`, pass the cursor as `after` to get the next page """
+        return self._observations.page(size, fields, after, **conditions)
+
+    def update_observations(self, docs: List[Dict]):
+        """ replace the observations with the same `id` """
+        with self.backend.transaction():
+            self._observations.upsert_many(docs)
+
+    def remove_observations(self, ids: List[int]):
+        with self.backend.transaction():
+            self._observations.remove(ids)
+
+    def load_lines(self, value):
+        """ fetch the lines of a stdout, stderr or csv field that might be stored in the blob store """
+        return self.blobs.load_lines(value)
+
+    def close(self):
+        self.backend.close()
 
 
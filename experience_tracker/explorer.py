@@ -1,13 +1,15 @@
 
 from flask import Flask
 import pandas as pd
-from tinydb import TinyDB, where
+import argparse
 import logging
 import base64
 
 import experience_tracker.database as database
 import experience_tracker.template as html
 import experience_tracker.fakefile as fakefile
+import experience_tracker.stats as stats
+import experience_tracker.compare as comparison
 
 ALPHA = 'ABCDEFGHIJKLMNOPQRSTUVXYZ'
 FLOAT_COLS = ['Time(%)', 'Time', 'Calls', 'Avg', 'Min', 'Max']
@@ -60,15 +62,183 @@ def html_reports(report, cols):
     return gpu_html, api_html
 
 
+def metric_row(key, value) -> dict:
+    summary = stats.peek(value)
+
+    # the header of the state is enough, the stream is not rebuilt
+    if summary is not None and summary['type'] == 'StatStream':
+        row = {'Key': key, 'Value': summary['last'], 'Avg': summary['avg'], 'Sd': summary['sd'],
+               'Min': summary['min'], 'Max': summary['max'], 'Count': summary['count']}
+
+        if summary['sampling'] is not None:
+            row['Sampling'] = '{mode} {param}: {recorded}/{offered}'.format(**summary['sampling'])
+
+        return row
+
+    if summary is not None and summary['type'] == 'RawSamples':
+        return {'Key': key, 'Value': summary['last'], 'Min': summary['min'], 'Max': summary['max'],
+                'Count': summary['count'], 'Kept': '{kept} ({mode})'.format(**summary)}
+
+    value = stats.decode(value)
+
+    if isinstance(value, stats.StatStream):
+        row = {'Key': key, 'Value': value.val, 'Avg': value.avg, 'Sd': value.sd,
+               'Min': value.min, 'Max': value.max, 'Count': value.count}
+
+    elif isinstance(value, (stats.QuantileStream, stats.Histogram)):
+        p50, p95, p99 = value.quantiles([0.5, 0.95, 0.99])
+        row = {'Key': key, 'Value': value.val, 'Min': value.min, 'Max': value.max, 'Count': value.count,
+               'P50': p50, 'P95': p95, 'P99': p99}
+
+        if isinstance(value, stats.Histogram):
+            row['Avg'] = value.avg
+
+    elif isinstance(value, stats.WindowedStream):
+        row = {'Key': key, 'Value': value.val, 'Avg': value.avg, 'Count': value.count,
+               'Rate': value.rate, 'Ewma': value.ewma}
+    else:
+        return {'Key': key, 'Value': value}
+
+    # counts and rates of sampled streams are multiplied by offered / recorded
+    if value.sampling is not None:
+        row['Sampling'] = '{mode} {param}: {recorded}/{offered}'.format(**value.sampling)
+
+    return row
+
+
+def make_series_svg(stream, width=600, height=150):
+    """ samples/s (line) and mean value (dots) of each window over the run """
+    series = stream.series()
+    if len(series) == 0:
+        return ''
+
+    start = series[0]['start']
+    end = max(series[-1]['start'] + series[-1]['duration'] - start, 1e-9)
+    top_rate = max(max(w['rate'] for w in series), 1e-9)
+    top_mean = max(max(w['mean'] for w in series), 1e-9)
+
+    def x(w):
+        return width * (w['start'] + w['duration'] / 2 - start) / end
+
+    rate = ' '.join('{:.1f},{:.1f}'.format(x(w), height - height * w['rate'] / top_rate) for w in series)
+    means = ''.join(
+        '<circle cx="{:.1f}" cy="{:.1f}" r="2" fill="#ffc107"><title>{:.1f} s: mean {:.4g}, {:.4g}/s</title>'
+        '</circle>'.format(x(w), height - height * w['mean'] / top_mean, w['start'] - start, w['mean'], w['rate'])
+        for w in series)
+
+    return """
+        <svg width="{w}" height="{h2}" xmlns="http://www.w3.org/2000/svg">
+            <polyline points="{rate}" fill="none" stroke="#17a2b8" stroke-width="2"/>
+            {means}
+            <text x="0" y="{ty}" fill="white" font-size="12">0 s (rate max: {top:.4g}/s)</text>
+            <text x="{w}" y="{ty}" fill="white" font-size="12" text-anchor="end">{end:.1f} s</text>
+        </svg>
+    """.format(w=width, h2=height + 16, ty=height + 14, rate=rate, means=means, top=top_rate, end=end)
+
+
+def make_points_svg(raw, width=600, height=150):
+    """ retained raw observations, x is the index of the observation """
+    xs, ys = raw.points()
+    if len(xs) == 0:
+        return ''
+
+    low, high = min(ys), max(ys)
+    span_x = max(xs[-1] - xs[0], 1e-9)
+    span_y = max(high - low, 1e-9)
+
+    coords = [(width * (x - xs[0]) / span_x, height - height * (y - low) / span_y) for x, y in zip(xs, ys)]
+
+    # downsampled series are drawn as a line, reservoirs as a scatter plot
+    if raw.mode == 'lttb':
+        marks = '<polyline points="{}" fill="none" stroke="#17a2b8" stroke-width="1"/>'.format(
+            ' '.join('{:.1f},{:.1f}'.format(x, y) for x, y in coords))
+    else:
+        marks = ''.join('<circle cx="{:.1f}" cy="{:.1f}" r="1.5" fill="#17a2b8"/>'.format(x, y) for x, y in coords)
+
+    return """
+        <svg width="{w}" height="{h2}" xmlns="http://www.w3.org/2000/svg">
+            {marks}
+            <text x="0" y="{ty}" fill="white" font-size="12">#{first:.0f} [{low:.4g}, {high:.4g}]</text>
+            <text x="{w}" y="{ty}" fill="white" font-size="12" text-anchor="end">#{last:.0f}</text>
+        </svg>
+    """.format(w=width, h2=height + 16, ty=height + 14, marks=marks, first=xs[0], last=xs[-1], low=low, high=high)
+
+
+def make_histogram_svg(hist, width=600, height=150, max_bars=80):
+    """ bar chart of the non empty range of the histogram, x axis is log scale like the buckets """
+    used = [i for i, count in enumerate(hist.counts) if count]
+    if len(used) == 0:
+        return ''
+
+    first, last = used[0], used[-1] + 1
+    # merge neighbouring buckets so we do not draw more than `max_bars` bars
+    step = max((last - first + max_bars - 1) // max_bars, 1)
+    bars = []
+    for i in range(first, last, step):
+        end = min(i + step, last)
+        bars.append((hist.bucket_bounds(i)[0], hist.bucket_bounds(end - 1)[1], sum(hist.counts[i:end])))
+
+    top = max(count for _, _, count in bars)
+    bar_width = width / len(bars)
+    rects = []
+    for k, (low, high, count) in enumerate(bars):
+        h = height * count / top
+        rects.append(
+            '<rect x="{:.1f}" y="{:.1f}" width="{:.1f}" height="{:.1f}" fill="#17a2b8">'
+            '<title>[{:.4g}, {:.4g}): {}</title></rect>'.format(k * bar_width, height - h, bar_width * 0.9, h,
+                                                                 low, high, count))
+
+    return """
+        <svg width="{w}" height="{h2}" xmlns="http://www.w3.org/2000/svg">
+            {rects}
+            <text x="0" y="{ty}" fill="white" font-size="12">{low:.4g}</text>
+            <text x="{w}" y="{ty}" fill="white" font-size="12" text-anchor="end">{high:.4g}</text>
+        </svg>
+    """.format(w=width, h2=height + 16, ty=height + 14, rects=''.join(rects), low=bars[0][0], high=bars[-1][1])
+
+
+def make_metrics_section(name, report):
+    """ logger namespace, plain values and statistics summaries """
+    table = pd.DataFrame([metric_row(key, value) for key, value in report.items()])
+    table_html = table.to_html(
+        classes='table table-striped table-hover table-condensed table-dark',
+        float_format=lambda x: '{:.4f}'.format(x), index=False, na_rep='')
+
+    charts = []
+    for key, value in report.items():
+        if stats.is_encoded(value) and value['__stat__'] not in ('Histogram', 'WindowedStream', 'RawSamples'):
+            continue
+
+        value = stats.decode(value)
+
+        if isinstance(value, stats.Histogram):
+            charts.append('<h5>{}</h5>{}'.format(key, make_histogram_svg(value)))
+
+        elif isinstance(value, stats.WindowedStream):
+            charts.append('<h5>{}</h5>{}'.format(key, make_series_svg(value)))
+
+        elif isinstance(value, stats.RawSamples):
+            charts.append('<h5>{}</h5>{}'.format(key, make_points_svg(value)))
+
+    return """
+        <h4>{}</h4>
+        {}
+        {}
+    """.format(name, table_html, '\n'.join(charts))
+
+
 def make_reports_section(reports, date):
     sections = []
     for file_name, reps in reports.items():
+        if isinstance(reps, dict) and 'nvprof' not in reps:
+            sections.append(make_metrics_section(file_name, reps))
+            continue
 
         if 'nvprof' in reps:
             rep = reps['nvprof']
             nvprof_header = rep['nvprof_header']
             print(rep)
-            csv = pd.read_csv(fakefile.FakeFile(rep['csv']), index_col=False)
+            csv = pd.read_csv(fakefile.FakeFile(db.load_lines(rep['csv'])), index_col=False)
 
             gpu_html, api_html = html_reports(csv, SELECTED_COLS)
 
@@ -127,21 +297,22 @@ def optional_map(item, fun):
 
 @app.route('/job/<uid>')
 def job(uid: str) -> str:
-    benchmarks = db.get_observation(by='program_uid', value=uid)
+    job_refs = db.get_program(by='uid', value=uid)
 
-    if len(benchmarks) == 0:
+    if len(job_refs) == 0:
         return html.make_page('no job with (uid={})'.format(uid))
 
-    job_ref = db.get_program(by='uid', value=uid)[0]
-    benchmarks = benchmarks
+    job_ref = job_refs[0]
+    # observations are loaded one page at a time
+    benchmarks = db.iter_observations(program_uid=uid)
 
     bench_mark_pages = []
     for bench in benchmarks:
         date = bench['date']
         system_uid = bench['system_uid']
         reports = bench['reports']
-        output = bench.get('stdout')
-        outerr = bench.get('stderr')
+        output = db.load_lines(bench.get('stdout'))
+        outerr = db.load_lines(bench.get('stderr'))
 
         print(outerr)
 
@@ -168,6 +339,9 @@ def job(uid: str) -> str:
 
         bench_mark_pages.append(page)
 
+    if len(bench_mark_pages) == 0:
+        return html.make_page('no job with (uid={})'.format(uid))
+
     return html.make_page('\n'.join(bench_mark_pages))
 
 
@@ -206,6 +380,43 @@ def compare_ids(varargs = None):
     return make_comparison(job_refs, name=None, hostname=hostname)
 
 
+@app.route('/compare/observations/<path:varargs>')
+def compare_observations(varargs=None):
+    """ statistical comparison of the metrics of observations (ids), the first one is the baseline """
+    ids = [int(id) for id in varargs.split('/') if id]
+    observations = []
+
+    for id in ids:
+        results = db.get_observation(by='id', value=id)
+        if len(results) == 0:
+            return html.make_page('no observation with (id={})'.format(id))
+        observations.append(results[0])
+
+    if len(observations) < 2:
+        return html.make_page('Expected at least two observation ids')
+
+    page = make_stat_comparison(observations, [str(id) for id in ids])
+    return html.make_page(page or 'No metrics shared by the observations')
+
+
+def make_stat_comparison(observations, labels, confidence=0.95) -> str:
+    """ Welch's t-test of the StatStreams shared with the first observation """
+    rows = comparison.compare_observations(observations, labels, confidence)
+    if len(rows) == 0:
+        return ''
+
+    table = pd.DataFrame(rows, columns=comparison.COLUMNS)
+    table_html = table.to_html(
+        classes='table table-striped table-hover table-condensed table-dark',
+        float_format=lambda x: '{:.4g}'.format(x), index=False, na_rep='')
+
+    return """
+        <h1>Metrics</h1>
+        <p>difference to {} ({:.0f}% confidence interval), significant if p &lt; {:.2g}</p>
+        {}
+    """.format(labels[0], confidence * 100, 1 - confidence, table_html)
+
+
 @app.route('/compare/<name>/<hostname>')
 def compare(name: str, hostname: str) -> str:
     name = base64.b64decode(name).decode('utf-8')
@@ -230,9 +441,7 @@ def make_comparison(job_refs, name, hostname):
     # db.get_observation(by='program_uid', value=j['uid']) for j in job_refs
     benchmarks = []
     for j in job_refs:
-        r = db.observations().search(
-            (where('program_uid') == j['uid']) &
-            (where('system_uid') == system['uid']))
+        r = db.search_observations(program_uid=j['uid'], system_uid=system['uid'])
 
         if len(r) > 0:
             benchmarks.append(r[0])
@@ -243,6 +452,10 @@ def make_comparison(job_refs, name, hostname):
     if len(benchmarks) == 0:
         return 'No jobs found'
 
+    metrics_html = ''
+    if len(benchmarks) > 1:
+        metrics_html = make_stat_comparison(benchmarks, list(ALPHA[:len(benchmarks)]))
+
     comp_report = []
     job_link = {}
 
@@ -255,21 +468,40 @@ def make_comparison(job_refs, name, hostname):
         # usually only one report is generated by NVIDIA but this could change with MP
         data = {}
         for k, val in reports.items():
-            data = val['nvprof']
+            if isinstance(val, dict) and 'nvprof' in val:
+                data = val['nvprof']
+        job_link[a] = {'uid': b['program_uid']}
+        job_ref = db.get_program(by='uid', value=b['program_uid'])[0]
+        job_link[a]['arguments'] = job_ref['arguments']
+
         try:
-            df = pd.read_csv(fakefile.FakeFile(data['csv']))
+            df = pd.read_csv(fakefile.FakeFile(db.load_lines(data['csv'])))
             df['Job'] = a
             comp_report.append(df)
-            job_link[a] = {'uid': b['program_uid']}
-            job_ref = db.get_program(by='uid', value=b['program_uid'])[0]
-            job_link[a]['arguments'] = job_ref['arguments']
         except Exception as e:
             print('Was not able to read CSV back for {}'.format(a))
             print(e)
 
-    if len(comp_report) == 0:
+    if len(comp_report) == 0 and not metrics_html:
         return ''
 
+    job_description = [
+        '<li>{} | {} | {}</li>'.format(job_ref['uid'], key, ' '.join(job_ref['arguments']))
+        for key, job_ref in job_link.items()
+    ]
+
+    if len(comp_report) == 0:
+        return html.make_page("""
+            <h1> Jobs </h1>
+
+            <ul>
+                <li>Name: {}</li>
+                <li>Machine: {}</li>
+            </ul>
+            <ul>{}</ul>
+            {}
+        """.format(name, hostname, ''.join(job_description), metrics_html))
+
     total = pd.concat(comp_report, ignore_index=True)
 
     for col in FLOAT_COLS:
@@ -277,11 +509,6 @@ def make_comparison(job_refs, name, hostname):
 
     total = total.sort_values(by=['Time(%)'], ascending=False)
 
-    job_description = [
-        '<li>{} | {} | {}</li>'.format(job_ref['uid'], key, ' '.join(job_ref['arguments']))
-        for key, job_ref in job_link.items()
-    ]
-
     gpu_html, api_html = html_reports(total, SELECTED_COLS_COMP)
 
     page = """
@@ -292,17 +519,25 @@ def make_comparison(job_refs, name, hostname):
             <li>Machine: {}</li>
         </ul>
         <ul>{}</ul>
-
+        {}
         <h1>GPU Activities</h1>
         {}
         <h1>API Calls </h1>
         {}
-    """.format(name, hostname, ''.join(job_description), gpu_html, api_html)
+    """.format(name, hostname, ''.join(job_description), metrics_html, gpu_html, api_html)
 
     return html.make_page(page)
 
 
 def main():
+    global db
+
+    parser = argparse.ArgumentParser(description='Web interface to consult and compare experiments')
+    parser.add_argument('database', nargs='?', default=database.TINY_DB,
+                        help='path or URL of the database (e.g. benchmark.db, sqlite://benchmark.db)')
+    args = parser.parse_args()
+
+    db = database.ExperienceDatabase(args.database)
     app.run()
 
 
@@ -0,0 +1,285 @@
+import csv
+import glob
+import json
+import math
+import os
+from typing import *
+
+import numpy as np
+
+from experience_tracker.database import ExperienceDatabase
+from experience_tracker.stats import StatStream, QuantileStream, Histogram, WindowedStream
+import experience_tracker.stats as stats
+
+STATE_FILE = 'export.json'
+
+# column name -> numpy dtype
+METRIC_COLUMNS = {
+    'observation_id': np.int64,
+    'program_uid': str,
+    'system_uid': str,
+    'date': str,
+    'namespace': str,
+    'key': str,
+    # numeric logger values, NaN for streams and non numeric values
+    'value': np.float64,
+    # non numeric logger values as JSON
+    'text': str,
+    # statistics summaries, NaN for plain values
+    'count': np.float64,
+    'avg': np.float64,
+    'sd': np.float64,
+    'min': np.float64,
+    'max': np.float64,
+    # QuantileStream/Histogram percentiles
+    'p50': np.float64,
+    'p95': np.float64,
+    'p99': np.float64,
+    # WindowedStream samples per second over the whole run
+    'rate': np.float64,
+    # offered / recorded observations of sampled streams (1 when not sampled), multiply count and rate by it
+    'sampling_scale': np.float64,
+}
+
+# WindowedStream series, one row per window
+WINDOW_COLUMNS = {
+    'observation_id': np.int64,
+    'program_uid': str,
+    'system_uid': str,
+    'namespace': str,
+    'key': str,
+    'start': np.float64,
+    'duration': np.float64,
+    'count': np.int64,
+    'samples': np.float64,
+    'rate': np.float64,
+    'mean': np.float64,
+    'min': np.float64,
+    'max': np.float64,
+}
+
+KERNEL_COLUMNS = {
+    'observation_id': np.int64,
+    'program_uid': str,
+    'system_uid': str,
+    'report': str,
+    'type': str,
+    'name': str,
+    'time_pct': np.float64,
+    'time': np.float64,
+    'calls': np.float64,
+    'avg': np.float64,
+    'min': np.float64,
+    'max': np.float64,
+}
+
+# nvprof csv column -> kernel column
+NVPROF_COLUMNS = {
+    'Type': 'type',
+    'Name': 'name',
+    'Time(%)': 'time_pct',
+    'Time': 'time',
+    'Calls': 'calls',
+    'Avg': 'avg',
+    'Min': 'min',
+    'Max': 'max',
+}
+
+
+def to_float(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def stream_summary(value) -> Optional[Dict[str, float]]:
+    summary = stats.peek(value)
+
+    # read from the header of the state without rebuilding the stream
+    if summary is not None and summary['type'] == 'StatStream':
+        return {'count': summary['count'], 'avg': summary['avg'], 'sd': summary['sd'], 'min': summary['min'],
+                'max': summary['max'], 'sampling_scale': stats.scale(summary)}
+
+    if summary is not None and summary['type'] == 'RawSamples':
+        return {'count': summary['count'], 'min': summary['min'], 'max': summary['max'], 'sampling_scale': 1.0}
+
+    value = stats.decode(value)
+
+    if isinstance(value, StatStream):
+        summary = {'count': value.count, 'avg': value.avg, 'sd': value.sd, 'min': value.min, 'max': value.max}
+
+    elif isinstance(value, (QuantileStream, Histogram)):
+        p50, p95, p99 = value.quantiles([0.5, 0.95, 0.99])
+        summary = {'count': value.count, 'min': value.min, 'max': value.max, 'p50': p50, 'p95': p95, 'p99': p99}
+
+        if isinstance(value, Histogram):
+            summary['avg'] = value.avg
+
+    elif isinstance(value, WindowedStream):
+        series = value.series()
+        summary = {'count': value.count, 'avg': value.avg, 'rate': value.rate,
+                   'min': min((w['min'] for w in series), default=math.nan),
+                   'max': max((w['max'] for w in series), default=math.nan)}
+    else:
+        return None
+
+    summary['sampling_scale'] = stats.scale(value)
+    return summary
+
+
+class Columns:
+    """ accumulate rows column by column """
+
+    def __init__(self, columns: Dict[str, Any]):
+        self.types = columns
+        self.data: Dict[str, List] = {name: [] for name in columns}
+
+    def append(self, **row):
+        for name, dtype in self.types.items():
+            default = math.nan if dtype is np.float64 else ''
+            self.data[name].append(row.get(name, default))
+
+    def __len__(self):
+        return len(self.data['observation_id'])
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        return {name: np.array(values, dtype=self.types[name]) for name, values in self.data.items()}
+
+
+def add_metrics(table: Columns, windows: Columns, obs: Dict, namespace: str, values: Dict):
+    common = dict(observation_id=obs['id'], program_uid=obs.get('program_uid', ''),
+                  system_uid=obs.get('system_uid', ''), date=obs.get('date', ''), namespace=namespace)
+
+    for key, value in values.items():
+        summary = stream_summary(value)
+
+        if stats.is_encoded(value) and value['__stat__'] == 'WindowedStream':
+            add_windows(windows, obs, namespace, key, stats.decode(value))
+
+        if summary is not None:
+            table.append(key=key, **summary, **common)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            table.append(key=key, value=float(value), **common)
+        else:
+            table.append(key=key, text=json.dumps(value, default=str), **common)
+
+
+def add_windows(table: Columns, obs: Dict, namespace: str, key: str, stream: WindowedStream):
+    common = dict(observation_id=obs['id'], program_uid=obs.get('program_uid', ''),
+                  system_uid=obs.get('system_uid', ''), namespace=namespace, key=key)
+
+    for window in stream.series():
+        table.append(**window, **common)
+
+
+def add_kernels(table: Columns, obs: Dict, report_name: str, lines: List[str]):
+    common = dict(observation_id=obs['id'], program_uid=obs.get('program_uid', ''),
+                  system_uid=obs.get('system_uid', ''), report=report_name)
+
+    for row in csv.DictReader(lines):
+        # nvprof writes a line of units right after the header
+        if not row.get('Type'):
+            continue
+
+        values = {}
+        for col, name in NVPROF_COLUMNS.items():
+            raw = row.get(col, '')
+            values[name] = raw if KERNEL_COLUMNS[name] is str else to_float(raw)
+
+        table.append(**values, **common)
+
+
+def read_state(folder: str) -> Dict:
+    path = os.path.join(folder, STATE_FILE)
+    if not os.path.exists(path):
+        return {'last_id': None, 'parts': 0}
+
+    with open(path, 'r') as file:
+        return json.load(file)
+
+
+def write_state(folder: str, state: Dict):
+    tmp = os.path.join(folder, STATE_FILE + '.tmp')
+    with open(tmp, 'w') as file:
+        json.dump(state, file)
+    os.replace(tmp, os.path.join(folder, STATE_FILE))
+
+
+def write_npz(path: str, arrays: Dict[str, np.ndarray]):
+    np.savez_compressed(path + '.npz', **arrays)
+
+
+def require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError('parquet export requires pyarrow (pip install pyarrow)')
+
+
+def write_parquet(path: str, arrays: Dict[str, np.ndarray]):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    pq.write_table(pa.table(arrays), path + '.parquet')
+
+
+WRITERS = {
+    'npz': write_npz,
+    'parquet': write_parquet,
+}
+
+
+def export(db: ExperienceDatabase, folder: str, fmt: str = 'npz') -> Dict[str, int]:
+    """
+        Flatten the observations added since the last export into columnar tables:
+            - metrics: logger key/values and statistics summaries, one row per (observation, namespace, key)
+            - windows: WindowedStream series, one row per (observation, namespace, key, window)
+            - kernels: nvprof rows, one row per (observation, report, kernel/api call)
+
+        Each export writes a new part (`metrics-00001.npz`, `kernels-00001.npz`, ...) in `folder`,
+        the id of the last exported observation is saved in `folder/export.json`
+    """
+    if fmt == 'parquet':
+        require_pyarrow()
+
+    os.makedirs(folder, exist_ok=True)
+    state = read_state(folder)
+
+    if state.get('format', fmt) != fmt:
+        raise RuntimeError('`{}` holds a {} export, cannot append {} parts'.format(folder, state['format'], fmt))
+
+    metrics = Columns(METRIC_COLUMNS)
+    kernels = Columns(KERNEL_COLUMNS)
+    windows = Columns(WINDOW_COLUMNS)
+    last_id = state['last_id']
+    count = 0
+
+    for obs in db.iter_observations(fields=['program_uid', 'system_uid', 'date', 'reports'], after=last_id):
+        for name, report in (obs.get('reports') or {}).items():
+            if isinstance(report, dict) and isinstance(report.get('nvprof'), dict):
+                add_kernels(kernels, obs, name, db.load_lines(report['nvprof']['csv']) or [])
+            elif isinstance(report, dict):
+                add_metrics(metrics, windows, obs, name, report)
+
+        last_id = obs['id']
+        count += 1
+
+    if count > 0:
+        part = state['parts'] + 1
+        WRITERS[fmt](os.path.join(folder, 'metrics-{:05d}'.format(part)), metrics.arrays())
+        WRITERS[fmt](os.path.join(folder, 'kernels-{:05d}'.format(part)), kernels.arrays())
+        WRITERS[fmt](os.path.join(folder, 'windows-{:05d}'.format(part)), windows.arrays())
+        write_state(folder, {'last_id': last_id, 'parts': part, 'format': fmt})
+
+    return {'observations': count, 'metrics': len(metrics), 'kernels': len(kernels), 'windows': len(windows)}
+
+
+def load_npz(folder: str, table: str) -> Dict[str, np.ndarray]:
+    """ concatenate all the npz parts of `table` (`metrics`, `windows` or `kernels`) """
+    parts = [np.load(path) for path in sorted(glob.glob(os.path.join(folder, '{}-*.npz'.format(table))))]
+    if len(parts) == 0:
+        return {}
+
+    return {name: np.concatenate([part[name] for part in parts]) for name in parts[0].files}
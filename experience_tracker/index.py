@@ -0,0 +1,77 @@
+import threading
+from typing import *
+
+from experience_tracker.backends import Backend, Table
+
+
+class TableIndex:
+    """
+        In-memory hash indexes `field -> value -> documents` over a table, lookups are O(1) whatever the backend.
+
+        The indexes are built on the first lookup, updated in place with the documents we write
+        and rebuilt when the backend's `data_version` says someone else modified the database.
+
+        The explorer serves threaded requests, rebuilds and updates hold `lock` so a lookup never sees
+        half-built indexes
+    """
+
+    def __init__(self, table: Table, fields: Tuple[str, ...], backend: Backend):
+        self.table = table
+        self.fields = fields
+        self.backend = backend
+        self.version = None
+        self.built = False
+        self.docs: Dict[int, Dict] = {}
+        self.indexes: Dict[str, Dict[Any, Dict[int, Dict]]] = {}
+        self.lock = threading.RLock()
+
+    def invalidate(self):
+        with self.lock:
+            self.built = False
+            self.docs = {}
+            self.indexes = {}
+
+    def _ensure(self):
+        # called with the lock held
+        version = self.backend.data_version()
+        if self.built and version == self.version:
+            return
+
+        # version is read before loading, writes made during the load trigger a new rebuild
+        self.invalidate()
+        self.version = version
+        self._add(self.table.all())
+        self.built = True
+
+    def _add(self, docs: List[Dict]):
+        for doc in docs:
+            self._remove(doc['id'])
+            self.docs[doc['id']] = doc
+
+            for field in self.fields:
+                self.indexes.setdefault(field, {}).setdefault(doc.get(field), {})[doc['id']] = doc
+
+    def _remove(self, doc_id: int):
+        old = self.docs.pop(doc_id, None)
+        if old is None:
+            return
+
+        for field in self.fields:
+            self.indexes[field][old.get(field)].pop(doc_id, None)
+
+    def update(self, docs: List[Dict]):
+        """ keep the indexes consistent with the documents we just wrote """
+        with self.lock:
+            if self.built:
+                self._add([dict(doc) for doc in docs])
+
+    def lookup(self, field: str, value) -> List[Dict]:
+        if field not in self.fields:
+            return self.table.search(**{field: value})
+
+        with self.lock:
+            self._ensure()
+            matches = self.indexes.get(field, {}).get(value, {})
+
+            # copies, callers are allowed to modify the documents
+            return [dict(matches[doc_id]) for doc_id in sorted(matches)]
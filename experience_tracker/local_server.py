@@ -1,18 +1,25 @@
+import os
+import tempfile
+
 from flask_classful import FlaskView, route
 from flask import Flask, request
 from multiprocessing import Process
 from typing import *
 
-from experience_tracker.stats import StatStream
+from experience_tracker.stats import StatStream, QuantileStream, Histogram, WindowedStream, merge_sampling, decode
+from experience_tracker.transport import JSON_KINDS
 
+# route -> kind of stream created by `/float/<kind>`
+STREAMS = {
+    'stream': StatStream,
+    'quantiles': QuantileStream,
+    'histogram': Histogram,
+    'windowed': WindowedStream,
+}
 
-class LocalServer(FlaskView):
-    """
-        This is a local server that is started when the experience tracker is used to wrap around a script.
-        This allow the  wrapped script to send data back to the tracker.
-        The user will use the tracker log utility and will not have to deal with the server directly
-    """
-    route_base = '/'
+
+class Collector:
+    """ namespaces built from the records sent by the tracked program, shared by the HTTP and unix socket servers """
 
     def __init__(self):
         self.namespaces: Dict[str, Dict[str, Any]] = {}
@@ -23,37 +30,117 @@ class LocalServer(FlaskView):
 
         return self.namespaces[name]
 
-    def get_stream(self, namespace, key, drop_nfirst_obs=0):
+    def get_stream(self, namespace, key, drop_nfirst_obs=0, kind=StatStream):
         namespace = self.get_namespace(namespace)
         if key not in namespace:
-            namespace[key] = StatStream(drop_nfirst_obs)
+            namespace[key] = kind(drop_nfirst_obs)
 
         return namespace[key]
 
+    @staticmethod
+    def unknown_streams(records: List[Dict]) -> List[str]:
+        """ kinds of streams that do not exist, a partial state without its `stream` raises a `KeyError` """
+        kinds = (record['stream'] if record['kind'] == 'merge' else record['kind'] for record in records
+                 if record['kind'] not in JSON_KINDS)
+        return sorted(set(kind for kind in kinds if kind not in STREAMS))
+
+    def apply(self, records: List[Dict]):
+        """ records sent by `experience_tracker.transport.BatchTransport` """
+        unknown = self.unknown_streams(records)
+        if unknown:
+            raise KeyError('unknown streams `{}`'.format(', '.join(unknown)))
+
+        for record in records:
+            if record['kind'] == 'push':
+                self.get_namespace(record['namespace'])[record['key']] = record['value']
+            elif record['kind'] in JSON_KINDS:
+                # nothing is done with the program and the system, see `LocalServer.set_program`
+                continue
+            elif record['kind'] == 'merge':
+                self.merge(record)
+            else:
+                self.record(record['kind'], record)
+
+    def merge(self, json):
+        """ partial state of a stream aggregated by the client, see `RemoteNamespace.aggregate` """
+        namespace = self.get_namespace(json['namespace'])
+        partial = decode(json['state'])
+
+        if json['key'] in namespace:
+            namespace[json['key']].merge(partial)
+        else:
+            namespace[json['key']] = partial
+
+    def record(self, kind, json):
+        stream = self.get_stream(json['namespace'], json['key'], json['drop_obs'], kind=STREAMS[kind])
+
+        # counts of the values sampled out by the client since its last record
+        if 'sampling' in json:
+            stream.sampling = merge_sampling(stream.sampling, json['sampling'])
+
+        # windowed streams are timestamped by the client
+        extra = {'samples': json['samples'], 'now': json['time']} if 'time' in json else {}
+
+        if isinstance(json['value'], list):
+            stream.update_many(json['value'], **extra)
+        else:
+            stream.update(float(json['value']), **extra)
+
+
+class LocalServer(FlaskView):
+    """
+        This is a local server that is started when the experience tracker is used to wrap around a script.
+        This allow the  wrapped script to send data back to the tracker.
+        The user will use the tracker log utility and will not have to deal with the server directly
+    """
+    route_base = '/'
+
+    # flask_classful makes one instance per route, the routes must share the namespaces
+    collector = Collector()
+    namespaces = collector.namespaces
+
     @route('/push', methods=['POST'])
     def push(self):
         print('receiving_pushing_key_value')
         json = request.json
-        self.get_namespace(json['namespace'])[json['key']] = json['value']
+        self.collector.get_namespace(json['namespace'])[json['key']] = json['value']
 
         return '', 204
 
-    @route('/float/stream', methods=['POST'])
-    def push_stat_stream(self):
+    @route('/float/<kind>', methods=['POST'])
+    def push_stat_stream(self, kind):
         print('receiving_pushing_to_stream')
-        json = request.json
-        self.get_namespace(json['namespace'])[json['key']] = json['value']
+        if kind not in STREAMS:
+            return 'unknown stream `{}`'.format(kind), 404
 
         try:
-            val = float(json['value'])
-            stream = self.get_stream(json['namespace'], json['key'], json['drop_obs'])
-            stream += val
-
+            self.collector.record(kind, request.json)
             return '', 204
         except Exception as e:
             print('push_stat_stream is expecting a float!')
             raise e
 
+    @route('/batch', methods=['POST'])
+    def push_batch(self):
+        """ records sent by `experience_tracker.transport.BatchTransport` """
+        records = request.json['records']
+        unknown = self.collector.unknown_streams(records)
+
+        if unknown:
+            return 'unknown streams `{}`'.format(', '.join(unknown)), 404
+
+        self.collector.apply(records)
+        return '', 204
+
+    @route('/merge', methods=['POST'])
+    def push_partial(self):
+        """ partial state of a stream aggregated by the client, see `RemoteNamespace.aggregate` """
+        if request.json['stream'] not in STREAMS:
+            return 'unknown stream `{}`'.format(request.json['stream']), 404
+
+        self.collector.merge(request.json)
+        return '', 204
+
     @route('/program', methods=['POST'])
     def set_program(self):
         json = request.json
@@ -73,6 +160,11 @@ class LocalServer(FlaskView):
         return '', 204
 
 
+def socket_path() -> str:
+    """ unix socket of the tracker of this job, one per `exp-tracker` process """
+    return os.path.join(tempfile.gettempdir(), 'exp-tracker-{}.sock'.format(os.getpid()))
+
+
 def start_local_server(port) -> Flask:
     app = Flask('BenchTrackerLocalServer')
     LocalServer.register(app)
@@ -1,76 +1,391 @@
+import atexit
+import os
 import requests
 import sys
 import datetime
+import time
 
 from typing import *
 from experience_tracker.database import System
 from experience_tracker.database import Program
 from experience_tracker.database import Observation
-from experience_tracker.database import ExperienceDatabase
-from experience_tracker.stats import StatStream
+from experience_tracker.database import ExperienceDatabase, TINY_DB
+from experience_tracker.checkpoint import Checkpointer, checkpoint_folder, run_header
+from experience_tracker.stats import StatStream, QuantileStream, Histogram, WindowedStream, RawSamples
+from experience_tracker.stats import is_scalar, as_floats, merge_sampling, encode
+from experience_tracker.timer import Timer
+from experience_tracker.sampling import Sampled, ClientSampler, make_sampler
+from experience_tracker.transport import BatchTransport, SOCKET_ENV, uds_sender
 
 #
-#   Might be useful to make all the logging be async
-#   have another python process sending the messages across
-#   and just have the main thread push messages
+#   Remote logging is asynchronous by default, the records are sent by batches
+#   from a background thread (see `experience_tracker.transport`)
+
+
+# raw observations of `key` are saved as `key + RAW_SUFFIX`, see `LocalNamespace.retain`
+RAW_SUFFIX = '.raw'
+
+# stream type -> local server route
+ROUTES = {
+    StatStream: 'stream',
+    QuantileStream: 'quantiles',
+    Histogram: 'histogram',
+    WindowedStream: 'windowed',
+}
+KINDS = {route: kind for kind, route in ROUTES.items()}
 
 
 class RemoteNamespace:
-    def __init__(self, name):
+    def __init__(self, name, transport: BatchTransport = None, send: Callable[[List[Dict]], None] = None):
         self.name = name
+        # records are sent synchronously without transport, with `send` or posted to the HTTP routes
+        self.transport = transport
+        self.send = send
+        self.sampling = None
+        self.samplers: Dict[Tuple[str, str], ClientSampler] = {}
+
+        # partial streams when the values are aggregated before being sent, see `aggregate`
+        self.partials: Dict[Tuple[str, str], Any] = None
+        self.interval = None
+        self.shipped = 0
+        self.at_exit = False
+
+    def aggregate(self, interval: float = 1.0) -> 'RemoteNamespace':
+        """
+            Aggregate the values in this process and only send the partial state of the streams
+            (count, mean, m2, min, max, sketches...) every `interval` seconds and at exit, the server merges them.
+            Pushing a value costs about the same as with a `LocalNamespace`
+        """
+        self.partials = {}
+        self.interval = interval
+        self.shipped = time.monotonic()
+        self._flush_at_exit()
+        return self
+
+    def _flush_at_exit(self):
+        if not self.at_exit:
+            atexit.register(self.flush)
+            self.at_exit = True
+
+    def ship(self):
+        """ send the partial states of the streams that received values since the last call """
+        self.shipped = time.monotonic()
+
+        for (kind, key), partial in self.partials.items():
+            if partial.current_count == 0 and partial.sampling is None:
+                continue
+
+            self._send({
+                'kind': 'merge',
+                'stream': kind,
+                'namespace': self.name,
+                'key': key,
+                'state': encode(partial)
+            }, 'merge')
+
+            self.partials[(kind, key)] = self._next_partial(partial)
+
+    @staticmethod
+    def _next_partial(partial):
+        # the observations still to drop, the layout and the EWMAs carry over
+        drop_obs = max(partial.drop_obs - partial.current_count, 0)
+
+        if isinstance(partial, Histogram):
+            return Histogram(drop_obs, partial.lowest, partial.highest, partial.precision)
+
+        if isinstance(partial, QuantileStream):
+            return QuantileStream(drop_obs, partial.k, partial.c)
+
+        stream = type(partial)(drop_obs)
+        if isinstance(partial, WindowedStream):
+            stream.ewma = partial.ewma
+            stream.ewma_rate = partial.ewma_rate
+
+        return stream
+
+    def sample(self, every: int = None, per_second: float = None, reservoir: int = None) -> 'RemoteNamespace':
+        """
+            Only send a sample of the values pushed to the streams of this namespace, see `LocalNamespace.sample`.
+            Sampling happens before the HTTP request; reservoirs are sent by `flush` (called at exit)
+        """
+        make_sampler(every, per_second, reservoir)
+        self.sampling = dict(every=every, per_second=per_second, reservoir=reservoir)
+        self._flush_at_exit()
+        return self
+
+    def flush(self):
+        """ send the reservoirs, the sampling counts of the values that were not sent and the partial states """
+        for (kind, key), sampler in self.samplers.items():
+            values, sampling = sampler.flush()
+
+            if sampling['offered'] > 0:
+                self._record(kind, key, values, 0, sampling=sampling)
+
+        if self.partials is not None:
+            self.ship()
 
     def push(self, key, value):
-        print('pushing_key_value')
-        requests.post('http://localhost:8123/push', json={
+        record = {
+            'kind': 'push',
             'namespace': self.name,
             'key': key,
             'value': value
-        })
+        }
+
+        self._send(record, 'push')
 
     def push_stream(self, key, value, drop_obs=0):
-        print('pushing_to_stream')
-        requests.post('http://localhost:8123/float/stream', json={
+        """ `value` is a float or a batch of floats (numpy array, list, ...) """
+        self._push_values('stream', key, value, drop_obs)
+
+    def push_quantiles(self, key, value, drop_obs=0):
+        """ like `push_stream` but keeps a quantile sketch (p50/p95/p99) instead of avg/sd """
+        self._push_values('quantiles', key, value, drop_obs)
+
+    def push_histogram(self, key, value, drop_obs=0):
+        """ like `push_stream` but keeps the full distribution in a log-bucketed histogram """
+        self._push_values('histogram', key, value, drop_obs)
+
+    def push_windowed(self, key, value, samples=1, drop_obs=0):
+        """ per time window aggregates of `value`, `samples` is the work done by each value (e.g. batch size) """
+        self._push_values('windowed', key, value, drop_obs, samples=samples, time=time.time())
+
+    def timer(self, key, drop_obs=0, kind=StatStream, subtract_overhead=False) -> Timer:
+        """ context manager/decorator pushing the elapsed time of a region to `key`, see `Timer` """
+        route = ROUTES[kind]
+        return Timer(lambda value: self._push_values(route, key, value, drop_obs), subtract_overhead)
+
+    def _push_values(self, kind, key, value, drop_obs, **extra):
+        if self.sampling is not None:
+            sampler = self.samplers.get((kind, key))
+
+            if sampler is None:
+                sampler = ClientSampler(make_sampler(**self.sampling), drop_obs, windowed=kind == 'windowed')
+                self.samplers[(kind, key)] = sampler
+
+            value = sampler.filter(value)
+            if value is None:
+                return
+
+            # the warmup was done by the sampler
+            drop_obs = 0
+            extra['sampling'] = sampler.report()
+
+        self._record(kind, key, value, drop_obs, **extra)
+
+    def _record(self, kind, key, value, drop_obs, **extra):
+        if self.partials is None:
+            return self._post(kind, key, value, drop_obs, **extra)
+
+        partial = self.partials.get((kind, key))
+        if partial is None:
+            partial = self.partials[(kind, key)] = KINDS[kind](drop_obs)
+
+        if 'sampling' in extra:
+            partial.sampling = merge_sampling(partial.sampling, extra.pop('sampling'))
+
+        # windowed streams are timestamped when the value is pushed
+        if 'time' in extra:
+            extra['now'] = extra.pop('time')
+
+        if is_scalar(value):
+            partial.update(value, **extra)
+        else:
+            partial.update_many(value, **extra)
+
+        if time.monotonic() - self.shipped >= self.interval:
+            self.ship()
+
+    def _post(self, kind, key, value, drop_obs, **extra):
+        if not is_scalar(value):
+            value = as_floats(value)
+            value = value.tolist() if hasattr(value, 'tolist') else value
+
+        self._send(dict({
+            'kind': kind,
             'namespace': self.name,
             'key': key,
             'value': value,
             'drop_obs': drop_obs
-        })
+        }, **extra), 'float/{}'.format(kind))
+
+    def _send(self, record, route):
+        if self.transport is not None:
+            self.transport.put(record)
+        elif self.send is not None:
+            self.send([record])
+        else:
+            requests.post('http://localhost:8123/{}'.format(route), json=record)
 
 
 class RemoteTrackLogger:
     """
         Implement a `print` so output is saved
+
+        With `asynchronous` the metrics are queued and sent by a background thread,
+        `transport_options` are forwarded to `BatchTransport` (max_batch, interval, capacity, policy).
+        With `aggregate=seconds` the streams are aggregated in this process and only their partial states
+        are sent, see `RemoteNamespace.aggregate`.
+
+        When the program is wrapped by `exp-tracker --server` the records are sent on the unix socket of the job
+        (`$EXP_TRACKER_SOCKET`) instead of HTTP
     """
 
+    def __init__(self, asynchronous=True, aggregate: float = None, **transport_options):
+        # synchronous records are only sent with a sender on the job socket, otherwise to the HTTP routes
+        self.send = transport_options.get('send')
+        if self.send is None and os.environ.get(SOCKET_ENV):
+            self.send = transport_options['send'] = uds_sender(os.environ[SOCKET_ENV])
+
+        self.transport = BatchTransport(**transport_options) if asynchronous else None
+        self.aggregate = aggregate
+        self.namespaces: Dict[str, RemoteNamespace] = {}
+
     def set_system(self):
-        requests.post('http://localhost:8123/system', json=System.get_system().as_json())
+        self._describe('system', System.get_system().as_json())
 
     def set_program(self, name: str, args: List[str], version: str):
-        requests.post('http://localhost:8123/program', json=Program(name, args, version).as_json())
+        self._describe('program', Program(name, args, version).as_json())
+
+    def _describe(self, kind, value):
+        # sent like the metrics, on the job socket when there is one
+        record = {'kind': kind, 'namespace': '', 'key': '', 'value': value}
+
+        if self.transport is not None:
+            self.transport.put(record)
+        elif self.send is not None:
+            self.send([record])
+        else:
+            requests.post('http://localhost:8123/{}'.format(kind), json=value)
 
     def namespace(self, name: str):
-        return RemoteNamespace(name)
+        # namespaces keep the samplers and the partial streams
+        if name not in self.namespaces:
+            namespace = RemoteNamespace(name, self.transport, self.send)
+
+            if self.aggregate is not None:
+                namespace.aggregate(self.aggregate)
+
+            self.namespaces[name] = namespace
+
+        return self.namespaces[name]
 
     def push(self, key, value, namespace='default'):
-        RemoteNamespace(namespace).push(key, value)
+        self.namespace(namespace).push(key, value)
 
     def push_stream(self, key, value, namespace='default'):
-        RemoteNamespace(namespace).push_stream(key, value)
+        self.namespace(namespace).push_stream(key, value)
+
+    def push_quantiles(self, key, value, namespace='default'):
+        self.namespace(namespace).push_quantiles(key, value)
+
+    def push_histogram(self, key, value, namespace='default'):
+        self.namespace(namespace).push_histogram(key, value)
+
+    def push_windowed(self, key, value, samples=1, namespace='default'):
+        self.namespace(namespace).push_windowed(key, value, samples)
+
+    def timer(self, key, namespace='default', **kwargs) -> Timer:
+        return self.namespace(namespace).timer(key, **kwargs)
+
+    def flush(self):
+        """ send the partial states and wait until the queued metrics were sent """
+        for namespace in self.namespaces.values():
+            namespace.flush()
+
+        if self.transport is not None:
+            self.transport.flush()
 
 
 class LocalNamespace:
     def __init__(self, name, reports):
-        self.reports = {}
-        reports[name] = self.reports
+        # namespaces are created again by each `LocalTrackLogger.push*`, keep what was pushed before
+        self.reports = reports.setdefault(name, {})
+        self.sampling = None
 
     def push(self, key, value):
         self.reports[key] = value
 
+    def sample(self, every: int = None, per_second: float = None, reservoir: int = None) -> 'LocalNamespace':
+        """
+            Only record a sample of the values pushed to the streams created after this call:
+                - every=N       : one call out of N
+                - per_second=K  : at most K calls per second and per key
+                - reservoir=K   : a uniform sample of K values per key (not for windowed streams)
+
+            The statistics carry the sampling metadata (`stream.sampling`), `stats.scale(stream)` extrapolates
+            the counts
+        """
+        make_sampler(every, per_second, reservoir)
+        self.sampling = dict(every=every, per_second=per_second, reservoir=reservoir)
+        return self
+
+    def retain(self, key, size: int = 1024, mode: str = 'reservoir', drop_obs: int = 0) -> 'LocalNamespace':
+        """
+            Keep up to `size` raw observations of the values pushed to `key` (before sampling), saved next to
+            its statistics as `key + '.raw'`:
+                - mode='reservoir': uniform sample of the observations
+                - mode='lttb'     : series downsampled to `size` points keeping its shape
+        """
+        self.reports[key + RAW_SUFFIX] = RawSamples(drop_obs, size, mode)
+        return self
+
     def push_stream(self, key, value, drop_obs=0):
+        """ `value` is a float or a batch of floats (numpy array, list, ...) """
+        self._push_values(StatStream, key, value, drop_obs)
+
+    def push_quantiles(self, key, value, drop_obs=0):
+        """ like `push_stream` but keeps a quantile sketch (p50/p95/p99) instead of avg/sd """
+        self._push_values(QuantileStream, key, value, drop_obs)
+
+    def push_histogram(self, key, value, drop_obs=0):
+        """ like `push_stream` but keeps the full distribution in a log-bucketed histogram """
+        self._push_values(Histogram, key, value, drop_obs)
+
+    def push_windowed(self, key, value, samples=1, drop_obs=0):
+        """ per time window aggregates of `value`, `samples` is the work done by each value (e.g. batch size) """
+        self._push_values(WindowedStream, key, value, drop_obs, samples=samples)
+
+    def timer(self, key, drop_obs=0, kind=StatStream, subtract_overhead=False) -> Timer:
+        """
+            Context manager/decorator pushing the elapsed time (s) of a region to `key`, see `Timer`.
+            The stream is created now so timing a region does not look it up
+        """
         if key not in self.reports:
-            self.reports[key] = StatStream(drop_obs)
+            self.reports[key] = self._make_stream(kind, drop_obs)
 
-        self.reports[key] += value
+        update = self.reports[key].update
+        raw = self.reports.get(key + RAW_SUFFIX)
+
+        if raw is not None:
+            def update_both(value):
+                update(value)
+                raw.update(value)
+
+            return Timer(update_both, subtract_overhead)
+
+        return Timer(update, subtract_overhead)
+
+    def _make_stream(self, kind, drop_obs):
+        if self.sampling is None:
+            return kind(drop_obs)
+
+        return Sampled(kind(drop_obs), make_sampler(**self.sampling))
+
+    def _push_values(self, kind, key, value, drop_obs, **extra):
+        if key not in self.reports:
+            self.reports[key] = self._make_stream(kind, drop_obs)
+
+        raw = self.reports.get(key + RAW_SUFFIX)
+
+        if is_scalar(value):
+            self.reports[key].update(value, **extra)
+            if raw is not None:
+                raw.update(value)
+        else:
+            self.reports[key].update_many(value, **extra)
+            if raw is not None:
+                raw.update_many(value)
 
 
 class LocalTrackLogger:
@@ -84,6 +399,7 @@ class LocalTrackLogger:
         [],
         []
     )
+    checkpointer: Checkpointer = None
 
     def set_system(self):
         pass
@@ -100,18 +416,59 @@ class LocalTrackLogger:
     def push_stream(self, key, value, namespace='default'):
         self.namespace(namespace).push_stream(key, value)
 
+    def push_quantiles(self, key, value, namespace='default'):
+        self.namespace(namespace).push_quantiles(key, value)
+
+    def push_histogram(self, key, value, namespace='default'):
+        self.namespace(namespace).push_histogram(key, value)
+
+    def push_windowed(self, key, value, samples=1, namespace='default'):
+        self.namespace(namespace).push_windowed(key, value, samples)
+
+    def timer(self, key, namespace='default', **kwargs) -> Timer:
+        return self.namespace(namespace).timer(key, **kwargs)
+
     def dump(self):
         self.observation.dump()
 
+    def checkpoint(self, interval: float = 60.0, location: str = TINY_DB) -> Checkpointer:
+        """
+            Save the namespaces changed since the last checkpoint every `interval` seconds from a background thread,
+            in `<database>.checkpoints/<run>.jsonl`. The file is removed by `persist`, the observation of a run
+            that crashed is recovered with `exp-tracker-admin recover <database>`
+        """
+        # like the observation, the checkpointer is shared by the loggers of the process
+        if LocalTrackLogger.checkpointer is None:
+            header = run_header(self.program, self.system, self.observation)
+            path = os.path.join(checkpoint_folder(location), header['run'] + '.jsonl')
+            LocalTrackLogger.checkpointer = Checkpointer(path, self.observation.reports, header, interval).start()
+
+        return LocalTrackLogger.checkpointer
+
     def persist(self):
         db = ExperienceDatabase()
         self.program.add_system(self.system.uid)
-        db.insert_program(self.program)
-        db.insert_system(self.system)
-        db.insert_observation(self.observation)
+
+        # the last state is in the checkpoints if the insert fails
+        if self.checkpointer is not None:
+            self.checkpointer.close()
+
+        with db.batch() as batch:
+            batch.insert_program(self.program)
+            batch.insert_system(self.system)
+            batch.insert_observation(self.observation)
+
+        if self.checkpointer is not None:
+            self.checkpointer.close(remove=True)
 
 
 def make_tracker(mode='local', *args, **kwargs):
     if mode == 'local':
-        return LocalTrackLogger()
-    return RemoteTrackLogger()
+        tracker = LocalTrackLogger()
+
+        # seconds between two checkpoints, see `LocalTrackLogger.checkpoint`
+        if kwargs.get('checkpoint') is not None:
+            tracker.checkpoint(kwargs['checkpoint'])
+
+        return tracker
+    return RemoteTrackLogger(*args, **kwargs)
@@ -0,0 +1,124 @@
+import datetime
+import os
+import time
+from typing import *
+
+from experience_tracker.blobs import is_blob_ref
+from experience_tracker.database import ExperienceDatabase
+
+
+def parse_date(date: str) -> Optional[datetime.datetime]:
+    try:
+        return datetime.datetime.fromisoformat(date)
+    except (TypeError, ValueError):
+        return None
+
+
+def disk_usage(db: ExperienceDatabase) -> int:
+    """ bytes used by the database files and its blob store """
+    total = db.blobs.size()
+    for path in db.backend.files():
+        if os.path.isfile(path):
+            total += os.path.getsize(path)
+    return total
+
+
+def select_expired(db: ExperienceDatabase, keep_last: int) -> List[int]:
+    """ ids of the observations that are not in the `keep_last` most recent of their (program, system) """
+    groups: Dict[Tuple[str, str], List[int]] = {}
+
+    for obs in db.iter_observations(fields=['program_uid', 'system_uid']):
+        groups.setdefault((obs.get('program_uid'), obs.get('system_uid')), []).append(obs['id'])
+
+    expired = []
+    for ids in groups.values():
+        # ids are increasing with insertion time
+        expired.extend(ids[:max(len(ids) - keep_last, 0)])
+
+    return expired
+
+
+def drop_outputs(db: ExperienceDatabase, older_than: datetime.timedelta, skip: Set[int] = frozenset()) -> List[Dict]:
+    """ observations older than `older_than` with their stdout/stderr removed """
+    limit = datetime.datetime.now() - older_than
+    docs = []
+
+    for obs in db.iter_observations():
+        date = parse_date(obs.get('date'))
+
+        if obs['id'] in skip or date is None or date >= limit:
+            continue
+
+        if obs.get('stdout') is None and obs.get('stderr') is None:
+            continue
+
+        obs['stdout'] = None
+        obs['stderr'] = None
+        docs.append(obs)
+
+    return docs
+
+
+def referenced_blobs(db: ExperienceDatabase) -> Set[str]:
+    keys = set()
+
+    def collect(value):
+        if is_blob_ref(value):
+            keys.add(value['blob'])
+        elif isinstance(value, dict):
+            for item in value.values():
+                collect(item)
+
+    for obs in db.iter_observations(fields=['stdout', 'stderr', 'reports']):
+        collect(obs)
+
+    return keys
+
+
+def collect_garbage(db: ExperienceDatabase, grace: float = 3600) -> int:
+    """
+        Remove the blobs that are not referenced anymore, returns the number of blobs removed.
+        Blobs written (or reused) in the last `grace` seconds are kept, they might belong to an observation
+        that is being inserted
+    """
+    now = time.time()
+    used = referenced_blobs(db)
+    unused = [
+        key for key in db.blobs.keys() if key not in used and now - os.path.getmtime(db.blobs.path(key)) > grace
+    ]
+
+    for key in unused:
+        db.blobs.remove(key)
+
+    return len(unused)
+
+
+def compact(db: ExperienceDatabase, keep_last: int = None, drop_outputs_after: datetime.timedelta = None,
+            grace: float = 3600) -> Dict:
+    """
+        Apply the retention policies, remove the unused blobs and rewrite the store compactly.
+
+        keep_last: number of observations to keep for each (program, system)
+        drop_outputs_after: stdout and stderr of observations older than this are removed
+        grace: unreferenced blobs younger than `grace` seconds are kept
+    """
+    removed = []
+    updated = []
+
+    with db.backend.transaction():
+        if keep_last is not None:
+            removed = select_expired(db, keep_last)
+            db.remove_observations(removed)
+
+        if drop_outputs_after is not None:
+            updated = drop_outputs(db, drop_outputs_after, skip=set(removed))
+            db.update_observations(updated)
+
+    blobs = collect_garbage(db, grace)
+    db.backend.compact()
+
+    return {
+        'removed_observations': len(removed),
+        'dropped_outputs': len(updated),
+        'removed_blobs': blobs
+    }
@@ -0,0 +1,270 @@
+import math
+import random
+import time
+from typing import *
+
+from experience_tracker.stats import as_floats, is_scalar
+
+
+class EveryNth:
+    """ record one call out of `n` """
+    mode = 'every'
+
+    def __init__(self, n: int):
+        self.n = n
+        self.offered = 0
+        self.recorded = 0
+
+    def accept(self) -> bool:
+        keep = self.offered % self.n == 0
+        self.offered += 1
+        self.recorded += keep
+        return keep
+
+    def select(self, values):
+        start = (-self.offered) % self.n
+        self.offered += len(values)
+        values = values[start::self.n]
+        self.recorded += len(values)
+        return values
+
+    @property
+    def param(self):
+        return self.n
+
+
+class RateLimit:
+    """ record at most `per_second` calls per second (token bucket, bursts up to one second worth of calls) """
+    mode = 'rate'
+
+    def __init__(self, per_second: float, clock=time.monotonic):
+        self.per_second = per_second
+        self.clock = clock
+        self.tokens = per_second
+        self.last = clock()
+        self.offered = 0
+        self.recorded = 0
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.tokens + (now - self.last) * self.per_second, self.per_second)
+        self.last = now
+
+    def accept(self) -> bool:
+        self.offered += 1
+        self._refill()
+
+        if self.tokens < 1:
+            return False
+
+        self.tokens -= 1
+        self.recorded += 1
+        return True
+
+    def select(self, values):
+        self.offered += len(values)
+        self._refill()
+
+        count = min(int(self.tokens), len(values))
+        if count == 0:
+            return values[:0]
+
+        # spread the recorded values over the batch
+        values = values[::int(math.ceil(len(values) / count))][:count]
+        self.tokens -= len(values)
+        self.recorded += len(values)
+        return values
+
+    @property
+    def param(self):
+        return self.per_second
+
+
+class Reservoir:
+    """
+        Keep a uniform sample of `size` values out of all the values offered (Vitter's algorithm R),
+        the statistics are computed on the sample when they are needed
+    """
+    mode = 'reservoir'
+
+    def __init__(self, size: int, seed=None):
+        self.size = size
+        self.values: List[float] = []
+        self.offered = 0
+        self.rng = random.Random(seed)
+
+    def offer(self, val: float):
+        self.offered += 1
+
+        if len(self.values) < self.size:
+            self.values.append(val)
+            return
+
+        i = self.rng.randrange(self.offered)
+        if i < self.size:
+            self.values[i] = val
+
+    @property
+    def recorded(self) -> int:
+        return len(self.values)
+
+    @property
+    def param(self):
+        return self.size
+
+
+SAMPLERS = {
+    'every': EveryNth,
+    'per_second': RateLimit,
+    'reservoir': Reservoir,
+}
+
+
+def make_sampler(every: int = None, per_second: float = None, reservoir: int = None):
+    options = {'every': every, 'per_second': per_second, 'reservoir': reservoir}
+    options = {name: value for name, value in options.items() if value is not None}
+
+    if len(options) != 1:
+        raise ValueError('Expected exactly one of every, per_second or reservoir')
+
+    name, value = options.popitem()
+    return SAMPLERS[name](value)
+
+
+def metadata(sampler) -> Dict:
+    return {
+        'mode': sampler.mode,
+        'param': sampler.param,
+        'offered': sampler.offered,
+        'recorded': sampler.recorded,
+    }
+
+
+class Sampled:
+    """
+        Stream that only records the values accepted by its sampler.
+        `resolve()` returns the underlying stream with the sampling metadata attached (`stream.sampling`),
+        `stats.scale(stream)` is the factor to apply to counts and rates
+    """
+
+    def __init__(self, stream, sampler):
+        if isinstance(sampler, Reservoir) and hasattr(stream, 'window'):
+            raise ValueError('Reservoir sampling loses the time of the observations, use every or per_second')
+
+        self.stream = stream
+        self.sampler = sampler
+        self.dirty = False
+
+        # the first observations are dropped before sampling
+        self.warmup = stream.drop_obs
+        stream.drop_obs = 0
+
+    def __iadd__(self, other):
+        self.update(other)
+        return self
+
+    def update(self, val, *args, **kwargs):
+        if self.warmup > 0:
+            self.warmup -= 1
+            return
+
+        if isinstance(self.sampler, Reservoir):
+            self.sampler.offer(float(val))
+            self.dirty = True
+
+        elif self.sampler.accept():
+            self.stream.update(val, *args, **kwargs)
+
+    def update_many(self, values, *args, **kwargs):
+        values = as_floats(values)
+
+        if self.warmup > 0:
+            skip = min(self.warmup, len(values))
+            self.warmup -= skip
+            values = values[skip:]
+
+        if isinstance(self.sampler, Reservoir):
+            for val in values:
+                self.sampler.offer(float(val))
+            self.dirty = True
+            return
+
+        values = self.sampler.select(values)
+        if len(values) > 0:
+            self.stream.update_many(values, *args, **kwargs)
+
+    def resolve(self):
+        """ the stream with its sampling metadata, reservoir streams are rebuilt from the sample """
+        if self.dirty:
+            self.stream.reset()
+            self.stream.update_many(self.sampler.values)
+            self.dirty = False
+
+        self.stream.sampling = metadata(self.sampler)
+        return self.stream
+
+    def dump(self, depth=0):
+        self.resolve().dump(depth)
+
+
+class ClientSampler:
+    """
+        Sampling done by the remote namespaces before sending anything to the local server.
+        The server sums the sampling metadata sent with each record (`report()` returns the counts since the last one);
+        reservoirs are only sent by `flush`
+    """
+
+    def __init__(self, sampler, drop_obs: int = 0, windowed: bool = False):
+        if isinstance(sampler, Reservoir) and windowed:
+            raise ValueError('Reservoir sampling loses the time of the observations, use every or per_second')
+
+        self.sampler = sampler
+        self.warmup = drop_obs
+        self.reported = (0, 0)
+
+    def filter(self, value) -> Optional[Any]:
+        """ values to send now, None if nothing has to be sent """
+        if is_scalar(value):
+            if self.warmup > 0:
+                self.warmup -= 1
+                return None
+
+            if isinstance(self.sampler, Reservoir):
+                self.sampler.offer(float(value))
+                return None
+
+            return value if self.sampler.accept() else None
+
+        values = as_floats(value)
+        if self.warmup > 0:
+            skip = min(self.warmup, len(values))
+            self.warmup -= skip
+            values = values[skip:]
+
+        if isinstance(self.sampler, Reservoir):
+            for val in values:
+                self.sampler.offer(float(val))
+            return None
+
+        values = self.sampler.select(values)
+        return values if len(values) > 0 else None
+
+    def report(self) -> Dict:
+        meta = metadata(self.sampler)
+        meta['offered'] -= self.reported[0]
+        meta['recorded'] -= self.reported[1]
+        self.reported = (self.sampler.offered, self.sampler.recorded)
+        return meta
+
+    def flush(self) -> Tuple[List[float], Dict]:
+        """ values that still need to be sent (reservoir) with the counts not reported yet """
+        meta = self.report()
+
+        if not isinstance(self.sampler, Reservoir):
+            return [], meta
+
+        # the next values go to a new reservoir
+        values = self.sampler.values
+        self.sampler = Reservoir(self.sampler.size)
+        self.reported = (0, 0)
+        return values, meta
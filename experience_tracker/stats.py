@@ -1,27 +1,54 @@
+import array
+import base64
+import collections
 import math
+import numbers
+import random
+import struct
+import sys
+import time
+from typing import *
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# version of the binary states, see `pack_header`
+FORMAT_VERSION = 1
+
+# common to all the binary states: version, type code, drop_obs, seen, count, last, min, max
+HEADER = struct.Struct('<BBqqqddd')
 
 
 class StatStream(object):
     """
-        Store the sum of the observations of the sum of the observation squared
+        Store the count, the mean and the sum of squared deviations (m2) of the observations (Welford)
         The first few observations are discarded (usually slower than the rest)
 
         The average and the standard deviation is computed at the user's request
 
-        In order to make the computation stable we store the first observation and subtract it to every other
-        observations. The idea is if x ~ N(mu, sigma)  x - x0 and the sum of x - x0 should be close(r) to 0 allowing
-        for greater precision; without that trick `var` was getting negative on some iteration.
+        Streams computed in different threads/processes/nodes can be combined with `merge` (Chan et al.);
+        `state()` is the JSON serializable partial state that is shipped instead of the raw values
     """
+    __slots__ = ('drop_obs', 'current_count', 'current_obs', 'n', 'mean', 'm2', 'min', 'max', 'sampling')
+
+    # binary state after the header: mean, m2
+    LAYOUT = struct.Struct('<dd')
+
     def __init__(self, drop_first_obs=10):
         self.reset()
         self.drop_obs = drop_first_obs
+        # set when the stream only recorded a sample of the observations, see `experience_tracker.sampling`
+        self.sampling = None
 
     def reset(self):
-        self.sum = 0.0
-        self.sum_sqr = 0.0
+        # number of observations received, dropped ones included
         self.current_count = 0
         self.current_obs = 0
-        self.first_obs = 0
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
         self.min = float('inf')
         self.max = float('-inf')
 
@@ -31,38 +58,147 @@ class StatStream(object):
 
     def update(self, val, weight=1):
         self.current_count += weight
+        self.current_obs = val
 
-        if self.current_count < self.drop_obs:
-            self.current_obs = val
+        accepted = self.current_count - self.drop_obs
+        if accepted <= 0:
             return
 
-        if self.count == 1:
-            self.first_obs = val
+        # part of the weight can fall in the dropped observations
+        if weight > accepted:
+            weight = accepted
 
-        self.current_obs = val - self.first_obs
-        self.sum += float(self.current_obs) * float(weight)
-        self.sum_sqr += float(self.current_obs * self.current_obs) * float(weight)
+        # hot path (timers), avoid the builtins and the attribute lookups
+        val = float(val)
+        n = self.n + weight
+        mean = self.mean
+        delta = val - mean
+        mean += delta * weight / n
 
-        self.min = min(self.min, val)
-        self.max = max(self.max, val)
+        self.n = n
+        self.mean = mean
+        self.m2 += delta * (val - mean) * weight
+
+        if val < self.min:
+            self.min = val
+        if val > self.max:
+            self.max = val
+
+    def update_many(self, values):
+        """
+            Fold a batch of observations (numpy array, array.array, memoryview, list...) at once.
+            The first `drop_obs` observations are dropped even if they are spread across batches
+        """
+        values = as_floats(values)
+        n = len(values)
+        if n == 0:
+            return
+
+        skip = max(self.drop_obs - self.current_count, 0)
+        self.current_count += n
+        self.current_obs = float(values[-1])
+
+        if skip >= n:
+            return
+
+        values = values[skip:]
+        n = len(values)
+
+        if np is not None:
+            mean = float(values.mean())
+            deviations = values - mean
+            m2 = float(np.dot(deviations, deviations))
+            low, high = float(values.min()), float(values.max())
+        else:
+            mean = math.fsum(values) / n
+            m2 = math.fsum((v - mean) ** 2 for v in values)
+            low, high = min(values), max(values)
+
+        self._combine(n, mean, m2, low, high)
+
+    def _combine(self, n, mean, m2, low, high):
+        total = self.n + n
+        delta = mean - self.mean
+
+        self.mean += delta * n / total
+        self.m2 += m2 + delta * delta * self.n * n / total
+        self.n = total
+        self.min = min(self.min, low)
+        self.max = max(self.max, high)
+
+    def merge(self, other: 'StatStream') -> 'StatStream':
+        """ fold the observations of `other` into this stream, the result does not depend on the merge order """
+        self.current_count += other.current_count
+        self.sampling = merge_sampling(self.sampling, other.sampling)
+
+        if other.n > 0:
+            self._combine(other.n, other.mean, other.m2, other.min, other.max)
+            self.current_obs = other.current_obs
+
+        return self
+
+    @staticmethod
+    def merge_all(streams: Iterable['StatStream'], drop_first_obs=0) -> 'StatStream':
+        result = StatStream(drop_first_obs)
+        for stream in streams:
+            result.merge(stream)
+        return result
+
+    def state(self) -> Dict:
+        return {
+            'drop_obs': self.drop_obs,
+            'seen': self.current_count,
+            'last': self.current_obs,
+            'count': self.n,
+            'mean': self.mean,
+            'm2': self.m2,
+            # JSON has no infinity
+            'min': self.min if self.n > 0 else None,
+            'max': self.max if self.n > 0 else None,
+        }
+
+    @staticmethod
+    def from_state(state: Dict) -> 'StatStream':
+        self = StatStream(state['drop_obs'])
+        self.current_count = state['seen']
+        self.current_obs = state['last']
+        self.n = state['count']
+        self.mean = state['mean']
+        self.m2 = state['m2']
+
+        if self.n > 0:
+            self.min = state['min']
+            self.max = state['max']
+
+        return self
+
+    def pack(self) -> bytes:
+        return pack_header(self, self.min, self.max) + StatStream.LAYOUT.pack(self.mean, self.m2)
+
+    @staticmethod
+    def unpack(data: bytes) -> 'StatStream':
+        header = unpack_header(data, StatStream)
+        self = StatStream(header['drop_obs'])
+        set_header(self, header)
+        self.mean, self.m2 = StatStream.LAYOUT.unpack_from(data, HEADER.size)
+        return self
 
     @property
     def val(self) -> float:
-        return self.current_obs + self.first_obs
+        return self.current_obs
 
     @property
-    def count(self)-> int:
-        # is count is 0 then self.sum is 0 so everything should workout
-        return max(self.current_count - self.drop_obs, 1)
+    def count(self) -> int:
+        """ number of observations that were not dropped """
+        return self.n
 
     @property
     def avg(self) -> float:
-        return self.sum / float(self.count) + self.first_obs
+        return self.mean
 
     @property
     def var(self) -> float:
-        avg = self.sum / float(self.count)
-        return self.sum_sqr / float(self.count) - avg * avg
+        return self.m2 / float(max(self.n, 1))
 
     @property
     def sd(self) -> float:
@@ -75,3 +211,1412 @@ class StatStream(object):
         print('{}  min: {:.4f}'.format(idt, self.min))
         print('{}  max: {:.4f}'.format(idt, self.max))
         print('{}count: {}'.format(idt, self.count))
+
+
+class QuantileStream(object):
+    """
+        Bounded memory quantile sketch (KLL, Karnin, Lang & Liberty 2016) for tail percentiles (p50/p95/p99).
+
+        Values are kept in a hierarchy of compactors; when a level is full it is sorted and one value out of two
+        is promoted to the next level with a doubled weight. The sketch holds about `3 * k` values
+        whatever the number of observations.
+
+        Error bound: the rank of the returned quantile is within `+/- eps * count` of the requested rank,
+        with eps ~ 1.65% for k=200 and eps ~ 0.8% for k=400 (99% confidence), eps scales as 1/k.
+        Values are exact while fewer than `k` observations were pushed. Min and max are always exact.
+
+        Sketches computed in different processes can be combined with `merge`, the error bound still holds
+    """
+    __slots__ = ('drop_obs', 'k', 'c', 'current_count', 'current_obs', 'n', 'min', 'max', 'compactors', 'size',
+                 'max_size', 'sampling')
+
+    # shared by all the sketches, a `Random` is 2.5 KB
+    rng = random.Random()
+
+    # binary state after the header: k, c, number of levels; then the level sizes (uint32) and the values
+    LAYOUT = struct.Struct('<qdI')
+
+    def __init__(self, drop_first_obs=0, k=200, c=2 / 3):
+        self.drop_obs = drop_first_obs
+        self.k = k
+        self.c = c
+        self.sampling = None
+        self.reset()
+
+    def reset(self):
+        self.current_count = 0
+        self.current_obs = 0
+        self.n = 0
+        self.min = float('inf')
+        self.max = float('-inf')
+        self.compactors: List[List[float]] = [[]]
+        self.size = 0
+        self.max_size = self.capacity(0)
+
+    def capacity(self, level: int) -> int:
+        depth = len(self.compactors) - level - 1
+        return int(math.ceil(self.k * self.c ** depth)) + 1
+
+    def _grow(self):
+        self.compactors.append([])
+        self.max_size = sum(self.capacity(h) for h in range(len(self.compactors)))
+
+    def _compress(self):
+        while self.size >= self.max_size:
+            for h in range(len(self.compactors)):
+                level = self.compactors[h]
+
+                if len(level) >= self.capacity(h):
+                    if h + 1 >= len(self.compactors):
+                        self._grow()
+
+                    # promote one value out of two, starting at a random offset, the odd one stays
+                    level.sort()
+                    odd = len(level) % 2
+                    offset = odd + self.rng.randint(0, 1)
+                    self.compactors[h + 1].extend(level[offset::2])
+                    del level[odd:]
+
+                    self.size = sum(len(c) for c in self.compactors)
+                    if self.size < self.max_size:
+                        break
+
+    def __iadd__(self, other):
+        self.update(other)
+        return self
+
+    def update(self, val):
+        self.current_count += 1
+        self.current_obs = val
+
+        if self.current_count <= self.drop_obs:
+            return
+
+        val = float(val)
+        self.n += 1
+        self.min = min(self.min, val)
+        self.max = max(self.max, val)
+
+        self.compactors[0].append(val)
+        self.size += 1
+        self._compress()
+
+    def update_many(self, values):
+        """ fold a batch of observations, see `StatStream.update_many` """
+        values = as_floats(values)
+        n = len(values)
+        if n == 0:
+            return
+
+        skip = max(self.drop_obs - self.current_count, 0)
+        self.current_count += n
+        self.current_obs = float(values[-1])
+
+        if skip >= n:
+            return
+
+        values = values[skip:]
+        self.n += len(values)
+        self.min = min(self.min, float(min(values)))
+        self.max = max(self.max, float(max(values)))
+
+        values = values.tolist() if hasattr(values, 'tolist') else values
+
+        # insert by chunks so the memory stays bounded
+        step = self.capacity(0)
+        for i in range(0, len(values), step):
+            chunk = values[i:i + step]
+            self.compactors[0].extend(chunk)
+            self.size += len(chunk)
+            self._compress()
+
+    def merge(self, other: 'QuantileStream') -> 'QuantileStream':
+        """ fold the observations of `other` into this sketch """
+        while len(self.compactors) < len(other.compactors):
+            self._grow()
+
+        for h, level in enumerate(other.compactors):
+            self.compactors[h].extend(level)
+
+        self.size = sum(len(c) for c in self.compactors)
+        self._compress()
+
+        self.current_count += other.current_count
+        self.sampling = merge_sampling(self.sampling, other.sampling)
+        self.n += other.n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+        if other.n > 0:
+            self.current_obs = other.current_obs
+
+        return self
+
+    def _weighted(self) -> List[Tuple[float, int]]:
+        items = [(value, 2 ** h) for h, level in enumerate(self.compactors) for value in level]
+        items.sort()
+        return items
+
+    def quantiles(self, qs: Iterable[float]) -> List[float]:
+        items = self._weighted()
+        if len(items) == 0:
+            return [float('nan') for _ in qs]
+
+        total = sum(w for _, w in items)
+        result = []
+
+        for q in qs:
+            if q <= 0:
+                result.append(self.min)
+                continue
+
+            if q >= 1:
+                result.append(self.max)
+                continue
+
+            target = q * total
+            cumulative = 0
+            value = items[-1][0]
+
+            for value, weight in items:
+                cumulative += weight
+                if cumulative >= target:
+                    break
+
+            result.append(value)
+
+        return result
+
+    def quantile(self, q: float) -> float:
+        return self.quantiles([q])[0]
+
+    def rank(self, value: float) -> float:
+        """ approximate fraction of the observations lower or equal to `value` """
+        items = self._weighted()
+        total = sum(w for _, w in items)
+        if total == 0:
+            return float('nan')
+
+        return sum(w for v, w in items if v <= value) / total
+
+    @staticmethod
+    def merge_all(streams: Iterable['QuantileStream'], drop_first_obs=0, k=200) -> 'QuantileStream':
+        result = QuantileStream(drop_first_obs, k)
+        for stream in streams:
+            result.merge(stream)
+        return result
+
+    def state(self) -> Dict:
+        return {
+            'drop_obs': self.drop_obs,
+            'k': self.k,
+            'c': self.c,
+            'seen': self.current_count,
+            'last': self.current_obs,
+            'count': self.n,
+            'min': self.min if self.n > 0 else None,
+            'max': self.max if self.n > 0 else None,
+            'compactors': [list(level) for level in self.compactors],
+        }
+
+    @staticmethod
+    def from_state(state: Dict) -> 'QuantileStream':
+        self = QuantileStream(state['drop_obs'], state['k'], state['c'])
+        self.current_count = state['seen']
+        self.current_obs = state['last']
+        self.n = state['count']
+        self.compactors = [list(level) for level in state['compactors']]
+        self.size = sum(len(c) for c in self.compactors)
+        self.max_size = sum(self.capacity(h) for h in range(len(self.compactors)))
+
+        if self.n > 0:
+            self.min = state['min']
+            self.max = state['max']
+
+        return self
+
+    def pack(self) -> bytes:
+        return b''.join([
+            pack_header(self, self.min, self.max),
+            QuantileStream.LAYOUT.pack(self.k, self.c, len(self.compactors)),
+            pack_array('I', [len(level) for level in self.compactors]),
+            pack_array('d', [value for level in self.compactors for value in level]),
+        ])
+
+    @staticmethod
+    def unpack(data: bytes) -> 'QuantileStream':
+        header = unpack_header(data, QuantileStream)
+        k, c, levels = QuantileStream.LAYOUT.unpack_from(data, HEADER.size)
+
+        self = QuantileStream(header['drop_obs'], k, c)
+        set_header(self, header)
+
+        sizes, offset = unpack_array('I', data, HEADER.size + QuantileStream.LAYOUT.size, levels)
+        values, _ = unpack_array('d', data, offset, sum(sizes))
+        values = values.tolist()
+
+        self.compactors = []
+        start = 0
+        for size in sizes:
+            self.compactors.append(values[start:start + size])
+            start += size
+
+        self.size = len(values)
+        self.max_size = sum(self.capacity(h) for h in range(len(self.compactors)))
+        return self
+
+    @property
+    def val(self) -> float:
+        return self.current_obs
+
+    @property
+    def count(self) -> int:
+        return self.n
+
+    @property
+    def p50(self) -> float:
+        return self.quantile(0.50)
+
+    @property
+    def p95(self) -> float:
+        return self.quantile(0.95)
+
+    @property
+    def p99(self) -> float:
+        return self.quantile(0.99)
+
+    def dump(self, depth=0):
+        idt = ' ' * depth
+        p50, p95, p99 = self.quantiles([0.5, 0.95, 0.99])
+        print('{}  p50: {:.4f}'.format(idt, p50))
+        print('{}  p95: {:.4f}'.format(idt, p95))
+        print('{}  p99: {:.4f}'.format(idt, p99))
+        print('{}  min: {:.4f}'.format(idt, self.min))
+        print('{}  max: {:.4f}'.format(idt, self.max))
+        print('{}count: {}'.format(idt, self.count))
+
+
+class Histogram(object):
+    """
+        Log-bucketed histogram (HDR style) to see the full distribution of a metric (bimodal step times, GC pauses...)
+
+        Bucket `i` counts the values in `[lowest * base^i, lowest * base^(i + 1))` with `base = 1 + precision`,
+        so the relative error on any value is at most `precision` (1% by default).
+        Values outside `[lowest, highest]` (infinities included) are counted in the first/last bucket;
+        min and max are exact. NaN values are ignored.
+
+        Counts are kept in a fixed `array('Q')`, recording a value is O(1)
+    """
+    __slots__ = ('drop_obs', 'lowest', 'highest', 'precision', 'inv_log_base', 'size', 'current_count',
+                 'current_obs', 'n', 'sum', 'min', 'max', 'counts', 'sampling')
+
+    # binary state after the header: lowest, highest, precision, sum, first and last non empty buckets,
+    # size of the counts (4 or 8 bytes); then the counts of the buckets in between
+    LAYOUT = struct.Struct('<ddddiiB')
+
+    def __init__(self, drop_first_obs=0, lowest=1e-6, highest=1e4, precision=0.01):
+        self.drop_obs = drop_first_obs
+        self.sampling = None
+        self.lowest = lowest
+        self.highest = highest
+        self.precision = precision
+        self.inv_log_base = 1.0 / math.log1p(precision)
+        self.size = self.index(highest) + 1
+        self.reset()
+
+    def reset(self):
+        self.current_count = 0
+        self.current_obs = 0
+        self.n = 0
+        self.sum = 0.0
+        self.min = float('inf')
+        self.max = float('-inf')
+        self.counts = array.array('Q', bytes(8 * self.size))
+
+    def index(self, val: float) -> int:
+        if val <= self.lowest:
+            return 0
+        return int(math.log(val / self.lowest) * self.inv_log_base)
+
+    def bucket(self, val: float) -> int:
+        """ bucket counting `val`, the values above `highest` go to the last one """
+        if val >= self.highest:
+            return self.size - 1
+        return self.index(val)
+
+    def bucket_bounds(self, i: int) -> Tuple[float, float]:
+        base = 1 + self.precision
+        return self.lowest * base ** i, self.lowest * base ** (i + 1)
+
+    def bucket_value(self, i: int) -> float:
+        """ value representing the bucket (geometric middle) """
+        return self.lowest * (1 + self.precision) ** (i + 0.5)
+
+    def __iadd__(self, other):
+        self.update(other)
+        return self
+
+    def update(self, val):
+        val = float(val)
+
+        # NaN has no bucket, it is ignored before any counter changes
+        if val != val:
+            return
+
+        self.current_count += 1
+        self.current_obs = val
+
+        if self.current_count <= self.drop_obs:
+            return
+
+        self.n += 1
+        self.sum += val
+        self.min = min(self.min, val)
+        self.max = max(self.max, val)
+        self.counts[self.bucket(val)] += 1
+
+    def update_many(self, values):
+        """ record a batch of observations, see `StatStream.update_many` """
+        values = as_floats(values)
+
+        # NaN values are ignored like in `update`
+        if np is None:
+            values = [val for val in values if val == val]
+        else:
+            values = values[~np.isnan(values)]
+
+        n = len(values)
+        if n == 0:
+            return
+
+        skip = max(self.drop_obs - self.current_count, 0)
+        self.current_count += n
+        self.current_obs = float(values[-1])
+
+        if skip >= n:
+            return
+
+        values = values[skip:]
+
+        if np is None:
+            for val in values:
+                self.n += 1
+                self.sum += val
+                self.counts[self.bucket(val)] += 1
+
+            self.min = min(self.min, min(values))
+            self.max = max(self.max, max(values))
+            return
+
+        self.n += len(values)
+        # +inf and -inf sum to NaN without a warning, like in `update`
+        with np.errstate(invalid='ignore'):
+            self.sum += float(values.sum())
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+
+        # the infinities are clipped to the first/last bucket
+        indexes = np.log(np.clip(values, self.lowest, self.highest) / self.lowest) * self.inv_log_base
+        indexes = np.minimum(indexes.astype(np.int64), self.size - 1)
+
+        # add in place through the array's buffer
+        counts = np.frombuffer(self.counts, dtype=np.uint64)
+        counts += np.bincount(indexes, minlength=self.size).astype(np.uint64)
+
+    def same_layout(self, other: 'Histogram') -> bool:
+        return (self.lowest, self.highest, self.precision) == (other.lowest, other.highest, other.precision)
+
+    def merge(self, other: 'Histogram') -> 'Histogram':
+        """ add the counts of `other`, both histograms must have the same buckets """
+        if not self.same_layout(other):
+            raise ValueError('Cannot merge histograms with different buckets')
+
+        for i, count in enumerate(other.counts):
+            if count:
+                self.counts[i] += count
+
+        self.current_count += other.current_count
+        self.sampling = merge_sampling(self.sampling, other.sampling)
+        self.n += other.n
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+        if other.n > 0:
+            self.current_obs = other.current_obs
+
+        return self
+
+    def buckets(self) -> List[Tuple[float, float, int]]:
+        """ `(low, high, count)` of the non empty buckets """
+        return [self.bucket_bounds(i) + (count,) for i, count in enumerate(self.counts) if count]
+
+    def quantiles(self, qs: Iterable[float]) -> List[float]:
+        if self.n == 0:
+            return [float('nan') for _ in qs]
+
+        result = []
+        for q in qs:
+            target = q * self.n
+            cumulative = 0
+            value = self.max
+
+            for i, count in enumerate(self.counts):
+                cumulative += count
+                if count and cumulative >= target:
+                    value = self.bucket_value(i)
+                    break
+
+            result.append(min(max(value, self.min), self.max))
+
+        return result
+
+    def quantile(self, q: float) -> float:
+        return self.quantiles([q])[0]
+
+    @staticmethod
+    def merge_all(streams: Iterable['Histogram']) -> Optional['Histogram']:
+        result = None
+        for stream in streams:
+            if result is None:
+                result = Histogram(0, stream.lowest, stream.highest, stream.precision)
+            result.merge(stream)
+        return result
+
+    def state(self) -> Dict:
+        # only the non empty buckets are saved
+        indexes = [i for i, count in enumerate(self.counts) if count]
+        return {
+            'drop_obs': self.drop_obs,
+            'lowest': self.lowest,
+            'highest': self.highest,
+            'precision': self.precision,
+            'seen': self.current_count,
+            'last': self.current_obs,
+            'count': self.n,
+            'sum': self.sum,
+            'min': self.min if self.n > 0 else None,
+            'max': self.max if self.n > 0 else None,
+            'indexes': indexes,
+            'counts': [self.counts[i] for i in indexes],
+        }
+
+    @staticmethod
+    def from_state(state: Dict) -> 'Histogram':
+        self = Histogram(state['drop_obs'], state['lowest'], state['highest'], state['precision'])
+        self.current_count = state['seen']
+        self.current_obs = state['last']
+        self.n = state['count']
+        self.sum = state['sum']
+
+        for i, count in zip(state['indexes'], state['counts']):
+            self.counts[i] = count
+
+        if self.n > 0:
+            self.min = state['min']
+            self.max = state['max']
+
+        return self
+
+    def pack(self) -> bytes:
+        indexes = [i for i, count in enumerate(self.counts) if count]
+        first, last = (indexes[0], indexes[-1]) if indexes else (0, -1)
+        counts = self.counts[first:last + 1]
+
+        # most counts fit in 32 bits
+        typecode = 'I' if max(counts, default=0) < 2 ** 32 else 'Q'
+
+        return b''.join([
+            pack_header(self, self.min, self.max),
+            Histogram.LAYOUT.pack(self.lowest, self.highest, self.precision, self.sum, first, last,
+                                  array.array(typecode).itemsize),
+            pack_array(typecode, counts),
+        ])
+
+    @staticmethod
+    def unpack(data: bytes) -> 'Histogram':
+        header = unpack_header(data, Histogram)
+        lowest, highest, precision, total, first, last, width = Histogram.LAYOUT.unpack_from(data, HEADER.size)
+
+        self = Histogram(header['drop_obs'], lowest, highest, precision)
+        set_header(self, header)
+        self.sum = total
+
+        typecode = 'I' if width == 4 else 'Q'
+        counts, _ = unpack_array(typecode, data, HEADER.size + Histogram.LAYOUT.size, last - first + 1)
+        self.counts[first:last + 1] = array.array('Q', counts)
+        return self
+
+    @property
+    def val(self) -> float:
+        return self.current_obs
+
+    @property
+    def count(self) -> int:
+        return self.n
+
+    @property
+    def avg(self) -> float:
+        return self.sum / max(self.n, 1)
+
+    def dump(self, depth=0, width=40):
+        idt = ' ' * depth
+        print('{}  avg: {:.4f}'.format(idt, self.avg))
+        print('{}  min: {:.4f}'.format(idt, self.min))
+        print('{}  max: {:.4f}'.format(idt, self.max))
+        print('{}count: {}'.format(idt, self.count))
+
+        buckets = self.buckets()
+        top = max([count for _, _, count in buckets], default=1)
+        for low, high, count in buckets:
+            print('{}[{:.4g}, {:.4g}) {} {}'.format(idt, low, high, '#' * max(int(width * count / top), 1), count))
+
+
+class WindowedStream(object):
+    """
+        Aggregates the observations per time window (10 s by default) to see warmup, throttling or slowdowns
+        that a single average over the whole run hides, plus an exponentially weighted moving average (EWMA).
+
+        Each window keeps `[start, count, samples, sum, min, max]`; `samples` is the work done by each
+        observation (e.g. the batch size) so `samples / duration` is the throughput.
+
+        Memory is bounded: the last `capacity` windows are kept at full resolution in a ring buffer,
+        older windows are folded in a history ring of `capacity` windows whose resolution is halved
+        (windows are merged two by two) each time it is full.
+
+        Windows are aligned on the wall clock so streams from different processes can be merged.
+        Windows without observations are not stored
+    """
+    START, COUNT, SAMPLES, SUM, MIN, MAX = range(6)
+
+    __slots__ = ('drop_obs', 'window', 'capacity', 'alpha', 'clock', 'current_count', 'current_obs', 'n', 'samples',
+                 'sum', 'first', 'last', 'ewma', 'ewma_rate', 'recent', 'history', 'history_window', 'sampling')
+
+    # binary state after the header: window, capacity, alpha, samples, sum, first_time, last_time, ewma,
+    # ewma_rate (NaN when not set), history_window, number of history and recent windows; then the windows
+    LAYOUT = struct.Struct('<dqddddddddII')
+
+    def __init__(self, drop_first_obs=0, window=10.0, capacity=256, alpha=0.1, clock=time.time):
+        self.drop_obs = drop_first_obs
+        self.window = window
+        self.capacity = capacity
+        self.alpha = alpha
+        self.clock = clock
+        self.sampling = None
+        self.reset()
+
+    def reset(self):
+        self.current_count = 0
+        self.current_obs = 0
+        self.n = 0
+        self.samples = 0
+        self.sum = 0.0
+        self.first = None
+        self.last = None
+        self.ewma = None
+        self.ewma_rate = None
+        self.recent: Deque[List[float]] = collections.deque()
+        self.history: List[List[float]] = []
+        self.history_window = self.window * 2
+
+    def _window(self, now: float) -> List[float]:
+        """ window receiving the observations made at `now` """
+        start = math.floor(now / self.window) * self.window
+
+        # observations are not allowed to go back in time
+        if self.recent and self.recent[-1][self.START] >= start:
+            return self.recent[-1]
+
+        if self.recent:
+            self._close(self.recent[-1])
+
+        window = [start, 0, 0, 0.0, float('inf'), float('-inf')]
+        self.recent.append(window)
+
+        if len(self.recent) > self.capacity:
+            self._archive(self.recent.popleft())
+
+        return window
+
+    def _close(self, window: List[float]):
+        rate = window[self.SAMPLES] / self.window
+        self.ewma_rate = rate if self.ewma_rate is None else self.alpha * rate + (1 - self.alpha) * self.ewma_rate
+
+    def _archive(self, window: List[float]):
+        start = math.floor(window[self.START] / self.history_window) * self.history_window
+
+        if self.history and self.history[-1][self.START] == start:
+            WindowedStream._fold(self.history[-1], window)
+        else:
+            self.history.append([start] + window[1:])
+
+        if len(self.history) > self.capacity:
+            self._downsample()
+
+    def _downsample(self):
+        self.history_window *= 2
+        self.history = WindowedStream._bucket(self.history, self.history_window)
+
+    @staticmethod
+    def _fold(target: List[float], window: List[float]):
+        target[WindowedStream.COUNT] += window[WindowedStream.COUNT]
+        target[WindowedStream.SAMPLES] += window[WindowedStream.SAMPLES]
+        target[WindowedStream.SUM] += window[WindowedStream.SUM]
+        target[WindowedStream.MIN] = min(target[WindowedStream.MIN], window[WindowedStream.MIN])
+        target[WindowedStream.MAX] = max(target[WindowedStream.MAX], window[WindowedStream.MAX])
+
+    def __iadd__(self, other):
+        self.update(other)
+        return self
+
+    def update(self, val, samples=1, now=None):
+        """ `samples` is the work done by this observation (e.g. the batch size) """
+        self.current_count += 1
+        self.current_obs = val
+
+        if self.current_count <= self.drop_obs:
+            return
+
+        val = float(val)
+        self._add(1, val, val, val, samples, now)
+
+    def update_many(self, values, samples=1, now=None):
+        """ fold a batch of observations made at `now`, `samples` is the work done by each of them """
+        values = as_floats(values)
+        n = len(values)
+        if n == 0:
+            return
+
+        skip = max(self.drop_obs - self.current_count, 0)
+        self.current_count += n
+        self.current_obs = float(values[-1])
+
+        if skip >= n:
+            return
+
+        values = values[skip:]
+        if np is not None:
+            self._add(len(values), float(values.sum()), float(values.min()), float(values.max()), samples, now)
+        else:
+            self._add(len(values), math.fsum(values), min(values), max(values), samples, now)
+
+    def _add(self, n, total, low, high, samples, now):
+        now = self.clock() if now is None else now
+
+        window = self._window(now)
+        window[self.COUNT] += n
+        window[self.SAMPLES] += samples * n
+        window[self.SUM] += total
+        window[self.MIN] = min(window[self.MIN], low)
+        window[self.MAX] = max(window[self.MAX], high)
+
+        self.n += n
+        self.samples += samples * n
+        self.sum += total
+        self.first = now if self.first is None else self.first
+        self.last = now
+
+        mean = total / n
+        self.ewma = mean if self.ewma is None else self.alpha * mean + (1 - self.alpha) * self.ewma
+
+    def series(self) -> List[Dict]:
+        """ per window aggregates, oldest first; the last window might still be receiving observations """
+        result = [self._describe(window, self.history_window) for window in self.history]
+        result += [self._describe(window, self.window) for window in self.recent]
+        result.sort(key=lambda window: window['start'])
+        return result
+
+    def _describe(self, window: List[float], duration: float) -> Dict:
+        return {
+            'start': window[self.START],
+            'duration': duration,
+            'count': window[self.COUNT],
+            'samples': window[self.SAMPLES],
+            'rate': window[self.SAMPLES] / duration,
+            'mean': window[self.SUM] / max(window[self.COUNT], 1),
+            'min': window[self.MIN],
+            'max': window[self.MAX],
+        }
+
+    def merge(self, other: 'WindowedStream') -> 'WindowedStream':
+        """
+            Combine the windows of a stream with the same window size (e.g. the same metric on another rank),
+            the EWMAs of the stream with the most recent observation are kept
+        """
+        if self.window != other.window:
+            raise ValueError('Cannot merge streams with different windows')
+
+        # the merged history needs the coarsest resolution of the two
+        while self.history_window < other.history_window:
+            self._downsample()
+
+        recent = WindowedStream._bucket(list(self.recent) + list(other.recent), self.window)
+        overflow = recent[:max(len(recent) - self.capacity, 0)]
+
+        self.recent = collections.deque(recent[len(overflow):])
+        self.history = WindowedStream._bucket(self.history + other.history + overflow, self.history_window)
+
+        while len(self.history) > self.capacity:
+            self._downsample()
+
+        self.current_count += other.current_count
+        self.sampling = merge_sampling(self.sampling, other.sampling)
+        self.n += other.n
+        self.samples += other.samples
+        self.sum += other.sum
+
+        if other.first is not None:
+            # partial states shipped at intervals carry the EWMAs over, the most recent ones are the current ones
+            if self.last is None or other.last >= self.last:
+                self.ewma = other.ewma
+                self.ewma_rate = other.ewma_rate if other.ewma_rate is not None else self.ewma_rate
+
+            self.first = other.first if self.first is None else min(self.first, other.first)
+            self.last = other.last if self.last is None else max(self.last, other.last)
+            self.current_obs = other.current_obs
+
+        return self
+
+    @staticmethod
+    def _bucket(windows: List[List[float]], duration: float) -> List[List[float]]:
+        """ fold the windows falling in the same `duration` long bucket, sorted by time """
+        buckets: Dict[float, List[float]] = {}
+
+        for window in windows:
+            start = math.floor(window[WindowedStream.START] / duration) * duration
+
+            if start in buckets:
+                WindowedStream._fold(buckets[start], window)
+            else:
+                buckets[start] = [start] + list(window[1:])
+
+        return [buckets[start] for start in sorted(buckets)]
+
+    def state(self) -> Dict:
+        def pack(windows):
+            # flat list of [start, count, samples, sum, min, max, ...]
+            return [value for window in windows for value in window]
+
+        return {
+            'drop_obs': self.drop_obs,
+            'window': self.window,
+            'capacity': self.capacity,
+            'alpha': self.alpha,
+            'seen': self.current_count,
+            'last': self.current_obs,
+            'count': self.n,
+            'samples': self.samples,
+            'sum': self.sum,
+            'first_time': self.first,
+            'last_time': self.last,
+            'ewma': self.ewma,
+            'ewma_rate': self.ewma_rate,
+            'history_window': self.history_window,
+            'history': pack(self.history),
+            'recent': pack(self.recent),
+        }
+
+    @staticmethod
+    def from_state(state: Dict) -> 'WindowedStream':
+        def unpack(values):
+            return [list(values[i:i + 6]) for i in range(0, len(values), 6)]
+
+        self = WindowedStream(state['drop_obs'], state['window'], state['capacity'], state['alpha'])
+        self.current_count = state['seen']
+        self.current_obs = state['last']
+        self.n = state['count']
+        self.samples = state['samples']
+        self.sum = state['sum']
+        self.first = state['first_time']
+        self.last = state['last_time']
+        self.ewma = state['ewma']
+        self.ewma_rate = state['ewma_rate']
+        self.history_window = state['history_window']
+        self.history = unpack(state['history'])
+        self.recent = collections.deque(unpack(state['recent']))
+        return self
+
+    def pack(self) -> bytes:
+        def optional(value):
+            return math.nan if value is None else value
+
+        windows = self.history + list(self.recent)
+        low = min((window[self.MIN] for window in windows), default=math.inf)
+        high = max((window[self.MAX] for window in windows), default=-math.inf)
+
+        return b''.join([
+            pack_header(self, low, high),
+            WindowedStream.LAYOUT.pack(
+                self.window, self.capacity, self.alpha, self.samples, self.sum, optional(self.first),
+                optional(self.last), optional(self.ewma), optional(self.ewma_rate), self.history_window,
+                len(self.history), len(self.recent)),
+            pack_array('d', [value for window in windows for value in window]),
+        ])
+
+    @staticmethod
+    def unpack(data: bytes) -> 'WindowedStream':
+        def optional(value):
+            return None if math.isnan(value) else value
+
+        header = unpack_header(data, WindowedStream)
+        window, capacity, alpha, samples, total, first, last, ewma, ewma_rate, history_window, history, recent = \
+            WindowedStream.LAYOUT.unpack_from(data, HEADER.size)
+
+        self = WindowedStream(header['drop_obs'], window, capacity, alpha)
+        self.current_count = header['seen']
+        self.current_obs = header['last']
+        self.n = header['count']
+        self.samples = samples
+        self.sum = total
+        self.first = optional(first)
+        self.last = optional(last)
+        self.ewma = optional(ewma)
+        self.ewma_rate = optional(ewma_rate)
+        self.history_window = history_window
+
+        values, _ = unpack_array('d', data, HEADER.size + WindowedStream.LAYOUT.size, 6 * (history + recent))
+        windows = [values[i:i + 6].tolist() for i in range(0, len(values), 6)]
+        self.history = windows[:history]
+        self.recent = collections.deque(windows[history:])
+        return self
+
+    @property
+    def val(self) -> float:
+        return self.current_obs
+
+    @property
+    def count(self) -> int:
+        return self.n
+
+    @property
+    def avg(self) -> float:
+        return self.sum / max(self.n, 1)
+
+    @property
+    def rate(self) -> float:
+        """ samples per second over the whole run (measured over one window at least) """
+        if self.first is None:
+            return float('nan')
+        return self.samples / max(self.last - self.first, self.window)
+
+    def dump(self, depth=0, last=5):
+        idt = ' ' * depth
+        print('{}  avg: {:.4f}'.format(idt, self.avg))
+        print('{} ewma: {:.4f}'.format(idt, self.ewma if self.ewma is not None else float('nan')))
+        print('{} rate: {:.4f}'.format(idt, self.rate))
+        print('{}count: {}'.format(idt, self.count))
+
+        series = self.series()
+        start = series[0]['start'] if series else 0
+        for window in series[-last:]:
+            print('{}[{:8.1f} s] rate: {:.4f}/s mean: {:.4f}'.format(
+                idt, window['start'] - start, window['rate'], window['mean']))
+
+
+class RawSamples(object):
+    """
+        Bounded set of the raw observations behind a key, `(x, y)` points where x is the index of the observation.
+        The points are kept in preallocated `array('d')` buffers:
+
+            - reservoir: uniform sample of `size` observations (Vitter's algorithm R)
+            - lttb     : `size` points keeping the shape of the series (largest triangle three buckets);
+                         the buffer holds `2 * size` points and is downsampled to `size` points when full
+
+        min, max and count are exact
+    """
+    __slots__ = ('drop_obs', 'size', 'mode', 'current_count', 'current_obs', 'n', 'min', 'max', 'xs', 'ys', 'length',
+                 'sampling')
+
+    MODES = ('reservoir', 'lttb')
+
+    # shared by all the reservoirs
+    rng = random.Random()
+
+    # binary state after the header: size, mode (index in MODES), number of points; then the xs and the ys
+    LAYOUT = struct.Struct('<qBI')
+
+    def __init__(self, drop_first_obs=0, size=1024, mode='reservoir'):
+        if mode not in RawSamples.MODES:
+            raise ValueError('Unknown retention mode `{}`, expected one of {}'.format(mode, RawSamples.MODES))
+
+        self.drop_obs = drop_first_obs
+        self.size = size
+        self.mode = mode
+        self.sampling = None
+        self.reset()
+
+    def reset(self):
+        self.current_count = 0
+        self.current_obs = 0
+        self.n = 0
+        self.min = float('inf')
+        self.max = float('-inf')
+        self.length = 0
+
+        capacity = self.size if self.mode == 'reservoir' else 2 * self.size
+        self.xs = array.array('d', bytes(8 * capacity))
+        self.ys = array.array('d', bytes(8 * capacity))
+
+    def __iadd__(self, other):
+        self.update(other)
+        return self
+
+    def update(self, val):
+        self.current_count += 1
+        self.current_obs = val
+
+        if self.current_count <= self.drop_obs:
+            return
+
+        val = float(val)
+        self.min = min(self.min, val)
+        self.max = max(self.max, val)
+        self._add(float(self.n), val)
+        self.n += 1
+
+    def update_many(self, values):
+        """ record a batch of observations, see `StatStream.update_many` """
+        values = as_floats(values)
+        n = len(values)
+        if n == 0:
+            return
+
+        skip = max(self.drop_obs - self.current_count, 0)
+        self.current_count += n
+        self.current_obs = float(values[-1])
+
+        if skip >= n:
+            return
+
+        values = values[skip:]
+        self.min = min(self.min, float(min(values)))
+        self.max = max(self.max, float(max(values)))
+
+        for val in (values.tolist() if hasattr(values, 'tolist') else values):
+            self._add(float(self.n), val)
+            self.n += 1
+
+    def _add(self, x: float, y: float):
+        if self.mode == 'reservoir':
+            i = self.length
+            if i == self.size:
+                # `x` is the number of points offered before this one
+                i = self.rng.randrange(int(x) + 1)
+                if i >= self.size:
+                    return
+            else:
+                self.length += 1
+
+        else:
+            if self.length == len(self.xs):
+                self._downsample()
+
+            i = self.length
+            self.length += 1
+
+        self.xs[i] = x
+        self.ys[i] = y
+
+    def _downsample(self):
+        """ keep `size` points of the buffer in place """
+        for k, i in enumerate(lttb(self.xs[:self.length], self.ys[:self.length], self.size)):
+            self.xs[k] = self.xs[i]
+            self.ys[k] = self.ys[i]
+
+        self.length = self.size
+
+    def points(self) -> Tuple[List[float], List[float]]:
+        """
+            `(xs, ys)` of the retained observations sorted by x, at most `size` points.
+            The buffer is read, not modified: only `_add` downsamples it, when it is full
+        """
+        length = self.length
+        xs, ys = self.xs[:length], self.ys[:length]
+
+        if self.mode == 'lttb' and length > self.size:
+            kept = lttb(xs, ys, self.size)
+            xs, ys = [xs[i] for i in kept], [ys[i] for i in kept]
+
+        points = sorted(zip(xs, ys))
+        return [x for x, _ in points], [y for _, y in points]
+
+    @property
+    def values(self) -> List[float]:
+        return self.points()[1]
+
+    def merge(self, other: 'RawSamples') -> 'RawSamples':
+        """ the x of the points of `other` are shifted after the points of this stream """
+        if (self.size, self.mode) != (other.size, other.mode):
+            raise ValueError('Cannot merge raw samples with different sizes or modes')
+
+        xs, ys = self.points()
+        other_xs, other_ys = other.points()
+        xs += [x + self.n for x in other_xs]
+        ys += other_ys
+
+        if self.mode == 'reservoir' and len(xs) > self.size:
+            # each point stands for `n / length` observations of its stream
+            weights = [self.n / max(self.length, 1)] * self.length + [other.n / max(other.length, 1)] * other.length
+            keys = sorted(range(len(xs)), key=lambda i: self.rng.random() ** (1 / weights[i]), reverse=True)
+            kept = sorted(keys[:self.size])
+            xs, ys = [xs[i] for i in kept], [ys[i] for i in kept]
+
+        elif self.mode == 'lttb' and len(xs) > self.size:
+            kept = lttb(xs, ys, self.size)
+            xs, ys = [xs[i] for i in kept], [ys[i] for i in kept]
+
+        self.length = len(xs)
+        self.xs[:self.length] = array.array('d', xs)
+        self.ys[:self.length] = array.array('d', ys)
+
+        self.current_count += other.current_count
+        self.sampling = merge_sampling(self.sampling, other.sampling)
+        self.n += other.n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+        if other.n > 0:
+            self.current_obs = other.current_obs
+
+        return self
+
+    def state(self) -> Dict:
+        xs, ys = self.points()
+        return {
+            'drop_obs': self.drop_obs,
+            'size': self.size,
+            'mode': self.mode,
+            'seen': self.current_count,
+            'last': self.current_obs,
+            'count': self.n,
+            'min': self.min if self.n > 0 else None,
+            'max': self.max if self.n > 0 else None,
+            'xs': xs,
+            'ys': ys,
+        }
+
+    @staticmethod
+    def from_state(state: Dict) -> 'RawSamples':
+        self = RawSamples(state['drop_obs'], state['size'], state['mode'])
+        self.current_count = state['seen']
+        self.current_obs = state['last']
+        self.n = state['count']
+        self.length = len(state['xs'])
+        self.xs[:self.length] = array.array('d', state['xs'])
+        self.ys[:self.length] = array.array('d', state['ys'])
+
+        if self.n > 0:
+            self.min = state['min']
+            self.max = state['max']
+
+        return self
+
+    def pack(self) -> bytes:
+        xs, ys = self.points()
+        return b''.join([
+            pack_header(self, self.min, self.max),
+            RawSamples.LAYOUT.pack(self.size, RawSamples.MODES.index(self.mode), len(xs)),
+            pack_array('d', xs),
+            pack_array('d', ys),
+        ])
+
+    @staticmethod
+    def unpack(data: bytes) -> 'RawSamples':
+        header = unpack_header(data, RawSamples)
+        size, mode, length = RawSamples.LAYOUT.unpack_from(data, HEADER.size)
+
+        self = RawSamples(header['drop_obs'], size, RawSamples.MODES[mode])
+        set_header(self, header)
+
+        xs, offset = unpack_array('d', data, HEADER.size + RawSamples.LAYOUT.size, length)
+        ys, _ = unpack_array('d', data, offset, length)
+        self.length = length
+        self.xs[:length] = xs
+        self.ys[:length] = ys
+        return self
+
+    @property
+    def val(self) -> float:
+        return self.current_obs
+
+    @property
+    def count(self) -> int:
+        return self.n
+
+    def dump(self, depth=0, last=5):
+        idt = ' ' * depth
+        xs, ys = self.points()
+        print('{}  min: {:.4f}'.format(idt, self.min))
+        print('{}  max: {:.4f}'.format(idt, self.max))
+        print('{}count: {}'.format(idt, self.count))
+        print('{} kept: {} ({})'.format(idt, len(xs), self.mode))
+        for x, y in zip(xs[-last:], ys[-last:]):
+            print('{}[{:8.0f}] {:.4f}'.format(idt, x, y))
+
+
+def lttb(xs: Sequence[float], ys: Sequence[float], points: int) -> List[int]:
+    """
+        Indexes of the `points` points that keep the visual shape of the series
+        (Largest Triangle Three Buckets, Steinarsson 2013); the first and last points are always kept
+    """
+    n = len(xs)
+    if points >= n:
+        return list(range(n))
+
+    if points < 3:
+        return [0, n - 1][:points]
+
+    selected = [0]
+    every = (n - 2) / (points - 2)
+    a = 0
+
+    for b in range(points - 2):
+        # average point of the next bucket
+        start = int((b + 1) * every) + 1
+        end = min(int((b + 2) * every) + 1, n)
+        avg_x = sum(xs[start:end]) / (end - start)
+        avg_y = sum(ys[start:end]) / (end - start)
+
+        # point of the current bucket making the largest triangle with the last selected point and the average
+        ax, ay = xs[a], ys[a]
+        best, best_area = -1, -1.0
+        for i in range(int(b * every) + 1, start):
+            area = abs((ax - avg_x) * (ys[i] - ay) - (ax - xs[i]) * (avg_y - ay))
+            if area > best_area:
+                best, best_area = i, area
+
+        selected.append(best)
+        a = best
+
+    selected.append(n - 1)
+    return selected
+
+
+def merge_sampling(a: Optional[Dict], b: Optional[Dict]) -> Optional[Dict]:
+    """ sampling metadata of the union of two sampled streams """
+    if a is None or b is None:
+        return a if b is None else b
+
+    return dict(a, offered=a['offered'] + b['offered'], recorded=a['recorded'] + b['recorded'])
+
+
+def scale(stream) -> float:
+    """
+        factor to extrapolate the counts and rates of a sampled stream (1 if every observation was recorded),
+        `stream` can be a `peek` summary
+    """
+    if isinstance(stream, dict):
+        sampling = stream.get('sampling')
+    else:
+        sampling = getattr(stream, 'sampling', None)
+    if not sampling or sampling['recorded'] == 0:
+        return 1.0
+
+    return sampling['offered'] / sampling['recorded']
+
+
+def is_scalar(value) -> bool:
+    return isinstance(value, numbers.Number) or getattr(value, 'ndim', None) == 0
+
+
+def as_floats(values):
+    """ flat float64 numpy array if numpy is available, list of floats otherwise """
+    if np is not None:
+        return np.asarray(values, dtype=np.float64).ravel()
+
+    return [float(v) for v in values]
+
+
+# name -> class of the statistics that can be saved inside an observation's reports
+STATS = {
+    'StatStream': StatStream,
+    'QuantileStream': QuantileStream,
+    'Histogram': Histogram,
+    'WindowedStream': WindowedStream,
+    'RawSamples': RawSamples,
+}
+
+# type codes of the binary states, never reuse a code
+CODES = {
+    StatStream: 1,
+    QuantileStream: 2,
+    Histogram: 3,
+    WindowedStream: 4,
+    RawSamples: 5,
+}
+TYPES = {code: cls for cls, code in CODES.items()}
+
+
+def pack_header(stream, low: float, high: float) -> bytes:
+    return HEADER.pack(FORMAT_VERSION, CODES[type(stream)], stream.drop_obs, stream.current_count, stream.n,
+                       float(stream.current_obs), low, high)
+
+
+def unpack_header(data: bytes, cls=None) -> Dict:
+    version, code, drop_obs, seen, count, last, low, high = HEADER.unpack_from(data)
+
+    if version != FORMAT_VERSION:
+        raise ValueError('Unsupported stat format version {}'.format(version))
+
+    if code not in TYPES or (cls is not None and TYPES[code] is not cls):
+        raise ValueError('Unexpected stat type code {}'.format(code))
+
+    return {
+        'type': TYPES[code].__name__,
+        'drop_obs': drop_obs,
+        'seen': seen,
+        'count': count,
+        'last': last,
+        'min': low if count > 0 else None,
+        'max': high if count > 0 else None,
+    }
+
+
+def set_header(stream, header: Dict):
+    stream.current_count = header['seen']
+    stream.current_obs = header['last']
+    stream.n = header['count']
+
+    if header['count'] > 0:
+        stream.min = header['min']
+        stream.max = header['max']
+
+
+def pack_array(typecode: str, values) -> bytes:
+    """ little endian bytes of `values` """
+    values = array.array(typecode, values)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values.tobytes()
+
+
+def unpack_array(typecode: str, data: bytes, offset: int, size: int) -> Tuple[array.array, int]:
+    """ `size` values starting at `offset`, returns the values and the offset of what follows """
+    values = array.array(typecode)
+    end = offset + size * values.itemsize
+    values.frombytes(data[offset:end])
+
+    if sys.byteorder == 'big':
+        values.byteswap()
+    return values, end
+
+
+def encode(value):
+    """
+        replace the statistics objects by `{'__stat__': name, 'format': version, 'data': base64 binary state}`
+        so the reports can be saved as JSON
+    """
+    if isinstance(value, dict):
+        return {k: encode(v) for k, v in value.items()}
+
+    # sampled streams
+    if hasattr(value, 'resolve'):
+        value = value.resolve()
+
+    for name, cls in STATS.items():
+        if type(value) is cls:
+            encoded = {
+                '__stat__': name,
+                'format': FORMAT_VERSION,
+                'data': base64.b64encode(value.pack()).decode('ascii'),
+            }
+
+            if value.sampling is not None:
+                encoded['sampling'] = value.sampling
+
+            return encoded
+
+    return value
+
+
+def is_encoded(value) -> bool:
+    return isinstance(value, dict) and value.get('__stat__') in STATS
+
+
+def decode(value):
+    """ inverse of `encode`, the JSON states (`state()`) saved by the previous versions are read as well """
+    if is_encoded(value):
+        state = dict(value)
+        sampling = state.pop('sampling', None)
+        cls = STATS[state.pop('__stat__')]
+
+        if 'data' in state:
+            stream = cls.unpack(base64.b64decode(state['data']))
+        else:
+            stream = cls.from_state(state)
+
+        stream.sampling = sampling
+        return stream
+
+    if isinstance(value, dict):
+        return {k: decode(v) for k, v in value.items()}
+
+    return value
+
+
+def peek(value) -> Optional[Dict]:
+    """
+        Summary of an encoded statistic read from its header, without building the object:
+        type, drop_obs, seen, count, last, min, max and the type specific scalars (avg, sd, sum, rate, ...).
+        Returns None if `value` is not an encoded statistic
+    """
+    if not is_encoded(value):
+        return None
+
+    if 'data' not in value:
+        return _peek_state(value)
+
+    data = base64.b64decode(value['data'])
+    summary = unpack_header(data, STATS[value['__stat__']])
+    summary['sampling'] = value.get('sampling')
+    count = summary['count']
+
+    if summary['type'] == 'StatStream':
+        mean, m2 = StatStream.LAYOUT.unpack_from(data, HEADER.size)
+        summary.update(mean=mean, m2=m2, avg=mean, sd=math.sqrt(m2 / max(count, 1)))
+
+    elif summary['type'] == 'QuantileStream':
+        k, c, _ = QuantileStream.LAYOUT.unpack_from(data, HEADER.size)
+        summary.update(k=k, c=c)
+
+    elif summary['type'] == 'Histogram':
+        lowest, highest, precision, total, _, _, _ = Histogram.LAYOUT.unpack_from(data, HEADER.size)
+        summary.update(lowest=lowest, highest=highest, precision=precision, sum=total, avg=total / max(count, 1))
+
+    elif summary['type'] == 'WindowedStream':
+        window, _, _, samples, total, first, last, ewma, _, _, _, _ = \
+            WindowedStream.LAYOUT.unpack_from(data, HEADER.size)
+        summary.update(window=window, samples=samples, sum=total, avg=total / max(count, 1),
+                       ewma=None if math.isnan(ewma) else ewma,
+                       rate=math.nan if math.isnan(first) else samples / max(last - first, window))
+
+    elif summary['type'] == 'RawSamples':
+        size, mode, length = RawSamples.LAYOUT.unpack_from(data, HEADER.size)
+        summary.update(size=size, mode=RawSamples.MODES[mode], kept=length)
+
+    return summary
+
+
+def _peek_state(state: Dict) -> Dict:
+    """ `peek` for the JSON states """
+    keys = ('drop_obs', 'seen', 'count', 'last', 'min', 'max', 'mean', 'm2', 'k', 'c', 'lowest', 'highest',
+            'precision', 'sum', 'window', 'samples', 'ewma')
+    summary = {key: state[key] for key in keys if key in state}
+    summary['type'] = state['__stat__']
+    summary['sampling'] = state.get('sampling')
+    count = max(state['count'], 1)
+
+    if 'mean' in state:
+        summary.update(avg=state['mean'], sd=math.sqrt(state['m2'] / count))
+
+    if 'sum' in state:
+        summary['avg'] = state['sum'] / count
+
+    if 'xs' in state:
+        summary.update(size=state['size'], mode=state['mode'], kept=len(state['xs']))
+
+    if 'window' in state:
+        first, last = state['first_time'], state['last_time']
+        summary['rate'] = math.nan if first is None else state['samples'] / max(last - first, state['window'])
+
+    return summary
@@ -5,7 +5,10 @@ import socket
 
 def get_cpu_info():
     info = cpuinfo.get_cpu_info()
-    return info['count'], info['brand'], info['vendor_id']
+    # py-cpuinfo >= 5 renamed `brand` and `vendor_id`
+    brand = info.get('brand', info.get('brand_raw'))
+    vendor = info.get('vendor_id', info.get('vendor_id_raw'))
+    return info['count'], brand, vendor
 
 
 def get_gpu_info():
@@ -0,0 +1,81 @@
+import functools
+import statistics
+from time import perf_counter_ns
+from typing import *
+
+# cost of an empty timed region in ns, measured by `calibrate`
+_overhead_ns = None
+
+
+class Timer:
+    """
+        Time a region of code and push the elapsed time (in seconds) to a stream.
+
+            with namespace.timer('forward'):
+                out = model(x)
+
+            @namespace.timer('load')
+            def load_batch():
+                ...
+
+        The stream is resolved once when the timer is created, timing a region costs two `perf_counter_ns` calls
+        and one `update`. With `subtract_overhead` the calibrated cost of the instrumentation is removed
+        from each measure.
+
+        The context manager is not reentrant, use one timer per region (the decorator is)
+    """
+    __slots__ = ('update', 'overhead', 'start')
+
+    def __init__(self, update: Callable[[float], Any], subtract_overhead: bool = False):
+        self.update = update
+        self.overhead = calibrate() if subtract_overhead else 0
+        self.start = 0
+
+    def __enter__(self) -> 'Timer':
+        self.start = perf_counter_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        elapsed = perf_counter_ns() - self.start - self.overhead
+        self.update(max(elapsed, 0) * 1e-9)
+
+    def __call__(self, fun: Callable) -> Callable:
+        update = self.update
+        overhead = self.overhead
+
+        @functools.wraps(fun)
+        def timed(*args, **kwargs):
+            start = perf_counter_ns()
+            try:
+                return fun(*args, **kwargs)
+            finally:
+                update(max(perf_counter_ns() - start - overhead, 0) * 1e-9)
+
+        return timed
+
+
+def measure_overhead(repeat: int = 10000, rounds: int = 5) -> float:
+    """ median time in ns measured by a timer around an empty region """
+    measures = []
+    timer = Timer(measures.append)
+
+    medians = []
+    for _ in range(rounds):
+        measures.clear()
+        for _ in range(repeat):
+            with timer:
+                pass
+
+        medians.append(statistics.median(measures) * 1e9)
+
+    return min(medians)
+
+
+def calibrate(force: bool = False) -> int:
+    """ cost of the instrumentation in ns, measured once per process """
+    global _overhead_ns
+
+    if _overhead_ns is None or force:
+        _overhead_ns = int(measure_overhead())
+
+    return _overhead_ns
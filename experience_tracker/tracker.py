@@ -9,7 +9,9 @@ import argparse
 import hashlib
 
 import experience_tracker.database as database
-from experience_tracker.local_server import make_local_server
+from experience_tracker.async_server import AsyncLocalServer
+from experience_tracker.local_server import socket_path
+from experience_tracker.transport import SOCKET_ENV
 
 
 def make_nvprof_folder(dry_run=False, folder=None):
@@ -48,7 +50,15 @@ def main():
                         help='Wrap the run script inside a nvprof call')
 
     parser.add_argument('--server', action='store_true', default=False,
-                        help='Start a local server for Inter Process communication')
+                        help='Start a local server for Inter Process communication, on a unix socket of this job '
+                             'passed to the program as $EXP_TRACKER_SOCKET')
+
+    parser.add_argument('--server-port', type=int, default=None,
+                        help='Serve the HTTP routes on this port for the clients without the socket '
+                             '(default: 8123 with --server)')
+
+    parser.add_argument('--db', type=str, default=database.TINY_DB,
+                        help='Path or URL of the database (e.g. benchmark.db, sqlite://benchmark.db)')
 
     parser.add_argument('program')
     #
@@ -57,8 +67,26 @@ def main():
 
     args, unknown = parser.parse_known_args()
     local = None
+    socket = None
+    port = args.server_port
     if args.server:
-        local = make_local_server(8123)
+        socket = socket_path()
+
+    # the clients posting to localhost:8123 still work next to the socket
+    if args.server and port is None:
+        port = 8123
+
+    # runs in this process so the metrics can be saved with the observation
+    if socket is not None or port is not None:
+        try:
+            local = AsyncLocalServer(socket, port).start()
+        except OSError as e:
+            if args.server_port is not None:
+                raise
+
+            # another job of the node has the default port, its own clients use the socket
+            print('Could not serve HTTP on port {} ({}), only the socket {} is served'.format(port, e, socket))
+            local = AsyncLocalServer(socket).start()
 
     #
     #   Configure environment
@@ -67,7 +95,7 @@ def main():
     program_name = args.program
     arguments = unknown
 
-    db = database.ExperienceDatabase()
+    db = database.ExperienceDatabase(args.db)
     system = database.System.get_system()
     program = database.Program(program_name, arguments)
 
@@ -87,6 +115,8 @@ def main():
 
         sub_env = os.environ.copy()
         sub_env['PYTHONUNBUFFERED'] = 'True'
+        if socket is not None:
+            sub_env[SOCKET_ENV] = socket
 
         pipe = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=sub_env)
         out = []
@@ -126,11 +156,13 @@ def main():
                 }
                 reports[report] = data
 
+        # metrics sent by the program
+        if local is not None:
+            reports.update(local.stop())
+
         # Run finished successfully
         # Push data to DB
         program.add_system(system.uid)
-        db.insert_program(program)
-        db.insert_system(system)
         observation = database.Observation(
             program.uid,
             system.uid,
@@ -139,9 +171,10 @@ def main():
             out,
             err
         )
-        db.insert_observation(observation)
-        if local is not None:
-            local.terminate()
+        with db.batch() as batch:
+            batch.insert_program(program)
+            batch.insert_system(system)
+            batch.insert_observation(observation)
         sys.exit()
 
     except subprocess.CalledProcessError as e:
@@ -149,6 +182,11 @@ def main():
         print(e)
         sys.exit(-1)
 
+    finally:
+        # removes the socket of the job
+        if local is not None:
+            local.stop()
+
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,338 @@
+import atexit
+import collections
+import json
+import os
+import socket
+import struct
+import threading
+import time
+from typing import *
+
+import requests
+
+from experience_tracker.stats import merge_sampling, is_scalar, pack_array, unpack_array
+
+# what to do when the queue is full
+POLICIES = ('block', 'drop_new', 'drop_old')
+
+# unix socket of the tracker of the current job, set by `exp-tracker --server` for the wrapped program
+SOCKET_ENV = 'EXP_TRACKER_SOCKET'
+
+# binary records sent over the unix socket, see `pack_records`
+RECORD_KINDS = ('push', 'stream', 'quantiles', 'histogram', 'windowed', 'merge', 'program', 'system')
+RECORD_CODES = {kind: code for code, kind in enumerate(RECORD_KINDS)}
+
+# records whose value is any JSON (key/value pushes, description of the program and the system)
+JSON_KINDS = ('push', 'program', 'system')
+
+# kind code, scalar flag, namespace length, key length, number of values, length of the JSON extras, drop_obs
+RECORD = struct.Struct('<BBHHIIq')
+
+# a batch: length of the packed records, number of records
+FRAME = struct.Struct('<II')
+
+# reply to a batch: status (0 ok), length of the error message
+STATUS = struct.Struct('<BI')
+
+# record fields stored in the fixed part of the binary record
+FIXED_FIELDS = ('kind', 'namespace', 'key', 'value', 'drop_obs')
+
+
+def http_sender(url: str = 'http://localhost:8123/batch') -> Callable[[List[Dict]], None]:
+    """ send a batch of records to the `LocalServer` batch endpoint """
+    session = requests.Session()
+
+    def send(records: List[Dict]):
+        session.post(url, json={'records': records}).raise_for_status()
+
+    return send
+
+
+def pack_records(records: List[Dict]) -> bytes:
+    """
+        Binary batch of records: `FRAME` followed by one `RECORD` per record, its namespace, key (utf-8),
+        values (float64) and the remaining fields as JSON (`samples`, `time`, `sampling`, pushed value, states...).
+        The values of the streams, which make most of the traffic, are never converted to text
+    """
+    parts = []
+
+    for record in records:
+        namespace = record['namespace'].encode('utf-8')
+        key = record['key'].encode('utf-8')
+        extra = {k: v for k, v in record.items() if k not in FIXED_FIELDS}
+
+        value = record.get('value')
+        scalar = False
+        values = b''
+        count = 0
+
+        if record['kind'] in JSON_KINDS:
+            extra['value'] = value
+
+        elif value is not None:
+            scalar = is_scalar(value)
+            values = pack_array('d', [value] if scalar else value)
+            count = len(values) // 8
+
+        extra = json.dumps(extra).encode('utf-8') if extra else b''
+
+        parts.append(RECORD.pack(RECORD_CODES[record['kind']], scalar, len(namespace), len(key), count, len(extra),
+                                 record.get('drop_obs', 0)))
+        parts.extend((namespace, key, values, extra))
+
+    payload = b''.join(parts)
+    return FRAME.pack(len(payload), len(records)) + payload
+
+
+def unpack_records(payload: bytes, count: int) -> List[Dict]:
+    """ records of a batch packed by `pack_records`, `payload` is what follows the `FRAME` """
+    records = []
+    offset = 0
+
+    for _ in range(count):
+        code, scalar, namespace, key, size, extra, drop_obs = RECORD.unpack_from(payload, offset)
+        offset += RECORD.size
+
+        record = {
+            'kind': RECORD_KINDS[code],
+            'namespace': payload[offset:offset + namespace].decode('utf-8'),
+            'key': payload[offset + namespace:offset + namespace + key].decode('utf-8'),
+            'drop_obs': drop_obs,
+        }
+        offset += namespace + key
+
+        # pushed values and states are in the extras
+        if RECORD_KINDS[code] not in JSON_KINDS and code != RECORD_CODES['merge']:
+            values, offset = unpack_array('d', payload, offset, size)
+            record['value'] = values[0] if scalar else values.tolist()
+
+        if extra:
+            record.update(json.loads(payload[offset:offset + extra].decode('utf-8')))
+            offset += extra
+
+        records.append(record)
+
+    return records
+
+
+def read_exactly(stream, size: int) -> Optional[bytes]:
+    """ `size` bytes read from a socket file, None if the connection was closed """
+    data = stream.read(size)
+    if len(data) < size:
+        return None
+    return data
+
+
+def uds_sender(path: str = None) -> Callable[[List[Dict]], None]:
+    """
+        send a batch of records to the tracker listening on the unix socket `path` (default: `$EXP_TRACKER_SOCKET`),
+        the connection is kept open between the batches
+    """
+    path = path or os.environ[SOCKET_ENV]
+    connection = None
+    replies = None
+
+    def send(records: List[Dict]):
+        nonlocal connection, replies
+
+        try:
+            if connection is None:
+                connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                connection.connect(path)
+                replies = connection.makefile('rb')
+
+            connection.sendall(pack_records(records))
+            reply = read_exactly(replies, STATUS.size)
+            if reply is None:
+                raise ConnectionError('tracker socket `{}` was closed'.format(path))
+
+        except OSError:
+            # connect again for the next batch
+            if connection is not None:
+                connection.close()
+            connection = None
+            raise
+
+        status, size = STATUS.unpack(reply)
+        if status != 0:
+            raise ValueError(replies.read(size).decode('utf-8'))
+
+    return send
+
+
+def default_sender() -> Callable[[List[Dict]], None]:
+    """ the unix socket of the job when the program is wrapped by `exp-tracker --server`, HTTP otherwise """
+    if os.environ.get(SOCKET_ENV):
+        return uds_sender(os.environ[SOCKET_ENV])
+    return http_sender()
+
+
+def coalesce(records: List[Dict]) -> List[Dict]:
+    """
+        Merge the records of the same stream into a single record holding the list of their values;
+        for the key/value records (`kind='push'`), the program and the system the last value wins.
+        Windowed records are only merged if they have the same timestamp and samples,
+        partial states (`kind='merge'`) are kept as is
+    """
+    merged: Dict[tuple, Dict] = {}
+    # records whose value is a list owned by the merged record
+    owned = set()
+
+    for i, record in enumerate(records):
+        if record['kind'] in JSON_KINDS:
+            merged[(record['kind'], record['namespace'], record['key'])] = record
+            continue
+
+        if record['kind'] == 'merge':
+            merged[('merge', i)] = record
+            continue
+
+        key = (record['kind'], record['namespace'], record['key'], record['drop_obs'],
+               record.get('time'), record.get('samples'))
+
+        previous = merged.get(key)
+        if previous is None:
+            merged[key] = dict(record)
+            continue
+
+        if key not in owned:
+            value = previous['value']
+            previous['value'] = list(value) if isinstance(value, list) else [value]
+            owned.add(key)
+
+        if isinstance(record['value'], list):
+            previous['value'].extend(record['value'])
+        else:
+            previous['value'].append(record['value'])
+
+        if 'sampling' in record:
+            previous['sampling'] = merge_sampling(previous.get('sampling'), record['sampling'])
+
+    return list(merged.values())
+
+
+class BatchTransport:
+    """
+        Send the records from a background thread so pushing a metric does not wait for the server.
+
+        Records are queued in a bounded queue (`capacity`), coalesced (see `coalesce`) and sent by batches
+        of at most `max_batch` records when the batch is full, every `interval` seconds and at exit.
+
+        When the queue is full, `policy` is:
+            - block   : wait for the sender to make room (backpressure)
+            - drop_new: drop the record being pushed
+            - drop_old: drop the oldest record of the queue
+
+        Batches that cannot be sent (server down) are dropped and counted in `errors`
+    """
+
+    def __init__(self, send: Callable[[List[Dict]], None] = None, max_batch: int = 512, interval: float = 0.5,
+                 capacity: int = 65536, policy: str = 'block'):
+        if policy not in POLICIES:
+            raise ValueError('Unknown policy `{}`, expected one of {}'.format(policy, POLICIES))
+
+        self.send = send or default_sender()
+        self.max_batch = max_batch
+        self.interval = interval
+        self.capacity = capacity
+        self.policy = policy
+
+        self.queue: Deque[Dict] = collections.deque()
+        self.lock = threading.Condition()
+        self.sending = False
+        self.flushing = False
+        self.closed = False
+
+        self.sent = 0
+        self.dropped = 0
+        self.batches = 0
+        self.errors = 0
+
+        self.thread = threading.Thread(target=self._run, name='BatchTransport', daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def put(self, record: Dict):
+        with self.lock:
+            if len(self.queue) >= self.capacity:
+                if self.policy == 'drop_new':
+                    self.dropped += 1
+                    return
+
+                if self.policy == 'drop_old':
+                    self.queue.popleft()
+                    self.dropped += 1
+                else:
+                    self.lock.notify_all()
+                    while len(self.queue) >= self.capacity and not self.closed:
+                        self.lock.wait()
+
+            self.queue.append(record)
+
+            if len(self.queue) >= self.max_batch:
+                self.lock.notify_all()
+
+    def flush(self, timeout: float = None):
+        """ wait until every queued record was sent """
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        with self.lock:
+            self.flushing = True
+            self.lock.notify_all()
+
+            while (self.queue or self.sending) and self.thread.is_alive():
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return
+
+                self.lock.wait(remaining)
+
+    def close(self, timeout: float = 10):
+        """ send the remaining records and stop the sender thread """
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.lock.notify_all()
+
+        self.thread.join(timeout)
+
+    def _run(self):
+        while True:
+            with self.lock:
+                deadline = time.monotonic() + self.interval
+
+                while len(self.queue) < self.max_batch and not (self.closed or self.flushing):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.lock.wait(remaining)
+
+                if not self.queue and self.closed:
+                    self.lock.notify_all()
+                    return
+
+                batch = [self.queue.popleft() for _ in range(min(len(self.queue), self.max_batch))]
+                self.sending = bool(batch)
+                self.flushing = self.flushing and bool(self.queue)
+
+                # room was made for the blocked producers
+                self.lock.notify_all()
+
+            if batch:
+                self._send(batch)
+
+            with self.lock:
+                self.sending = False
+                self.lock.notify_all()
+
+    def _send(self, batch: List[Dict]):
+        try:
+            self.send(coalesce(batch))
+            self.sent += len(batch)
+            self.batches += 1
+        except Exception as e:
+            if self.errors == 0:
+                print('BatchTransport: could not send the metrics ({}), dropping them'.format(e))
+            self.errors += 1
+            self.dropped += len(batch)
@@ -9,7 +9,7 @@ if __name__ == '__main__':
         version='0.0.0',
         description='Archive execution data to a database for posterity',
         author='Pierre Delaunay',
-        packages=['experience_tracker'],
+        packages=['experience_tracker', 'experience_tracker.backends'],
         install_requires=[
             'flask',
             'pandas',
@@ -21,7 +21,8 @@ if __name__ == '__main__':
             'console_scripts': [
                 'exp-tracker = experience_tracker.tracker:main',
                 'exp-explorer = experience_tracker.explorer:main',
-                'exp-explorer-cli = experience_tracker.cli_explorer:main'
+                'exp-explorer-cli = experience_tracker.cli_explorer:main',
+                'exp-tracker-admin = experience_tracker.admin:main'
             ]
         }
     )
@@ -0,0 +1,82 @@
+import argparse
+import json
+import time
+from time import perf_counter_ns
+
+from experience_tracker.logger import LocalNamespace
+from experience_tracker.timer import measure_overhead
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='Measure the cost of timing a region with the logger')
+    parser.add_argument('--repeat', default=200000, type=int, help='number of timed regions per method')
+    parser.add_argument('--output', default=None, type=str, help='write the results as JSON to this file')
+    return parser
+
+
+def bench(fun, repeat) -> float:
+    """ ns per call of `fun` """
+    start = perf_counter_ns()
+    fun(repeat)
+    return (perf_counter_ns() - start) / repeat
+
+
+def main():
+    args = get_parser().parse_args()
+    namespace = LocalNamespace('bench', {})
+
+    def baseline(n):
+        for _ in range(n):
+            pass
+
+    def manual(n):
+        # what the README example does
+        for _ in range(n):
+            start = time.time()
+            end = time.time()
+            namespace.push_stream('manual', end - start)
+
+    timer = namespace.timer('context')
+
+    def context(n):
+        for _ in range(n):
+            with timer:
+                pass
+
+    @namespace.timer('decorator')
+    def region():
+        pass
+
+    def decorator(n):
+        for _ in range(n):
+            region()
+
+    corrected = namespace.timer('corrected', subtract_overhead=True)
+
+    def subtracted(n):
+        for _ in range(n):
+            with corrected:
+                pass
+
+    loop = bench(baseline, args.repeat)
+    results = {
+        'calibrated_overhead_ns': measure_overhead(),
+        'manual time.time + push_stream': bench(manual, args.repeat) - loop,
+        'timer context manager': bench(context, args.repeat) - loop,
+        'timer decorator': bench(decorator, args.repeat) - loop,
+        'timer subtract_overhead': bench(subtracted, args.repeat) - loop,
+    }
+
+    print('{:>35}: {:8.1f} ns'.format('empty region measured as', results['calibrated_overhead_ns']))
+    for name in list(results)[1:]:
+        print('{:>35}: {:8.1f} ns/region'.format(name, results[name]))
+
+    print('{:>35}: {:8.1f} ns'.format('corrected empty region avg', namespace.reports['corrected'].avg * 1e9))
+
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
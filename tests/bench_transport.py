@@ -0,0 +1,127 @@
+import argparse
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+from typing import *
+
+from experience_tracker.async_server import AsyncLocalServer
+from experience_tracker.logger import RemoteTrackLogger
+from experience_tracker.transport import http_sender, uds_sender
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Compare the throughput of the HTTP and unix socket transports of the tracker collector')
+    parser.add_argument('--batches', default=200, type=int, help='number of batches sent by each sender')
+    parser.add_argument('--batch-size', default=512, type=int, help='number of records per batch')
+    parser.add_argument('--round-trips', default=2000, type=int, help='number of single record batches')
+    parser.add_argument('--pushes', default=200000, type=int, help='number of values pushed through the logger')
+    parser.add_argument('--port', default=8124, type=int, help='port of the HTTP server')
+    parser.add_argument('--output', default=None, type=str, help='write the results as JSON to this file')
+    return parser
+
+
+def serve(path, port):
+    """ the collector of `exp-tracker`, in its own process like for a tracked job """
+    AsyncLocalServer(path, port).start().thread.join()
+
+
+def wait_ready(send, timeout=10):
+    deadline = time.monotonic() + timeout
+
+    while True:
+        try:
+            return send([])
+        except Exception:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+def bench_sender(send, batches, batch_size) -> Dict:
+    """ send batches of distinct stream records (nothing to coalesce) """
+    batch = [{'kind': 'stream', 'namespace': 'bench', 'key': 'key{}'.format(i), 'value': float(i), 'drop_obs': 0}
+             for i in range(batch_size)]
+
+    start = time.perf_counter()
+    for _ in range(batches):
+        send(batch)
+    elapsed = time.perf_counter() - start
+
+    return {
+        'records/s': batches * batch_size / elapsed,
+        'us/batch': elapsed / batches * 1e6,
+    }
+
+
+def bench_logger(send, pushes) -> Dict:
+    """ values pushed to 16 streams through the asynchronous logger, until the server received them """
+    tracker = RemoteTrackLogger(send=send)
+    namespace = tracker.namespace('bench')
+
+    start = time.perf_counter()
+    for i in range(pushes):
+        namespace.push_stream('key{}'.format(i % 16), float(i))
+    pushed = time.perf_counter() - start
+
+    tracker.flush()
+    elapsed = time.perf_counter() - start
+    tracker.transport.close()
+
+    return {
+        'pushes/s': pushes / elapsed,
+        'us/push': pushed / pushes * 1e6,
+        'batches': tracker.transport.batches,
+        'errors': tracker.transport.errors,
+    }
+
+
+def main():
+    args = get_parser().parse_args()
+
+    path = os.path.join(tempfile.gettempdir(), 'exp-tracker-bench-{}.sock'.format(os.getpid()))
+    server = multiprocessing.Process(target=serve, args=(path, args.port))
+    server.start()
+
+    try:
+        senders = {
+            'http': http_sender('http://localhost:{}/batch'.format(args.port)),
+            'unix socket': uds_sender(path),
+        }
+        for send in senders.values():
+            wait_ready(send)
+
+        results = {}
+        for name, send in senders.items():
+            results[name] = {
+                'sender': bench_sender(send, args.batches, args.batch_size),
+                # synchronous logger, one request per value
+                'round trip': bench_sender(send, args.round_trips, 1),
+                'logger': bench_logger(send, args.pushes),
+            }
+
+        for name, result in results.items():
+            print('{:>12}: {:10.0f} records/s {:8.1f} us/batch | round trip {:7.1f} us | '
+                  'logger {:8.0f} pushes/s {:5.2f} us/push'.format(
+                    name, result['sender']['records/s'], result['sender']['us/batch'],
+                    result['round trip']['us/batch'], result['logger']['pushes/s'], result['logger']['us/push']))
+
+        for bench, unit in (('sender', 'records/s'), ('round trip', 'records/s'), ('logger', 'pushes/s')):
+            print('{:>12}: {:10.1f}x unix socket / http'.format(
+                bench, results['unix socket'][bench][unit] / results['http'][bench][unit]))
+
+        if args.output is not None:
+            with open(args.output, 'w') as file:
+                json.dump(results, file, indent=2)
+    finally:
+        server.terminate()
+        server.join()
+
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+if __name__ == '__main__':
+    main()
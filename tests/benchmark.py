@@ -0,0 +1,200 @@
+import argparse
+import base64
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import *
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='Benchmark the database and explorer hot paths on synthetic data')
+    parser.add_argument('--backend', default='tinydb', choices=['tinydb', 'sqlite'])
+    parser.add_argument('--programs', default=10, type=int)
+    parser.add_argument('--systems', default=2, type=int)
+    parser.add_argument('--observations', default=5, type=int, help='observations per program and system')
+    parser.add_argument('--stdout-lines', default=200, type=int)
+    parser.add_argument('--kernels', default=40, type=int, help='GPU kernels per nvprof report')
+    parser.add_argument('--repeat', default=5, type=int, help='number of timed runs of each benchmark')
+    parser.add_argument('--output', default=None, type=str, help='write the results as JSON to this file')
+    parser.add_argument('--baseline', default=None, type=str, help='JSON results to compare against')
+    return parser
+
+
+def revision() -> Optional[str]:
+    try:
+        folder = os.path.dirname(os.path.abspath(__file__))
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'], cwd=folder, stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Suite:
+    def __init__(self, repeat: int):
+        self.repeat = repeat
+        self.results: Dict[str, Dict] = {}
+
+    def run(self, name: str, fun: Callable, repeat: int = None, ops: int = 1):
+        """ time `fun` `repeat` times then measure its peak memory in one extra (slower) run """
+        times = []
+
+        # the explorer prints a lot
+        with contextlib.redirect_stdout(io.StringIO()):
+            for _ in range(repeat or self.repeat):
+                start = time.perf_counter()
+                fun()
+                times.append(time.perf_counter() - start)
+
+            tracemalloc.start()
+            fun()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+        self.results[name] = {
+            'repeat': len(times),
+            'ops': ops,
+            'min': min(times),
+            'median': statistics.median(times),
+            'mean': statistics.mean(times),
+            'peak_memory': peak,
+        }
+
+        print('{:>30}: {:10.3f} ms (min: {:10.3f} ms) {:10.2f} Kio'.format(
+            name, self.results[name]['median'] * 1000, min(times) * 1000, peak / 1024))
+
+
+def benchmark(args, location: str) -> Dict:
+    # the explorers open the default database when imported
+    os.environ['EXP_TRACKER_DB'] = location
+    from experience_tracker.database import ExperienceDatabase
+    import experience_tracker.explorer as explorer
+    import experience_tracker.cli_explorer as cli_explorer
+    from tests.synthetic import generate, make_observation
+
+    start = time.perf_counter()
+    data = generate(location, args.programs, args.systems, args.observations, args.stdout_lines, args.kernels)
+    generate_time = time.perf_counter() - start
+    print('{:>30}: {:10.3f} s'.format('generate', generate_time))
+
+    db = ExperienceDatabase(location)
+    explorer.db = db
+    cli_explorer.database = db
+    client = explorer.app.test_client()
+
+    rng = random.Random(1)
+    programs = data['programs']
+    systems = data['systems']
+    suite = Suite(args.repeat)
+
+    # Insert
+    def insert_single(n=10):
+        for i in range(n):
+            db.insert_observation(make_observation(rng, programs[0], systems[0], i, args.stdout_lines, args.kernels))
+
+    def insert_batch(n=10):
+        with db.batch() as batch:
+            for i in range(n):
+                batch.insert_observation(
+                    make_observation(rng, programs[0], systems[0], i, args.stdout_lines, args.kernels))
+
+    suite.run('insert_observation x10', insert_single, ops=10)
+    suite.run('batch insert x10', insert_batch, ops=10)
+
+    # Lookup
+    def lookup_programs():
+        for program in programs:
+            db.get_program(by='uid', value=program.uid)
+
+    def lookup_systems():
+        for system in systems:
+            db.get_system(by='hostname', value=system.hostname)
+
+    def search_observations():
+        for program in programs:
+            db.search_observations(program_uid=program.uid)
+
+    suite.run('get_program (all)', lookup_programs, ops=len(programs))
+    suite.run('get_system (all)', lookup_systems, ops=len(systems))
+    suite.run('search_observations (all)', search_observations, ops=len(programs))
+
+    # Listing
+    suite.run('programs', db.programs)
+    suite.run('observations (full)', db.observations)
+    suite.run('iter_observations (proj)', lambda: list(db.iter_observations(fields=['program_uid', 'date'])))
+    suite.run('cli list-obs', cli_explorer.list_obs)
+    suite.run('cli show-obs', lambda: cli_explorer.show_obs(0))
+
+    # Explorer routes
+    def get(url):
+        response = client.get(url)
+        assert response.status_code == 200, '{} returned {}'.format(url, response.status_code)
+
+    name = base64.b64encode(programs[0].name.encode('utf8')).decode('utf-8')
+    suite.run('GET /', lambda: get('/'))
+    suite.run('GET /job/<uid>', lambda: get('/job/{}'.format(programs[-1].uid)))
+    suite.run('GET /compare/<name>/<host>', lambda: get('/compare/{}/{}'.format(name, systems[0].hostname)))
+
+    db.close()
+
+    return {
+        'date': str(datetime.datetime.now()),
+        'revision': revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'config': {
+            'backend': args.backend,
+            'programs': args.programs,
+            'systems': args.systems,
+            'observations': args.observations,
+            'stdout_lines': args.stdout_lines,
+            'kernels': args.kernels,
+            'repeat': args.repeat,
+        },
+        'generate': generate_time,
+        'results': suite.results,
+    }
+
+
+def compare(results: Dict, baseline: Dict):
+    print('\n{:>30}  {:>10} {:>10} {:>8}'.format('', 'baseline', 'current', 'ratio'))
+    for name, result in results['results'].items():
+        if name not in baseline['results']:
+            continue
+
+        old = baseline['results'][name]['median']
+        print('{:>30}: {:10.3f} {:10.3f} {:8.2f}'.format(
+            name, old * 1000, result['median'] * 1000, result['median'] / old))
+
+
+def main():
+    args = get_parser().parse_args()
+
+    folder = tempfile.mkdtemp('_bench')
+    location = '{}://{}'.format(args.backend, os.path.join(folder, 'benchmark.db'))
+    results = benchmark(args, location)
+
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r') as file:
+            compare(results, json.load(file))
+
+    if args.output is None:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+import argparse
+import math
+import sys
+import time
+from typing import *
+
+import numpy as np
+from flask import Flask
+
+from experience_tracker.local_server import LocalServer
+from experience_tracker.logger import LocalNamespace, RemoteTrackLogger
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Check that the streams aggregated by the client and merged by the server match the local mode')
+    parser.add_argument('--values', default=100000, type=int, help='number of values pushed to each stream')
+    parser.add_argument('--interval', default=0.01, type=float, help='seconds between two partial states')
+    parser.add_argument('--seed', default=0, type=int)
+    return parser
+
+
+def in_process_server():
+    """ LocalServer behind a flask test client, the records do not go through the network """
+    LocalServer.namespaces.clear()
+    app = Flask('check_aggregation')
+    LocalServer.register(app)
+    client = app.test_client()
+
+    def send(records):
+        response = client.post('/batch', json={'records': records})
+        assert response.status_code == 204, response.data
+
+    return send
+
+
+def push_all(namespace, values, batches):
+    for i, value in enumerate(values):
+        namespace.push_stream('stream', value, drop_obs=10)
+        namespace.push_histogram('histogram', value, drop_obs=3)
+        namespace.push_windowed('windowed', value, samples=32)
+
+        if i % 100 == 0:
+            namespace.push_quantiles('quantiles', batches[i // 100])
+
+
+def close(a, b, tolerance=1e-9) -> bool:
+    return math.isclose(a, b, rel_tol=tolerance, abs_tol=tolerance)
+
+
+def check(local, remote, values, batches) -> List[str]:
+    errors = []
+
+    def expect(name, ok):
+        print('    {:<50} {}'.format(name, 'ok' if ok else 'FAILED'))
+        if not ok:
+            errors.append(name)
+
+    a, b = local['stream'], remote['stream']
+    expect('stream count/min/max/last', (a.count, a.min, a.max, a.val) == (b.count, b.min, b.max, b.val))
+    expect('stream mean/sd', close(a.avg, b.avg) and close(a.sd, b.sd))
+
+    a, b = local['histogram'], remote['histogram']
+    expect('histogram buckets', list(a.counts) == list(b.counts) and a.count == b.count)
+    expect('histogram sum', close(a.sum, b.sum))
+
+    a, b = local['windowed'], remote['windowed']
+    expect('windowed count/samples', (a.count, a.samples) == (b.count, b.samples))
+    expect('windowed sum', close(a.sum, b.sum))
+    expect('windowed series', [w['count'] for w in a.series()] == [w['count'] for w in b.series()])
+
+    # the sketches are randomized, compare the rank of the quantiles with the rank error bound (1.65% for k=200)
+    a, b = local['quantiles'], remote['quantiles']
+    raw = np.sort(np.concatenate(batches))
+    expect('quantiles count/min/max', (a.count, a.min, a.max) == (b.count, b.min, b.max))
+
+    for q in (0.5, 0.95, 0.99):
+        rank = np.searchsorted(raw, b.quantile(q), side='right') / len(raw)
+        expect('quantiles p{:.0f} rank error {:.4f}'.format(q * 100, abs(rank - q)), abs(rank - q) < 0.0165)
+
+    return errors
+
+
+def main():
+    args = get_parser().parse_args()
+    rng = np.random.default_rng(args.seed)
+    values = rng.lognormal(size=args.values).tolist()
+    batches = [rng.lognormal(size=100) for _ in range(args.values // 100 + 1)]
+
+    reports = {}
+    local = LocalNamespace('check', reports)
+
+    start = time.perf_counter()
+    push_all(local, values, batches)
+    local_time = time.perf_counter() - start
+
+    tracker = RemoteTrackLogger(aggregate=args.interval, send=in_process_server())
+    remote = tracker.namespace('check')
+
+    start = time.perf_counter()
+    push_all(remote, values, batches)
+    remote_time = time.perf_counter() - start
+
+    tracker.flush()
+    shipped = tracker.transport.sent
+
+    print('push cost per value (4 streams): local {:.2f} us, remote aggregated {:.2f} us ({} partial states)'.format(
+        local_time / args.values * 1e6, remote_time / args.values * 1e6, shipped))
+
+    errors = check(reports['check'], LocalServer.namespaces['check'], values, batches)
+    if errors:
+        print('[E] {} checks failed'.format(len(errors)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
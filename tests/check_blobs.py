@@ -0,0 +1,55 @@
+import argparse
+import shutil
+import sys
+import tempfile
+
+from experience_tracker.blobs import BlobStore
+
+# outputs whose lines must be read back as they were written
+OUTPUTS = {
+    'lines': ['epoch 0\n', 'epoch 1\n'],
+    'no trailing newline': ['epoch 0\n', 'done'],
+    'progress bar': ['  0%|          | 0/10\r 50%|#####     | 5/10\r100%|##########| 10/10\n', 'done\n'],
+    'crlf': ['windows\r\n', 'line\r\n'],
+    'other boundaries': ['form\x0cfeed\x0b\x1c\x1d\x1e\x85 \u2028 \u2029\n', '\n', '\n'],
+    'empty': [],
+}
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Check that the stdout/stderr lines saved in the blob store are read back unchanged')
+    return parser
+
+
+def main():
+    get_parser().parse_args()
+
+    root = tempfile.mkdtemp()
+    blobs = BlobStore(root)
+    errors = []
+
+    try:
+        for name, lines in OUTPUTS.items():
+            ref = blobs.put_lines(lines)
+            result = blobs.get_lines(ref)
+
+            if result != lines:
+                errors.append('{}: {!r} read as {!r}'.format(name, lines, result))
+
+            if ref['lines'] != len(result):
+                errors.append('{}: {} lines saved, {} read'.format(name, ref['lines'], len(result)))
+    finally:
+        shutil.rmtree(root)
+
+    for error in errors:
+        print('[E] {}'.format(error))
+
+    if errors:
+        sys.exit(1)
+
+    print('{} outputs read back unchanged'.format(len(OUTPUTS)))
+
+
+if __name__ == '__main__':
+    main()
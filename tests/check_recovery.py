@@ -0,0 +1,113 @@
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from experience_tracker.admin import recover
+from experience_tracker.checkpoint import pending
+from experience_tracker.database import ExperienceDatabase
+from experience_tracker.stats import peek
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Kill a job using checkpoints and check that its metrics are recovered')
+    parser.add_argument('--epochs', default=5, type=int, help='epochs done by the job before it is killed')
+    parser.add_argument('--steps', default=1000, type=int, help='values pushed per epoch')
+    parser.add_argument('--interval', default=0.1, type=float, help='seconds between two checkpoints')
+    return parser
+
+
+def last_loss(epoch, step, steps):
+    return 1.0 / (epoch * steps + step + 1)
+
+
+def job(epochs, steps, interval):
+    """ pushes metrics, waits for a checkpoint after each epoch and is killed before `persist` """
+    from experience_tracker.logger import make_tracker
+
+    tracker = make_tracker('local', checkpoint=interval)
+    perf = tracker.namespace('perf')
+    model = tracker.namespace('model')
+    # no key is added to these namespaces after the first epoch, only pushed again or changed in place
+    train = tracker.namespace('train')
+    state = tracker.namespace('state')
+    timer = perf.timer('region')
+    progress = {}
+    state.push('progress', progress)
+
+    for epoch in range(epochs):
+        for step in range(steps):
+            perf.push_stream('step', 0.01)
+            with timer:
+                pass
+
+            # the same key is pushed again between two checkpoints, the float often reuses the id of the previous one
+            train.push('loss', last_loss(epoch, step, steps))
+
+        # changed in place
+        progress['epoch'] = epoch
+        model.push('accuracy_E{}'.format(epoch), epoch)
+        time.sleep(interval * 3)
+
+    os.kill(os.getpid(), 9)
+
+
+def main():
+    args = get_parser().parse_args()
+
+    if os.environ.get('CHECK_RECOVERY_JOB'):
+        return job(args.epochs, args.steps, args.interval)
+
+    folder = tempfile.mkdtemp()
+    location = os.path.join(folder, 'recovery.db')
+    env = dict(os.environ, CHECK_RECOVERY_JOB='1', EXP_TRACKER_DB=location)
+
+    process = subprocess.run([sys.executable, '-m', 'tests.check_recovery'] + sys.argv[1:], env=env)
+    print('job exited with {}, {} checkpoint files'.format(process.returncode, len(pending(location))))
+
+    recover(location)
+
+    db = ExperienceDatabase(location)
+    observations = list(db.iter_observations())
+    errors = []
+
+    if len(observations) != 1:
+        errors.append('{} observations recovered'.format(len(observations)))
+    else:
+        reports = observations[0]['reports']
+        expected = args.epochs * args.steps
+
+        for key in ('step', 'region'):
+            count = peek(reports['perf'][key])['count']
+            if count != expected:
+                errors.append('perf/{}: {} values out of {}'.format(key, count, expected))
+
+        if sorted(reports['model']) != sorted('accuracy_E{}'.format(i) for i in range(args.epochs)):
+            errors.append('model: {}'.format(sorted(reports['model'])))
+
+        train = reports.get('train', {})
+        state = reports.get('state', {})
+        loss = last_loss(args.epochs - 1, args.steps - 1, args.steps)
+        if train.get('loss') != loss:
+            errors.append('train/loss: {} instead of the last value pushed {}'.format(train.get('loss'), loss))
+
+        if state.get('progress') != {'epoch': args.epochs - 1}:
+            errors.append('state/progress: {}'.format(state.get('progress')))
+
+    if pending(location):
+        errors.append('checkpoint files left after the recovery')
+
+    for error in errors:
+        print('[E] {}'.format(error))
+
+    if errors:
+        sys.exit(1)
+
+    print('recovered {} values of each stream and {} epochs'.format(args.epochs * args.steps, args.epochs))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+from experience_tracker.async_server import AsyncLocalServer
+from experience_tracker.logger import RemoteTrackLogger
+from experience_tracker.transport import http_sender, uds_sender
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description='Load test of the asyncio collector: many processes pushing metrics at the same time')
+    parser.add_argument('--clients', default=32, type=int, help='number of producer processes')
+    parser.add_argument('--pushes', default=2000, type=int, help='number of values pushed by each client')
+    parser.add_argument('--transport', default='uds', choices=['uds', 'http'])
+    parser.add_argument('--synchronous', action='store_true', default=False,
+                        help='send every push in its own request instead of batches')
+    parser.add_argument('--output', default=None, type=str, help='write the results as JSON to this file')
+    return parser
+
+
+def client(index, address, transport, pushes, synchronous, start):
+    send = uds_sender(address) if transport == 'uds' else http_sender(address)
+    tracker = RemoteTrackLogger(asynchronous=not synchronous, send=send)
+    namespace = tracker.namespace('load')
+
+    start.wait()
+    for i in range(pushes):
+        namespace.push_stream('all', float(i))
+        namespace.push_stream('client{}'.format(index), float(i))
+
+    namespace.push('done{}'.format(index), True)
+    tracker.flush()
+
+    if tracker.transport is not None and tracker.transport.errors:
+        sys.exit(1)
+
+
+def main():
+    args = get_parser().parse_args()
+
+    path = os.path.join(tempfile.gettempdir(), 'exp-tracker-load-{}.sock'.format(os.getpid()))
+    if args.transport == 'uds':
+        server = AsyncLocalServer(path=path).start()
+        address = path
+    else:
+        server = AsyncLocalServer(port=0).start()
+        address = 'http://localhost:{}/batch'.format(server.port)
+
+    start = multiprocessing.Event()
+    clients = [multiprocessing.Process(target=client, args=(i, address, args.transport, args.pushes,
+                                                             args.synchronous, start))
+               for i in range(args.clients)]
+
+    for process in clients:
+        process.start()
+
+    begin = time.perf_counter()
+    start.set()
+
+    for process in clients:
+        process.join()
+
+    elapsed = time.perf_counter() - begin
+    namespace = server.stop().get('load', {})
+
+    # every value of every client must have been received
+    expected = args.clients * args.pushes
+    errors = [process.exitcode for process in clients if process.exitcode != 0]
+    received = namespace['all'].count if 'all' in namespace else 0
+
+    for i in range(args.clients):
+        stream = namespace.get('client{}'.format(i))
+        if stream is None or stream.count != args.pushes or namespace.get('done{}'.format(i)) is not True:
+            errors.append(i)
+
+    results = {
+        'clients': args.clients,
+        'transport': args.transport,
+        'synchronous': args.synchronous,
+        'pushes': expected * 2,
+        'received': received,
+        'elapsed': elapsed,
+        'pushes/s': expected * 2 / elapsed,
+        'batches': server.batches,
+        'errors': server.errors + len(errors),
+    }
+
+    print('{clients} clients ({transport}{sync}): {pushes} pushes in {elapsed:.2f} s, {rate:.0f} pushes/s, '
+          '{batches} batches'.format(sync=', synchronous' if args.synchronous else '', rate=results['pushes/s'],
+                                     **results))
+
+    if args.output is not None:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=2)
+
+    if received != expected or errors:
+        print('[E] {} values received out of {}, {} clients failed'.format(received, expected, len(errors)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
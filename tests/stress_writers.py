@@ -0,0 +1,98 @@
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+
+from experience_tracker.database import ExperienceDatabase, Program, System, Observation
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='Run concurrent writers on a single database and check nothing was lost')
+    parser.add_argument('--writers', default=16, type=int, help='number of writer processes')
+    parser.add_argument('--inserts', default=50, type=int, help='number of observations inserted by each writer')
+    parser.add_argument('--db', default=None, type=str, help='database location, defaults to a temporary file')
+    parser.add_argument('--backend', default='tinydb', choices=['tinydb', 'sqlite'])
+    return parser
+
+
+def writer(location, worker, inserts):
+    db = ExperienceDatabase(location)
+    system = System((4, 'cpu', 'vendor'), [], (1, 1), 'host{}'.format(worker % 2))
+
+    for i in range(inserts):
+        # a few programs are shared between the writers
+        program = Program('stress.py', ['--arg', str(i % 5)])
+        program.add_system(system.uid)
+
+        observation = Observation(program.uid, system.uid, 'date', {'stress': {'worker': worker, 'i': i}},
+                                  ['worker {} insert {}\n'.format(worker, i)], [])
+
+        if i % 2 == 0:
+            db.insert_program(program)
+            db.insert_system(system)
+            db.insert_observation(observation)
+        else:
+            with db.batch() as batch:
+                batch.insert_program(program)
+                batch.insert_system(system)
+                batch.insert_observation(observation)
+
+    db.close()
+
+
+def check(location, writers, inserts) -> bool:
+    db = ExperienceDatabase(location)
+    observations = db.observations()
+
+    ids = [obs['id'] for obs in observations]
+    seen = {(obs['reports']['stress']['worker'], obs['reports']['stress']['i']) for obs in observations}
+    expected = {(w, i) for w in range(writers) for i in range(inserts)}
+    uids = [prog['uid'] for prog in db.programs()]
+
+    ok = True
+    if seen != expected:
+        print('[E] lost {} observations'.format(len(expected - seen)))
+        ok = False
+
+    if len(ids) != len(set(ids)):
+        print('[E] {} duplicated observation ids'.format(len(ids) - len(set(ids))))
+        ok = False
+
+    if len(uids) != len(set(uids)) or len(uids) != 5:
+        print('[E] expected 5 programs got {} ({} unique)'.format(len(uids), len(set(uids))))
+        ok = False
+
+    if len(db.systems()) != min(writers, 2):
+        print('[E] expected {} systems got {}'.format(min(writers, 2), len(db.systems())))
+        ok = False
+
+    print('{} observations, {} programs, {} systems'.format(len(observations), len(uids), len(db.systems())))
+    return ok
+
+
+def main():
+    args = get_parser().parse_args()
+
+    location = args.db
+    if location is None:
+        folder = tempfile.mkdtemp('_stress')
+        location = '{}://{}'.format(args.backend, os.path.join(folder, 'benchmark.db'))
+
+    procs = [multiprocessing.Process(target=writer, args=(location, w, args.inserts)) for w in range(args.writers)]
+    for proc in procs:
+        proc.start()
+
+    for proc in procs:
+        proc.join()
+
+    if any(proc.exitcode != 0 for proc in procs) or not check(location, args.writers, args.inserts):
+        print('FAILED ({})'.format(location))
+        sys.exit(1)
+
+    print('OK ({})'.format(location))
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
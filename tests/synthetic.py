@@ -0,0 +1,124 @@
+import argparse
+import random
+from typing import *
+
+from experience_tracker.database import ExperienceDatabase, Program, System, Observation
+
+GPU_KERNELS = [
+    'volta_sgemm_128x64_nn',
+    'volta_scudnn_128x64_relu_interior_nn_v1',
+    'void cudnn::detail::bn_fw_tr_1C11_kernel_NCHW<float, float, int=512, bool=1, int=1>(cudnnTensorStruct, float const *)',
+    'void at::native::vectorized_elementwise_kernel<int=4, at::native::AddFunctor<float>, at::detail::Array<char*, int=3>>(int, float, float)',
+    '[CUDA memcpy HtoD]',
+    '[CUDA memcpy DtoH]',
+    '[CUDA memset]',
+]
+
+API_CALLS = [
+    'cudaLaunchKernel', 'cudaMemcpyAsync', 'cudaMalloc', 'cudaFree', 'cudaStreamSynchronize',
+    'cudaEventRecord', 'cudaGetDevice', 'cudaSetDevice', 'cuDeviceGetAttribute',
+]
+
+
+def make_program(i: int, names: int = 4) -> Program:
+    # programs share a few names so /compare has something to compare
+    return Program('train_{}.py'.format(i % names), ['--batch-size', str(32 * (i + 1)), '--seed', str(i)])
+
+
+def make_system(i: int) -> System:
+    return System(
+        (16, 'x86_64', 'Intel(R) Xeon(R) CPU E5-2698 v4 @ 2.20GHz'),
+        [(d, 'Tesla V100-SXM2-16GB') for d in range(4)],
+        (64 * 1024 ** 3, 32 * 1024 ** 3),
+        'node{:03d}'.format(i))
+
+
+def make_stdout(rng: random.Random, lines: int) -> List[str]:
+    return [
+        '[{:3d}][{:5d}] loss: {:.4f} | time: {:.4f} s | lr: {:.5f}\n'.format(
+            i // 100, i, rng.uniform(0.5, 3.0), rng.uniform(0.05, 0.2), 0.1 / (1 + i // 100))
+        for i in range(lines)
+    ]
+
+
+def make_nvprof_csv(rng: random.Random, kernels: int) -> List[str]:
+    lines = [
+        '"Type","Time(%)","Time","Calls","Avg","Min","Max","Name"\n',
+        ',%,ms,,us,us,ms,\n'
+    ]
+
+    names = [('GPU activities', GPU_KERNELS[i % len(GPU_KERNELS)] + ('' if i < len(GPU_KERNELS) else '_{}'.format(i)))
+             for i in range(kernels)]
+    names += [('API calls', name) for name in API_CALLS]
+
+    for kind, name in names:
+        calls = rng.randint(1, 20000)
+        avg = rng.uniform(1, 500)
+        lines.append('"{}",{:.6f},{:.6f},{},{:.6f},{:.6f},{:.6f},"{}"\n'.format(
+            kind, rng.uniform(0, 30), calls * avg / 1000, calls, avg, avg * 0.8, avg * 1.5 / 1000, name))
+
+    return lines
+
+
+def make_observation(rng: random.Random, program: Program, system: System, index: int,
+                     stdout_lines: int, kernels: int) -> Observation:
+    reports = {
+        'train': {'epoch': 90, 'loss': rng.uniform(0.5, 1.0), 'accuracy': rng.uniform(0.6, 0.8)},
+        '/tmp/nvprof/report_{}.nvprof'.format(index): {
+            'nvprof': {
+                'nvprof_header': ['==1== NVPROF is profiling process 1\n', '==1== Profiling application\n',
+                                  '==1== Profiling result:\n'],
+                'csv': make_nvprof_csv(rng, kernels)
+            }
+        }
+    }
+    date = '2019-{:02d}-{:02d} 12:00:00.000000'.format(1 + index % 12, 1 + index % 28)
+    return Observation(program.uid, system.uid, date, reports, make_stdout(rng, stdout_lines), [])
+
+
+def generate(location: str, programs: int = 10, systems: int = 2, observations: int = 5,
+             stdout_lines: int = 200, kernels: int = 40, seed: int = 0) -> Dict[str, List]:
+    """
+        Fill `location` with `programs x systems x observations` observations,
+        returns the generated programs and systems
+    """
+    rng = random.Random(seed)
+    db = ExperienceDatabase(location)
+
+    progs = [make_program(i) for i in range(programs)]
+    syss = [make_system(i) for i in range(systems)]
+
+    for program in progs:
+        for system in syss:
+            program.add_system(system.uid)
+
+    db.insert_many(programs=progs, systems=syss)
+
+    index = 0
+    for program in progs:
+        for system in syss:
+            with db.batch() as batch:
+                for _ in range(observations):
+                    batch.insert_observation(make_observation(rng, program, system, index, stdout_lines, kernels))
+                    index += 1
+
+    db.close()
+    return {'programs': progs, 'systems': syss}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic experiment database')
+    parser.add_argument('database', help='path or URL of the database to fill')
+    parser.add_argument('--programs', default=10, type=int)
+    parser.add_argument('--systems', default=2, type=int)
+    parser.add_argument('--observations', default=5, type=int, help='observations per program and system')
+    parser.add_argument('--stdout-lines', default=200, type=int)
+    parser.add_argument('--kernels', default=40, type=int, help='GPU kernels per nvprof report')
+    parser.add_argument('--seed', default=0, type=int)
+    args = parser.parse_args()
+
+    generate(args.database, args.programs, args.systems, args.observations, args.stdout_lines, args.kernels, args.seed)
+
+
+if __name__ == '__main__':
+    main()